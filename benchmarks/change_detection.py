@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Benchmark: change detection and state reads of the StateRecorder.
+
+Compares the current implementations with the previous ones (the copies in
+``tests/test_change_detection.py``) and prints the number of SQL statements and
+the wall time of each.
+
+1. Change detection — ``changes_of_new_version`` with the hash-indexed FileIndex
+   against the nested loops over all stored and current files of a course.
+2. State reads      — ``get_stored_files``, ``get_old_files`` and
+   ``changes_to_notify`` with one query each against one query per course and
+   file, on a synthetic state database.
+
+Run locally:  python benchmarks/change_detection.py [--files 3000] [--courses 100] [--rows-per-course 200]
+"""
+
+import argparse
+import copy
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from moodle_dl.database import StateRecorder  # noqa: E402
+from moodle_dl.types import Course, File  # noqa: E402
+from tests.helpers import make_config  # noqa: E402
+from tests.test_change_detection import (  # noqa: E402
+    old_changes_to_notify,
+    old_get_modified_files,
+    old_get_new_files,
+    old_get_old_files,
+    old_get_stored_files,
+)
+
+
+def make_file(rnd: random.Random, idx: int) -> File:
+    return File(
+        module_id=idx // 10,
+        section_name=f'section{idx // 100}',
+        section_id=idx // 100,
+        module_name=f'module{idx // 10}',
+        content_filepath='/',
+        content_filename=f'file{idx}.pdf',
+        content_fileurl=f'https://moodle.example.org/pluginfile.php/{idx}/file{idx}.pdf',
+        content_filesize=rnd.randint(1, 10**7),
+        content_timemodified=rnd.randint(1, 10**9),
+        module_modname='resource',
+        content_type='file',
+        content_isexternalfile=False,
+        saved_to=f'/tmp/file{idx}.pdf',
+    )
+
+
+def measure(database: StateRecorder, function, *args):
+    "@return: The number of executed SQL statements and the wall time of a call"
+    statements = []
+    database.conn.set_trace_callback(statements.append)
+    start = time.perf_counter()
+    function(*args)
+    duration = time.perf_counter() - start
+    database.conn.set_trace_callback(None)
+    return len(statements), duration
+
+
+def report(name: str, old, new):
+    print(f'  {name:<20} {old[0]:>7} -> {new[0]:<4} queries  {old[1]:8.3f} s -> {new[1]:.3f} s')
+
+
+def bench_change_detection(database: StateRecorder, files: int):
+    rnd = random.Random(0)
+    stored = Course(1, 'course', [make_file(rnd, idx) for idx in range(files)])
+    current = Course(1, 'course', [copy.copy(file) for file in stored.files])
+    for file in rnd.sample(current.files, files // 10):
+        file.content_filesize += 1  # modified
+    for file in rnd.sample(current.files, files // 10):
+        file.content_filename = 'moved-' + file.content_filename  # moved
+    current.files = current.files[: files - files // 20]  # deleted
+    current.files += [make_file(rnd, files + idx) for idx in range(files // 10)]  # new
+
+    def run_old(current_courses, stored_courses):
+        old_get_new_files(old_get_modified_files(stored_courses, current_courses), stored_courses, current_courses)
+
+    print(f'Change detection of a course with {files} files:')
+    report(
+        'changes_of_new_version',
+        measure(database, run_old, copy.deepcopy([current]), copy.deepcopy([stored])),
+        measure(database, database.changes_of_new_version, copy.deepcopy([current]), copy.deepcopy([stored])),
+    )
+
+
+def fill_database(database: StateRecorder, courses: int, rows_per_course: int):
+    "Saves files of which some are modified, moved or deleted, as they would be after many runs"
+    rnd = random.Random(1)
+    for course_id in range(courses):
+        course = Course(course_id, f'course{course_id}')
+        for idx in range(rows_per_course):
+            database.new_file(make_file(rnd, idx), course.id, course.fullname)
+    database.flush()
+
+    for course in database.get_stored_files():
+        for stored_file in course.files:
+            dice = rnd.random()
+            if dice < 0.1:
+                new_file = copy.copy(stored_file)
+                new_file.content_filesize += 1
+                new_file.old_file = stored_file
+                database.modifie_file(new_file, course.id, course.fullname)
+            elif dice < 0.15:
+                new_file = copy.copy(stored_file)
+                new_file.content_filename = 'moved-' + new_file.content_filename
+                new_file.old_file = stored_file
+                database.move_file(new_file, course.id, course.fullname)
+            elif dice < 0.2:
+                database.delete_file(stored_file, course.id, course.fullname)
+    database.flush()
+
+    # Most changes are already notified
+    notified = [Course(course.id, course.fullname, course.files[::2]) for course in database.changes_to_notify()]
+    database.notified(notified)
+
+
+def bench_state_reads(database: StateRecorder, courses: int, rows_per_course: int):
+    fill_database(database, courses, rows_per_course)
+    rows = database.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    print(f'State reads of a database with {rows} rows in {courses} courses:')
+    for name, old_function, new_function in [
+        ('get_stored_files', old_get_stored_files, StateRecorder.get_stored_files),
+        ('get_old_files', old_get_old_files, StateRecorder.get_old_files),
+        ('changes_to_notify', old_changes_to_notify, StateRecorder.changes_to_notify),
+    ]:
+        report(name, measure(database, old_function, database), measure(database, new_function, database))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--files', type=int, default=3000, help='files of the course for the change detection')
+    parser.add_argument('--courses', type=int, default=100, help='courses of the state database')
+    parser.add_argument('--rows-per-course', type=int, default=200, help='saved files per course')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        opts, config_helper = make_config(Path(tmp_dir))
+        database = StateRecorder(config_helper, opts)
+        try:
+            bench_change_detection(database, args.files)
+            bench_state_reads(database, args.courses, args.rows_per_course)
+        finally:
+            database.close()
+
+
+if __name__ == '__main__':
+    main()
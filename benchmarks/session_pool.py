@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Benchmark: shared per-host sessions against one session per request.
+
+Downloads many small files over HTTPS from a local aiohttp server, once the way
+the download tasks did before the SessionPool (a new session and connector for
+the HEAD and for the GET request of every file, so a new TCP and TLS handshake
+each time) and once with the shared sessions of the SessionPool.
+
+Run locally:  python benchmarks/session_pool.py [--files 2000] [--size 20000] [--parallel 5]
+
+Requires the ``openssl`` command to create a self-signed certificate for the
+local server.
+"""
+
+import argparse
+import asyncio
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from moodle_dl.downloader.session_pool import SessionPool  # noqa: E402
+from moodle_dl.utils import SslHelper  # noqa: E402
+from tests.helpers import make_config  # noqa: E402
+
+
+def create_certificate(tmp_dir: Path) -> ssl.SSLContext:
+    cert_file, key_file = tmp_dir / 'cert.pem', tmp_dir / 'key.pem'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1']
+        + ['-keyout', str(key_file), '-out', str(cert_file)],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def start_server(server_ssl: ssl.SSLContext, size: int) -> str:
+    "Serves files of the given size in a background thread and returns the base URL"
+    body = b'x' * size
+
+    async def handler(request):
+        return web.Response(body=body)
+
+    async def start() -> str:
+        app = web.Application()
+        app.router.add_route('*', '/f/{name}', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0, ssl_context=server_ssl).start()
+        return f'https://127.0.0.1:{runner.addresses[0][1]}'
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(start(), loop).result()
+
+
+async def fetch(session: aiohttp.ClientSession, url: str):
+    async with session.request('HEAD', url) as resp:
+        await resp.read()
+    async with session.request('GET', url) as resp:
+        await resp.read()
+
+
+async def download_all(urls, parallel: int, download):
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def limited(url):
+        async with semaphore:
+            await download(url)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(url) for url in urls])
+    return time.perf_counter() - start
+
+
+async def run_per_request(urls, parallel: int, ssl_context: ssl.SSLContext) -> float:
+    async def new_session():
+        connector = aiohttp.TCPConnector(resolver=aiohttp.AsyncResolver(), ssl=ssl_context)
+        return aiohttp.ClientSession(connector=connector, raise_for_status=True)
+
+    async def download(url):
+        async with await new_session() as session:
+            async with session.request('HEAD', url) as resp:
+                await resp.read()
+        async with await new_session() as session:
+            async with session.request('GET', url) as resp:
+                await resp.read()
+
+    return await download_all(urls, parallel, download)
+
+
+async def run_pooled(urls, parallel: int, opts) -> float:
+    session_pool = SessionPool(opts)
+
+    async def download(url):
+        await fetch(session_pool.get_session(url, False), url)
+
+    try:
+        return await download_all(urls, parallel, download)
+    finally:
+        await session_pool.close()
+
+
+def report(name: str, files: int, duration: float):
+    print(f'  {name:<12} {duration:7.2f} s ({files / duration:.0f} files/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--files', type=int, default=2000, help='number of downloaded files')
+    parser.add_argument('--size', type=int, default=20000, help='size of each file in bytes')
+    parser.add_argument('--parallel', type=int, default=5, help='parallel downloads')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_url = start_server(create_certificate(Path(tmp_dir)), args.size)
+        opts, _ = make_config(Path(tmp_dir), ['-scv', '-mcph', str(args.parallel)])
+        ssl_context = SslHelper.get_ssl_context(opts.skip_cert_verify, opts.allow_insecure_ssl, opts.use_all_ciphers)
+        urls = [f'{base_url}/f/{idx}' for idx in range(args.files)]
+
+        print(f'{args.files} files of {args.size} bytes over HTTPS, {args.parallel} parallel downloads:')
+        report('per request', args.files, asyncio.run(run_per_request(urls, args.parallel, ssl_context)))
+        report('pooled', args.files, asyncio.run(run_pooled(urls, args.parallel, opts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
 
 from moodle_dl.config import ConfigHelper
 from moodle_dl.database import StateRecorder
@@ -8,6 +10,10 @@ from moodle_dl.utils import Cutie, Log
 
 
 class DatabaseManager:
+    SCAN_WORKERS = 16  # parallel directory scans and hash checks
+    MTIME_TOLERANCE = 2  # seconds; file systems like FAT store the modification time coarsely
+    MAX_LISTED_FILES = 20  # files listed per problem, unless verbose
+
     def __init__(self, config: ConfigHelper, opts: MoodleDlOpts):
         self.config = config
         self.opts = opts
@@ -200,3 +206,158 @@ class DatabaseManager:
                     os.remove(files[file_index].saved_to)
 
         self.state_recorder.batch_delete_files_from_db(files_to_delete)
+
+    @staticmethod
+    def scan_directory(dir_path: str) -> Tuple[Dict[str, os.stat_result], List[str]]:
+        """
+        Lists one directory. This is blocking, run it in an executor.
+        @return: The files with their stat results and the sub directories
+        """
+        files = {}
+        sub_dirs = []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(entry.path)
+                        elif entry.is_file():
+                            files[entry.path] = entry.stat()
+                    except OSError:
+                        continue
+        except OSError as err:
+            Log.warning(f'Could not scan {dir_path}: {err}')
+        return files, sub_dirs
+
+    def scan_download_tree(self, download_path: str) -> Dict[str, os.stat_result]:
+        """
+        Walks the download tree, the directories are scanned in parallel.
+        Files directly in the download path are not part of a course (config, database, logs) and are skipped.
+        @return: All files below the course directories with their stat results, keyed by the normalized path
+        """
+        local_files = {}
+        _, course_dirs = self.scan_directory(download_path)
+        with ThreadPoolExecutor(max_workers=self.SCAN_WORKERS) as executor:
+            pending = {executor.submit(self.scan_directory, dir_path) for dir_path in course_dirs}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, sub_dirs = future.result()
+                    for file_path, file_stat in files.items():
+                        local_files[self.normalize_path(file_path)] = file_stat
+                    pending.update(executor.submit(self.scan_directory, dir_path) for dir_path in sub_dirs)
+        return local_files
+
+    @staticmethod
+    def normalize_path(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    @staticmethod
+    def has_expected_hash(file: File) -> bool:
+        "Hashes a local file and compares it with the stored hash. This is blocking, run it in an executor."
+        from moodle_dl.downloader.task import Task
+
+        try:
+            hasher, _ = Task.hash_file(file.saved_to)
+        except OSError:
+            return False
+        return hasher.hexdigest() == file.content_hash
+
+    def print_files(self, title: str, paths: List[str]):
+        if len(paths) == 0:
+            return
+        Log.warning(f'{title}: {len(paths)}')
+        shown_paths = paths if self.opts.verbose else paths[: self.MAX_LISTED_FILES]
+        for path in shown_paths:
+            print(f'    {path}')
+        if len(shown_paths) < len(paths):
+            print(f'    ... and {len(paths) - len(shown_paths)} more (use --verbose to list all)')
+
+    def verify_local_files(self):
+        """
+        Compares the downloaded files with the database without asking anything. Each stored file is checked
+        for existence, modification time, size and, with --verify-hashes, its content hash. Files that were
+        changed after their download are only reported. Local files that are not known to the database are
+        reported as orphaned, but never deleted.
+        With --requeue-broken-files, missing, truncated and corrupt files are removed from the database and
+        their courses are synced completely again, so that the next run downloads them again. Locally changed
+        files are never requeued.
+        """
+        download_path = self.config.get_download_path()
+        stored_files = MoodleService.filter_courses(self.state_recorder.get_stored_files(), self.config)
+
+        print(f'Scanning {download_path} ...')
+        local_files = self.scan_download_tree(download_path)
+
+        missing = set()
+        truncated = []
+        changed = []
+        to_hash = []
+        broken_files: Dict[int, List[File]] = {}
+        for course in stored_files:
+            for course_file in course.files:
+                if not course_file.saved_to:
+                    continue
+                file_stat = local_files.get(self.normalize_path(course_file.saved_to))
+                if file_stat is None:
+                    file_stat = self.stat_file(course_file.saved_to)
+                if file_stat is None:
+                    if course_file.content_size == 0:
+                        # Empty descriptions are not stored
+                        continue
+                    missing.add(course_file.saved_to)
+                    broken_files.setdefault(course.id, []).append(course_file)
+                elif 0 < course_file.time_stamp < file_stat.st_mtime - self.MTIME_TOLERANCE:
+                    # Edited after the download (e.g. an annotated PDF), its size and content differ on purpose.
+                    # It is only reported and never requeued, so that the edits are not lost.
+                    changed.append(course_file.saved_to)
+                elif course_file.content_size is not None and file_stat.st_size != course_file.content_size:
+                    truncated.append(course_file.saved_to)
+                    broken_files.setdefault(course.id, []).append(course_file)
+                elif self.opts.verify_hashes and course_file.content_hash is not None:
+                    to_hash.append((course.id, course_file))
+
+        corrupt = []
+        if len(to_hash) > 0:
+            print(f'Verifying the content of {len(to_hash)} files ...')
+            with ThreadPoolExecutor(max_workers=self.SCAN_WORKERS) as executor:
+                results = executor.map(self.has_expected_hash, [course_file for _, course_file in to_hash])
+                for (course_id, course_file), is_intact in zip(to_hash, results):
+                    if not is_intact:
+                        corrupt.append(course_file.saved_to)
+                        broken_files.setdefault(course_id, []).append(course_file)
+
+        known_paths = {self.normalize_path(path) for path in self.state_recorder.get_saved_paths()}
+        orphaned = sorted(path for path in local_files if path not in known_paths)
+
+        checked_count = sum(len(course.files) for course in stored_files)
+        print(f'Checked {checked_count} stored files against {len(local_files)} local files')
+        self.print_files('Missing files', sorted(missing))
+        self.print_files('Truncated files (size differs from the download)', truncated)
+        self.print_files('Corrupt files (content differs from the download)', corrupt)
+        self.print_files('Locally changed files (newer than the download)', changed)
+        self.print_files('Orphaned files (unknown to the database)', orphaned)
+
+        if len(broken_files) == 0:
+            Log.success('All stored files are intact.')
+            return
+
+        if not self.opts.requeue_broken_files:
+            Log.info('Use --requeue-broken-files to download missing, truncated and corrupt files again.')
+            return
+
+        files_to_requeue = [course_file for course_files in broken_files.values() for course_file in course_files]
+        for course_file in files_to_requeue:
+            if course_file.saved_to not in missing and os.path.exists(course_file.saved_to):
+                os.remove(course_file.saved_to)
+        self.state_recorder.batch_delete_files_from_db(files_to_requeue)
+        self.state_recorder.forget_course_syncs(list(broken_files.keys()))
+        Log.success(f'{len(files_to_requeue)} files will be downloaded again in the next run.')
+
+    @staticmethod
+    def stat_file(path: str) -> os.stat_result:
+        "Fallback for files outside of the course directories; @return: None if the file does not exist"
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
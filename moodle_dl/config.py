@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import sys
@@ -79,6 +80,15 @@ class ConfigHelper:
             #                           ^ behavior if the key is not present
             self._save()
 
+    def get_config_hash(self, ignored_keys: List[str] = None) -> str:
+        # return a hash of the whole configuration, to detect changes of the configuration
+        with self._lock:
+            relevant_config = {
+                key: value for key, value in self._whole_config.items() if key not in (ignored_keys or [])
+            }
+            config_raw = json.dumps(relevant_config, sort_keys=True)
+        return hashlib.sha256(config_raw.encode('utf-8')).hexdigest()
+
     # ---------------------------- GETTERS ------------------------------------
 
     def get_download_submissions(self) -> str:
@@ -235,6 +245,18 @@ class ConfigHelper:
         # return if files for which a cookie is required should be downloaded
         return self.get_property_or('download_also_with_cookie', False)
 
+    def get_database_write_batch_size(self) -> int:
+        # return how many file changes are committed together to the database
+        return self.get_property_or('database_write_batch_size', 100)
+
+    def get_incremental_sync_max_age(self) -> int:
+        # return after how many seconds all courses are fetched again completely, even with incremental sync
+        return self.get_property_or('incremental_sync_max_age', 24 * 60 * 60)
+
+    def get_deduplicate_files(self) -> bool:
+        # return if files with the same content should be linked instead of downloaded and stored again
+        return self.get_property_or('deduplicate_files', False)
+
     def get_write_links(self) -> Dict:
         # returns what kind of shortcuts should be created
         write_links = {
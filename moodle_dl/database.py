@@ -1,10 +1,15 @@
+import asyncio
+import collections
+import copy
 import logging
+import queue
 import sqlite3
+import threading
 from sqlite3 import Error
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from moodle_dl.config import ConfigHelper
-from moodle_dl.types import Course, File, MoodleDlOpts
+from moodle_dl.types import Course, File, HttpValidator, MoodleDlOpts, PartialDownload
 from moodle_dl.utils import PathTools as PT
 
 
@@ -14,6 +19,28 @@ class StateRecorder:
     state against the previous.
     """
 
+    # Queries of which the plans are reported, if they change during a migration
+    HOT_QUERIES = {
+        'stored files': (
+            'SELECT * FROM files WHERE deleted = 0 AND modified = 0 AND moved = 0 ORDER BY course_id, file_id'
+        ),
+        'old files': (
+            'SELECT old.* FROM files new JOIN files old ON old.file_id = new.old_file_id'
+            + ' WHERE new.old_file_id IS NOT NULL ORDER BY new.course_id, new.file_id'
+        ),
+        'files to notify': 'SELECT * FROM files WHERE notified = 0 ORDER BY course_id, file_id',
+        'new files to notify': (
+            'SELECT * FROM files WHERE old_file_id IN'
+            + ' (SELECT file_id FROM files WHERE notified = 0 AND (modified = 1 OR moved = 1)) ORDER BY file_id'
+        ),
+        'forum timestamps': (
+            'SELECT module_id, max(content_timemodified) FROM files'
+            + " WHERE module_modname = 'forum' AND content_type = 'description' GROUP BY module_id"
+        ),
+        'unlink old file': 'UPDATE files SET old_file_id = NULL WHERE old_file_id = 1',
+        'update file': 'UPDATE files SET notified = 1 WHERE file_id = 1',
+    }
+
     def __init__(self, config: ConfigHelper, opts: MoodleDlOpts):
         """
         Initiates the database.
@@ -23,9 +50,20 @@ class StateRecorder:
         self.opts = opts
         self.db_file = PT.make_path(config.get_misc_files_path(), 'moodle_state.db')
 
-        try:
-            conn = sqlite3.connect(self.db_file)
+        self.write_batch_size = max(1, config.get_database_write_batch_size())
+        self.pending_writes = 0
+        self.lock = threading.RLock()
 
+        try:
+            # One connection is used for the whole lifetime of the recorder, so that compiled statements are cached
+            # and not every call pays for opening the database. It can be shared between threads, all access is
+            # serialized by the lock.
+            self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            # With a write-ahead log, commits are cheap appends and readers do not block the writer
+            self.conn.execute('PRAGMA journal_mode=WAL;')
+
+            conn = self.conn
             c = conn.cursor()
 
             sql_create_index_table = """ CREATE TABLE IF NOT EXISTS files (
@@ -172,14 +210,162 @@ class StateRecorder:
                 current_version = 5
                 conn.commit()
 
+            if current_version == 5:
+                # Add indexes for the frequent queries. The file_id is the rowid, so it is already part of every index
+                plans_before = self.get_query_plans(c)
+
+                sql_create_current_files_index = """
+                CREATE INDEX IF NOT EXISTS idx_current_files
+                ON files (course_id)
+                WHERE deleted = 0 AND modified = 0 AND moved = 0;
+                """
+
+                sql_create_old_file_id_index = """
+                CREATE INDEX IF NOT EXISTS idx_old_file_id
+                ON files (old_file_id)
+                WHERE old_file_id IS NOT NULL;
+                """
+
+                sql_create_not_notified_index = """
+                CREATE INDEX IF NOT EXISTS idx_not_notified
+                ON files (course_id)
+                WHERE notified = 0;
+                """
+
+                sql_create_mod_timestamp_index = """
+                CREATE INDEX IF NOT EXISTS idx_mod_timestamp
+                ON files (module_modname, content_type, module_id, content_timemodified);
+                """
+
+                c.execute(sql_create_current_files_index)
+                c.execute(sql_create_old_file_id_index)
+                c.execute(sql_create_not_notified_index)
+                c.execute(sql_create_mod_timestamp_index)
+                c.execute('ANALYZE;')
+
+                c.execute('PRAGMA user_version = 6;')
+                current_version = 6
+                conn.commit()
+
+                self.log_changed_query_plans(plans_before, self.get_query_plans(c))
+
+            if current_version == 6:
+                # Add table for the incremental sync of courses
+                sql_create_course_syncs_table = """
+                CREATE TABLE IF NOT EXISTS course_syncs (
+                course_id integer PRIMARY KEY,
+                last_sync integer NOT NULL,
+                config_hash text NOT NULL
+                );"""
+                c.execute(sql_create_course_syncs_table)
+
+                c.execute('PRAGMA user_version = 7;')
+                current_version = 7
+                conn.commit()
+
+            if current_version == 7:
+                # Add table for downloads that can be continued in the next run
+                sql_create_partial_downloads_table = """
+                CREATE TABLE IF NOT EXISTS partial_downloads (
+                url_key text PRIMARY KEY,
+                part_path text NOT NULL,
+                bytes_received integer NOT NULL,
+                etag text NULL,
+                last_modified text NULL,
+                time_stamp integer NOT NULL
+                );"""
+                c.execute(sql_create_partial_downloads_table)
+
+                c.execute('PRAGMA user_version = 8;')
+                current_version = 8
+                conn.commit()
+
+            if current_version == 8:
+                # Add table for the validators of downloaded URLs, to send conditional requests
+                sql_create_http_validators_table = """
+                CREATE TABLE IF NOT EXISTS http_validators (
+                url_key text PRIMARY KEY,
+                etag text NULL,
+                last_modified text NULL,
+                content_length integer NULL,
+                content_type text NULL,
+                saved_to text NOT NULL,
+                time_stamp integer NOT NULL
+                );"""
+                c.execute(sql_create_http_validators_table)
+
+                c.execute('PRAGMA user_version = 9;')
+                current_version = 9
+                conn.commit()
+
+            if current_version == 9:
+                # Add hash of the downloaded content, to find files with the same content
+                c.execute('ALTER TABLE files ADD COLUMN content_hash text NULL;')
+
+                c.execute('PRAGMA user_version = 10;')
+                current_version = 10
+                conn.commit()
+
+            if current_version == 10:
+                # Add size of the downloaded content
+                c.execute('ALTER TABLE files ADD COLUMN content_size integer NULL;')
+
+                c.execute('PRAGMA user_version = 11;')
+                current_version = 11
+                conn.commit()
+
             conn.commit()
             logging.debug('Database Version: %s', str(current_version))
 
-            conn.close()
-
         except Error as error:
             raise RuntimeError(f'Could not create database! Error: {error}') from error
 
+    @classmethod
+    def get_query_plans(cls, cursor: sqlite3.Cursor) -> Dict[str, str]:
+        plans = {}
+        for name, sql in cls.HOT_QUERIES.items():
+            plan_rows = cursor.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            plans[name] = '; '.join(plan_row[3] for plan_row in plan_rows)
+        return plans
+
+    @staticmethod
+    def log_changed_query_plans(plans_before: Dict[str, str], plans_after: Dict[str, str]):
+        for name, plan_after in plans_after.items():
+            if plans_before.get(name) != plan_after:
+                logging.debug('Query plan of %s changed from "%s" to "%s"', name, plans_before.get(name), plan_after)
+
+    def write_done(self, count: int = 1):
+        """
+        Registers finished writes. They are committed together, as soon as a batch is full,
+        so that not every single file costs a transaction (and a sync to disk).
+        A crash only loses the writes of the current batch, all committed batches are safe.
+        """
+        with self.lock:
+            self.pending_writes += count
+            if self.pending_writes >= self.write_batch_size:
+                self.flush()
+
+    def flush(self):
+        "Commits all pending writes"
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        "Commits all pending writes and closes the database connection"
+        with self.lock:
+            self.flush()
+            # Let SQLite update its statistics, if the indexes are used differently than the last time
+            self.conn.execute('PRAGMA optimize;')
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @staticmethod
     def files_have_same_type(file1: File, file2: File) -> bool:
         # Returns True if the files have the same type attributes
@@ -275,104 +461,64 @@ class StateRecorder:
 
         return False
 
-    def get_stored_files(self) -> List[Course]:
-        # get all stored files (that are not yet deleted)
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        stored_courses = []
-
-        cursor.execute(
-            """SELECT course_id, course_fullname
-            FROM files WHERE deleted = 0 AND modified = 0 AND moved = 0
-            GROUP BY course_id;"""
-        )
-
-        curse_rows = cursor.fetchall()
+    @staticmethod
+    def group_files_by_course(
+        rows: List[sqlite3.Row], course_id_key: str = 'course_id', fullname_key: str = 'course_fullname'
+    ) -> List[Course]:
+        """
+        Builds the courses of file rows, the courses and the files keep the order of the rows.
+        @param course_id_key: The column that holds the course id of a row
+        @param fullname_key: The column that holds the course name of a row, the last row of a course wins
+        """
+        courses = {}
+        fullnames = {}
+        for row in rows:
+            course_id = row[course_id_key]
+            courses.setdefault(course_id, []).append(File.fromRow(row))
+            fullnames[course_id] = row[fullname_key]
 
-        for course_row in curse_rows:
-            course = Course(course_row['course_id'], course_row['course_fullname'])
+        return [Course(course_id, fullnames[course_id], files) for course_id, files in courses.items()]
 
+    def get_stored_files(self) -> List[Course]:
+        # get all stored files (that are not yet deleted)
+        with self.lock:
+            cursor = self.conn.cursor()
             cursor.execute(
                 """SELECT *
                 FROM files
                 WHERE deleted = 0
                 AND modified = 0
                 AND moved = 0
-                AND course_id = ?;""",
-                (course.id,),
+                ORDER BY course_id, file_id;"""
             )
 
-            file_rows = cursor.fetchall()
-
-            course.files = []
-
-            for file_row in file_rows:
-                notify_file = File.fromRow(file_row)
-                course.files.append(notify_file)
-
-            stored_courses.append(course)
-
-        conn.close()
-        return stored_courses
+            return self.group_files_by_course(cursor.fetchall())
 
     def get_old_files(self) -> List[Course]:
-        # get all stored files (that are not yet deleted)
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        stored_courses = []
-
-        cursor.execute(
-            """SELECT DISTINCT course_id, course_fullname
-            FROM files WHERE old_file_id IS NOT NULL"""
-        )
-
-        course_rows = cursor.fetchall()
-        for course_row in course_rows:
-            course = Course(course_row['course_id'], course_row['course_fullname'])
-
+        # get all files that were replaced by a newer version, in the course of the newer version
+        with self.lock:
+            cursor = self.conn.cursor()
             cursor.execute(
-                """SELECT *
-                FROM files
-                WHERE course_id = ?
-                AND old_file_id IS NOT NULL""",
-                (course.id,),
+                """SELECT old.*,
+                new.course_id AS new_course_id, new.course_fullname AS new_course_fullname
+                FROM files new
+                JOIN files old ON old.file_id = new.old_file_id
+                WHERE new.old_file_id IS NOT NULL
+                ORDER BY new.old_file_id, new.file_id;"""
             )
 
-            updated_files = cursor.fetchall()
-
-            course.files = []
-
-            for updated_file in updated_files:
-                cursor.execute(
-                    """SELECT *
-                    FROM files
-                    WHERE file_id = ?""",
-                    (updated_file['old_file_id'],),
-                )
-
-                old_file = cursor.fetchone()
-
-                notify_file = File.fromRow(old_file)
-                course.files.append(notify_file)
-
-            stored_courses.append(course)
-
-        conn.close()
-        return stored_courses
+            return self.group_files_by_course(cursor.fetchall(), 'new_course_id', 'new_course_fullname')
 
     def get_modified_files(self, stored_courses: List[Course], current_courses: List[Course]) -> List[Course]:
         # returns courses with modified and deleted files
         changed_courses = []
 
-        for stored_course in stored_courses:
-            same_course_in_current = None
+        current_courses_by_id = {}
+        for current_course in current_courses:
+            current_courses_by_id.setdefault(current_course.id, current_course)
 
-            for current_course in current_courses:
-                if current_course.id == stored_course.id:
-                    same_course_in_current = current_course
-                    break
+        for stored_course in stored_courses:
+            same_course_in_current = current_courses_by_id.get(stored_course.id)
 
             if same_course_in_current is None:
                 # stroed_course does not exist anymore!
@@ -390,15 +536,10 @@ class StateRecorder:
             # so try to find removed files, that are still exist in storage
             # also find modified files
             changed_course = Course(stored_course.id, stored_course.fullname)
+            current_files_index = FileIndex(same_course_in_current.files)
             for stored_file in stored_course.files:
-                matching_file = None
-
-                for current_file in same_course_in_current.files:
-                    # Try to find a matching file with same path
-                    if self.files_have_same_path(current_file, stored_file):
-                        matching_file = current_file
-                        # file does still exist
-                        break
+                # Try to find a matching file with same path
+                matching_file = current_files_index.find_file_with_same_path(stored_file)
 
                 if matching_file is not None:
                     # An matching file was found
@@ -413,13 +554,7 @@ class StateRecorder:
 
                 # No matching file was found --> file was deleted or moved
                 # check for moved files
-
-                for current_file in same_course_in_current.files:
-                    # Try to find a matching file that was moved
-                    if self.file_was_moved(current_file, stored_file):
-                        matching_file = current_file
-                        # file does still exist
-                        break
+                matching_file = current_files_index.find_moved_file(stored_file)
 
                 if matching_file is None and not self.ignore_deleted(stored_file):
                     # No matching file was found --> file was deleted
@@ -441,52 +576,49 @@ class StateRecorder:
         self, changed_courses: List[Course], stored_courses: List[Course], current_courses: List[Course]
     ) -> List[Course]:
         # check for new files
-        for current_course in current_courses:
-            # check if that file does not exist in stored
+        stored_courses_by_id = {}
+        for stored_course in stored_courses:
+            stored_courses_by_id.setdefault(stored_course.id, stored_course)
 
-            same_course_in_stored = None
+        changed_courses_by_id = {}
+        for ch_course in changed_courses:
+            changed_courses_by_id.setdefault(ch_course.id, ch_course)
 
-            for stored_course in stored_courses:
-                if stored_course.id == current_course.id:
-                    same_course_in_stored = stored_course
-                    break
+        for current_course in current_courses:
+            # check if that file does not exist in stored
+            same_course_in_stored = stored_courses_by_id.get(current_course.id)
 
             if same_course_in_stored is None:
                 # current_course is not saved yet
 
                 changed_courses.append(current_course)
+                changed_courses_by_id.setdefault(current_course.id, current_course)
                 # skip the next checks!
                 continue
 
             changed_course = Course(current_course.id, current_course.fullname)
+            stored_files_index = FileIndex(same_course_in_stored.files)
             for current_file in current_course.files:
-                matching_file = None
-
-                for stored_file in same_course_in_stored.files:
-                    # Try to find a matching file
-                    has_same_path = self.files_have_same_path(current_file, stored_file)
-                    was_moved = self.file_was_moved(current_file, stored_file)
-                    if has_same_path or was_moved:
-                        matching_file = current_file
-                        break
-
-                if matching_file is None:
+                # Try to find a matching file
+                if (
+                    stored_files_index.find_file_with_same_path(current_file) is None
+                    and stored_files_index.find_moved_file(current_file) is None
+                ):
                     # current_file is a new file
                     changed_course.files.append(current_file)
 
             if len(changed_course.files) > 0:
-                matched_changed_course = None
-                for ch_course in changed_courses:
-                    if ch_course.id == changed_course.id:
-                        matched_changed_course = ch_course
-                        break
+                matched_changed_course = changed_courses_by_id.get(changed_course.id)
                 if matched_changed_course is None:
                     changed_courses.append(changed_course)
+                    changed_courses_by_id[changed_course.id] = changed_course
                 else:
                     matched_changed_course.files += changed_course.files
         return changed_courses
 
-    def changes_of_new_version(self, current_courses: List[Course]) -> List[Course]:
+    def changes_of_new_version(
+        self, current_courses: List[Course], stored_courses: List[Course] = None
+    ) -> List[Course]:
         # all changes are stored inside changed_courses,
         # as a list of changed courses
         changed_courses = []
@@ -501,7 +633,8 @@ class StateRecorder:
         # later check for new files
 
         # first get all stored files (that are not yet deleted)
-        stored_courses = self.get_stored_files()
+        if stored_courses is None:
+            stored_courses = self.get_stored_files()
 
         changed_courses = self.get_modified_files(stored_courses, current_courses)
         # ----------------------------------------------------------
@@ -523,110 +656,230 @@ class StateRecorder:
         }
         """
 
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        mod_forum_dict = {}
-        mod_calendar_dict = {}
-
-        cursor.execute(
-            """SELECT module_id, max(content_timemodified) as content_timemodified
-            FROM files WHERE module_modname = 'forum' AND content_type = 'description'
-            GROUP BY module_id;"""
-        )
+        with self.lock:
+            cursor = self.conn.cursor()
+            mod_forum_dict = {}
+            mod_calendar_dict = {}
 
-        curse_rows = cursor.fetchall()
+            cursor.execute(
+                """SELECT module_id, max(content_timemodified) as content_timemodified
+                FROM files WHERE module_modname = 'forum' AND content_type = 'description'
+                GROUP BY module_id;"""
+            )
 
-        for course_row in curse_rows:
-            mod_forum_dict[course_row['module_id']] = course_row['content_timemodified']
+            curse_rows = cursor.fetchall()
 
-        cursor.execute(
-            """SELECT module_id, max(content_timemodified) as content_timemodified
-            FROM files WHERE module_modname = 'calendar' AND content_type = 'html'
-            GROUP BY module_id;"""
-        )
+            for course_row in curse_rows:
+                mod_forum_dict[course_row['module_id']] = course_row['content_timemodified']
 
-        course_row = cursor.fetchone()
-        if course_row is not None:
-            mod_calendar_dict[course_row['module_id']] = course_row['content_timemodified']
+            cursor.execute(
+                """SELECT module_id, max(content_timemodified) as content_timemodified
+                FROM files WHERE module_modname = 'calendar' AND content_type = 'html'
+                GROUP BY module_id;"""
+            )
 
-        conn.close()
+            course_row = cursor.fetchone()
+            if course_row is not None:
+                mod_calendar_dict[course_row['module_id']] = course_row['content_timemodified']
 
-        return {'forum': mod_forum_dict, 'calendar': mod_calendar_dict}
+            return {'forum': mod_forum_dict, 'calendar': mod_calendar_dict}
 
     def changes_to_notify(self) -> List[Course]:
-        changed_courses = []
-
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """SELECT course_id, course_fullname
-            FROM files WHERE notified = 0 GROUP BY course_id;"""
-        )
-
-        curse_rows = cursor.fetchall()
-
-        for course_row in curse_rows:
-            course = Course(course_row['course_id'], course_row['course_fullname'])
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """SELECT *
+                FROM files WHERE notified = 0
+                ORDER BY course_id, file_id;"""
+            )
+            changed_courses = self.group_files_by_course(cursor.fetchall())
 
+            # add reference to new files of all modified and moved files
             cursor.execute(
                 """SELECT *
-                FROM files WHERE notified = 0 AND course_id = ?;""",
-                (course.id,),
+                FROM files
+                WHERE old_file_id IN (
+                    SELECT file_id FROM files WHERE notified = 0 AND (modified = 1 OR moved = 1)
+                )
+                ORDER BY file_id;"""
             )
+            new_files = {}
+            for file_row in cursor.fetchall():
+                new_files.setdefault(file_row['old_file_id'], file_row)
 
-            file_rows = cursor.fetchall()
+            for course in changed_courses:
+                for notify_file in course.files:
+                    if notify_file.modified or notify_file.moved:
+                        file_row = new_files.get(notify_file.file_id)
+                        if file_row is not None:
+                            notify_file.new_file = File.fromRow(file_row)
 
-            course.files = []
+            return changed_courses
 
-            for file_row in file_rows:
-                notify_file = File.fromRow(file_row)
-                if notify_file.modified or notify_file.moved:
-                    # add reference to new file
+    def notified(self, courses: List[Course]):
+        # saves that a notification with the changes where send
+
+        with self.lock:
+            cursor = self.conn.cursor()
+
+            for course in courses:
+                course_id = course.id
+
+                for file in course.files:
+                    data = {'course_id': course_id}
+                    data.update(file.getMap())
 
                     cursor.execute(
-                        """SELECT *
-                        FROM files
-                        WHERE old_file_id = ?;""",
-                        (notify_file.file_id,),
+                        """UPDATE files
+                        SET notified = 1
+                        WHERE file_id = :file_id;
+                        """,
+                        data,
                     )
 
-                    file_row = cursor.fetchone()
-                    if file_row is not None:
-                        notify_file.new_file = File.fromRow(file_row)
+            self.flush()
 
-                course.files.append(notify_file)
+    def get_course_syncs(self) -> Dict[int, Dict]:
+        """
+        Returns the last sync of every course, indexed by course id
+        Like: {123: {'last_sync': 1700000000, 'config_hash': 'ab12...'}}
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT course_id, last_sync, config_hash FROM course_syncs;')
 
-            changed_courses.append(course)
+            return {
+                sync_row['course_id']: {'last_sync': sync_row['last_sync'], 'config_hash': sync_row['config_hash']}
+                for sync_row in cursor.fetchall()
+            }
 
-        conn.close()
-        return changed_courses
+    def courses_synced(self, course_ids: List[int], last_sync: int, config_hash: str):
+        # saves that all changes of the courses until last_sync are stored
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                """INSERT OR REPLACE INTO course_syncs (course_id, last_sync, config_hash)
+                VALUES (?, ?, ?);""",
+                [(course_id, last_sync, config_hash) for course_id in course_ids],
+            )
 
-    def notified(self, courses: List[Course]):
-        # saves that a notification with the changes where send
+            self.flush()
+
+    def get_partial_downloads(self) -> Dict[str, PartialDownload]:
+        "Returns all downloads that can be continued, indexed by their url key"
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM partial_downloads;')
+
+            return {
+                partial_row['url_key']: PartialDownload(
+                    url_key=partial_row['url_key'],
+                    part_path=partial_row['part_path'],
+                    bytes_received=partial_row['bytes_received'],
+                    etag=partial_row['etag'],
+                    last_modified=partial_row['last_modified'],
+                    time_stamp=partial_row['time_stamp'],
+                )
+                for partial_row in cursor.fetchall()
+            }
 
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def save_partial_download(self, partial: PartialDownload):
+        # remembers a download that can be continued in the next run
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """INSERT OR REPLACE INTO partial_downloads
+                (url_key, part_path, bytes_received, etag, last_modified, time_stamp)
+                VALUES (?, ?, ?, ?, ?, ?);""",
+                (
+                    partial.url_key,
+                    partial.part_path,
+                    partial.bytes_received,
+                    partial.etag,
+                    partial.last_modified,
+                    partial.time_stamp,
+                ),
+            )
 
-        for course in courses:
-            course_id = course.id
+            self.write_done()
 
-            for file in course.files:
-                data = {'course_id': course_id}
-                data.update(file.getMap())
+    def delete_partial_download(self, url_key: str):
+        # forgets a download, after it was finished or can not be continued
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM partial_downloads WHERE url_key = ?;', (url_key,))
 
-                cursor.execute(
-                    """UPDATE files
-                    SET notified = 1
-                    WHERE file_id = :file_id;
-                    """,
-                    data,
+            self.write_done()
+
+    def get_saved_paths(self) -> List[str]:
+        "Returns the paths of all files that are referenced in the database, also of old copies and partial downloads"
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """SELECT saved_to FROM files WHERE saved_to IS NOT NULL AND saved_to != ''
+                UNION SELECT part_path FROM partial_downloads;"""
+            )
+            return [path_row[0] for path_row in cursor.fetchall()]
+
+    def get_files_with_content_hash(self) -> List[sqlite3.Row]:
+        "Returns the location and identity of all files with a known content hash, the newest files last"
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """SELECT saved_to, content_filesize, content_fileurl, content_timemodified, content_hash,
+                content_size FROM files WHERE content_hash IS NOT NULL ORDER BY file_id;"""
+            )
+            return cursor.fetchall()
+
+    def get_http_validators(self) -> Dict[str, HttpValidator]:
+        "Returns the validators of all downloaded URLs, indexed by their url key"
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM http_validators;')
+
+            return {
+                validator_row['url_key']: HttpValidator(
+                    url_key=validator_row['url_key'],
+                    etag=validator_row['etag'],
+                    last_modified=validator_row['last_modified'],
+                    content_length=validator_row['content_length'],
+                    content_type=validator_row['content_type'],
+                    saved_to=validator_row['saved_to'],
+                    time_stamp=validator_row['time_stamp'],
                 )
+                for validator_row in cursor.fetchall()
+            }
+
+    def save_http_validator(self, validator: HttpValidator):
+        # remembers the validator of a downloaded URL
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """INSERT OR REPLACE INTO http_validators
+                (url_key, etag, last_modified, content_length, content_type, saved_to, time_stamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?);""",
+                (
+                    validator.url_key,
+                    validator.etag,
+                    validator.last_modified,
+                    validator.content_length,
+                    validator.content_type,
+                    validator.saved_to,
+                    validator.time_stamp,
+                ),
+            )
+
+            self.write_done()
 
-        conn.commit()
-        conn.close()
+    def forget_course_syncs(self, course_ids: List[int]):
+        # lets the incremental sync fetch these courses again completely
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                'DELETE FROM course_syncs WHERE course_id = ?;', [(course_id,) for course_id in course_ids]
+            )
+
+            self.flush()
 
     def save_file(self, file: File, course_id: int, course_fullname: str):
         if file.deleted:
@@ -641,151 +894,401 @@ class StateRecorder:
     def new_file(self, file: File, course_id: int, course_fullname: str):
         # saves a file to index
 
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
 
-        data = {'course_id': course_id, 'course_fullname': course_fullname}
-        data.update(file.getMap())
+            data = {'course_id': course_id, 'course_fullname': course_fullname}
+            data.update(file.getMap())
 
-        data.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
+            data.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
 
-        cursor.execute(File.INSERT, data)
+            cursor.execute(File.INSERT, data)
 
-        conn.commit()
-        conn.close()
+            self.write_done()
 
     def batch_delete_files(self, courses: List[Course]):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
 
-        for course in courses:
-            for file in course.files:
-                if file.deleted:
-                    data = {'course_id': course.id, 'course_fullname': course.fullname}
-                    data.update(file.getMap())
+            for course in courses:
+                for file in course.files:
+                    if file.deleted:
+                        data = {'course_id': course.id, 'course_fullname': course.fullname}
+                        data.update(file.getMap())
 
-                    cursor.execute(
-                        """UPDATE files
-                        SET notified = 0, deleted = 1, time_stamp = :time_stamp
-                        WHERE file_id = :file_id;
-                        """,
-                        data,
-                    )
+                        cursor.execute(
+                            """UPDATE files
+                            SET notified = 0, deleted = 1, time_stamp = :time_stamp
+                            WHERE file_id = :file_id;
+                            """,
+                            data,
+                        )
 
-        conn.commit()
-        conn.close()
+            self.flush()
 
     def batch_delete_files_from_db(self, files: List[File]):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
 
-        for file in files:
-            cursor.execute(
-                """UPDATE files
-                SET old_file_id = NULL
-                WHERE old_file_id = ?
-                """,
-                (file.file_id,),
-            )
+            for file in files:
+                cursor.execute(
+                    """UPDATE files
+                    SET old_file_id = NULL
+                    WHERE old_file_id = ?
+                    """,
+                    (file.file_id,),
+                )
 
-            data = {}
+                data = {}
+                data.update(file.getMap())
+
+                cursor.execute(
+                    """DELETE FROM files
+                    WHERE file_id = :file_id
+                    """,
+                    data,
+                )
+
+            self.flush()
+
+    def delete_file(self, file: File, course_id: int, course_fullname: str):
+        with self.lock:
+            cursor = self.conn.cursor()
+
+            data = {'course_id': course_id, 'course_fullname': course_fullname}
             data.update(file.getMap())
 
             cursor.execute(
-                """DELETE FROM files
-                WHERE file_id = :file_id
+                """UPDATE files
+                SET notified = 0, deleted = 1, time_stamp = :time_stamp
+                WHERE file_id = :file_id;
                 """,
                 data,
             )
 
-        conn.commit()
-        conn.close()
+            self.write_done()
 
-    def delete_file(self, file: File, course_id: int, course_fullname: str):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def move_file(self, file: File, course_id: int, course_fullname: str):
+        with self.lock:
+            cursor = self.conn.cursor()
 
-        data = {'course_id': course_id, 'course_fullname': course_fullname}
-        data.update(file.getMap())
+            data_new = {'course_id': course_id, 'course_fullname': course_fullname}
+            data_new.update(file.getMap())
 
-        cursor.execute(
-            """UPDATE files
-            SET notified = 0, deleted = 1, time_stamp = :time_stamp
-            WHERE file_id = :file_id;
-            """,
-            data,
-        )
+            if file.old_file is not None:
+                # insert a new file, but it is already notified because the same file already exists as moved
+                data_new.update(
+                    {'old_file_id': file.old_file.file_id, 'modified': 0, 'moved': 0, 'deleted': 0, 'notified': 1}
+                )
+                cursor.execute(File.INSERT, data_new)
 
-        conn.commit()
-        conn.close()
+                data_old = {'course_id': course_id, 'course_fullname': course_fullname}
+                data_old.update(file.old_file.getMap())
 
-    def move_file(self, file: File, course_id: int, course_fullname: str):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+                cursor.execute(
+                    """UPDATE files
+                SET notified = 0, moved = 1
+                WHERE file_id = :file_id;
+                """,
+                    data_old,
+                )
+            else:
+                # this should never happen, but the old file is not saved in the
+                # file descriptor, so we need to inform about the new file notified = 0
+                data_new.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
+                cursor.execute(File.INSERT, data_new)
 
-        data_new = {'course_id': course_id, 'course_fullname': course_fullname}
-        data_new.update(file.getMap())
+            self.write_done()
 
-        if file.old_file is not None:
-            # insert a new file, but it is already notified because the same file already exists as moved
-            data_new.update(
-                {'old_file_id': file.old_file.file_id, 'modified': 0, 'moved': 0, 'deleted': 0, 'notified': 1}
-            )
-            cursor.execute(File.INSERT, data_new)
+    def modifie_file(self, file: File, course_id: int, course_fullname: str):
+        with self.lock:
+            cursor = self.conn.cursor()
+
+            data_new = {'course_id': course_id, 'course_fullname': course_fullname}
+            data_new.update(file.getMap())
+
+            if file.old_file is not None:
+                # insert a new file,
+                # but it is already notified because the same file already exists
+                # as modified
+                data_new.update(
+                    {'old_file_id': file.old_file.file_id, 'modified': 0, 'moved': 0, 'deleted': 0, 'notified': 1}
+                )
+                cursor.execute(File.INSERT, data_new)
 
-            data_old = {'course_id': course_id, 'course_fullname': course_fullname}
-            data_old.update(file.old_file.getMap())
+                data_old = {'course_id': course_id, 'course_fullname': course_fullname}
+                data_old.update(file.old_file.getMap())
 
-            cursor.execute(
-                """UPDATE files
-            SET notified = 0, moved = 1
-            WHERE file_id = :file_id;
-            """,
-                data_old,
-            )
-        else:
-            # this should never happen, but the old file is not saved in the
-            # file descriptor, so we need to inform about the new file notified = 0
-            data_new.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
-            cursor.execute(File.INSERT, data_new)
+                cursor.execute(
+                    """UPDATE files
+                SET notified = 0, modified = 1,
+                saved_to = :saved_to
+                WHERE file_id = :file_id;
+                """,
+                    data_old,
+                )
+            else:
+                # this should never happen, but the old file is not saved in the
+                # file descriptor, so we need to inform about the new file
+                # notified = 0
 
-        conn.commit()
-        conn.close()
+                data_new.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
+                cursor.execute(File.INSERT, data_new)
 
-    def modifie_file(self, file: File, course_id: int, course_fullname: str):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        data_new = {'course_id': course_id, 'course_fullname': course_fullname}
-        data_new.update(file.getMap())
-
-        if file.old_file is not None:
-            # insert a new file,
-            # but it is already notified because the same file already exists
-            # as modified
-            data_new.update(
-                {'old_file_id': file.old_file.file_id, 'modified': 0, 'moved': 0, 'deleted': 0, 'notified': 1}
-            )
-            cursor.execute(File.INSERT, data_new)
+            self.write_done()
 
-            data_old = {'course_id': course_id, 'course_fullname': course_fullname}
-            data_old.update(file.old_file.getMap())
 
-            cursor.execute(
-                """UPDATE files
-            SET notified = 0, modified = 1,
-            saved_to = :saved_to
-            WHERE file_id = :file_id;
-            """,
-                data_old,
+class StateWriter:
+    """
+    Saves file changes in a background thread, so that the async loop of the downloader never waits for the database.
+    The changes are committed in batches of the write batch size of the database, or as soon as no new changes
+    arrive for a moment.
+    Queuing a change never blocks: if the queue is full, changes are held back in an overflow list, that the writer
+    moves into the queue as soon as there is room again, in the order in which they were queued.
+    The queue is bounded by the producer: the downloader does not start new downloads while the writer is full
+    (see wait_for_room()), so only the downloads that are already running can add to the overflow.
+    Every change gets a number in the order it is queued; changes_saved is the number of the last change that is
+    committed, use wait_saved() or flush() to wait until changes are durable.
+    """
+
+    MAX_QUEUED = 1000
+    IDLE_FLUSH_INTERVAL = 1  # seconds
+    FLUSH = 'flush'  # commits the changes so far without waiting for the batch to be full
+
+    def __init__(self, database: StateRecorder):
+        self.database = database
+        self.queue = queue.Queue(maxsize=self.MAX_QUEUED)
+        self.overflow = collections.deque()
+        self.overflow_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='StateWriter', daemon=True)
+        self.error = None
+        self.stopped = False
+
+        self.changes_queued = 0
+        # Number of changes that are committed to the database
+        self.changes_saved = 0
+        # Notified when changes are committed or there is room in the queue again
+        self.progress = threading.Condition()
+
+    def start(self):
+        self.thread.start()
+
+    @staticmethod
+    def snapshot(arg):
+        """
+        Copies an argument of a change, because the downloader can still change it while the writer saves it.
+        The fields of files, partial downloads and validators are immutable values, so a shallow copy is enough.
+        Only the old file of a file is an object of its own, it is copied as well.
+        """
+        arg = copy.copy(arg)
+        if isinstance(arg, File) and arg.old_file is not None:
+            arg.old_file = copy.copy(arg.old_file)
+        return arg
+
+    def queue_change(self, save_method, *args) -> int:
+        """
+        Queues a change, that is saved by calling save_method of the database with args.
+        @return: The number of the change, it is committed as soon as changes_saved reaches it
+        """
+        self.changes_queued += 1
+        self.put((save_method, tuple(self.snapshot(arg) for arg in args)))
+        return self.changes_queued
+
+    def put(self, change):
+        with self.overflow_lock:
+            if len(self.overflow) == 0:
+                try:
+                    self.queue.put_nowait(change)
+                    return
+                except queue.Full:
+                    logging.debug('The database is slower than the downloads, holding back changes')
+            self.overflow.append(change)
+
+    def refill_queue(self):
+        "Moves held back changes into the queue, as long as there is room"
+        with self.overflow_lock:
+            while len(self.overflow) > 0:
+                try:
+                    self.queue.put_nowait(self.overflow[0])
+                except queue.Full:
+                    break
+                self.overflow.popleft()
+
+    def is_full(self) -> bool:
+        "@return: True if the writer can not keep up and no more changes should be produced for now"
+        if self.error is not None or self.stopped or not self.thread.is_alive():
+            # A writer that stopped does not take changes anymore, waiting for it would never end
+            return False
+        with self.overflow_lock:
+            return len(self.overflow) > 0 or self.queue.full()
+
+    def wait_for_room_blocking(self, timeout: float = None) -> bool:
+        "Blocks until the writer is not full anymore; @return: False if the timeout passed"
+        with self.progress:
+            return self.progress.wait_for(lambda: not self.is_full(), timeout)
+
+    async def wait_for_room(self):
+        "Waits until the writer is not full anymore, without blocking the async loop"
+        while self.is_full():
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.wait_for_room_blocking, self.IDLE_FLUSH_INTERVAL
             )
-        else:
-            # this should never happen, but the old file is not saved in the
-            # file descriptor, so we need to inform about the new file
-            # notified = 0
 
-            data_new.update({'modified': 0, 'deleted': 0, 'moved': 0, 'notified': 0})
-            cursor.execute(File.INSERT, data_new)
+    def wait_saved(self, change_number: int = None, timeout: float = None) -> bool:
+        """
+        Blocks until a change is committed to the database
+        @param change_number: The number returned by queue_change(), by default the last queued change
+        @return: False if the timeout passed or the writer stopped before the change was saved
+        """
+        if change_number is None:
+            change_number = self.changes_queued
+        with self.progress:
+            self.progress.wait_for(
+                lambda: self.changes_saved >= change_number or self.error is not None or self.stopped,
+                timeout,
+            )
+            return self.changes_saved >= change_number
 
-        conn.commit()
-        conn.close()
+    async def flush(self):
+        """
+        Commits all changes queued so far and waits until they are saved, without blocking the async loop.
+        Raises the error that stopped the writer, if there was one.
+        """
+        change_number = self.changes_queued
+        if self.changes_saved < change_number and self.thread.is_alive() and not self.stopped:
+            self.put(self.FLUSH)
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_saved, change_number)
+        self.raise_error()
+
+    def save_file(self, file: File, course_id: int, course_fullname: str) -> int:
+        "Queues a file change to be saved to the database; @return: The number of the change"
+        return self.queue_change(self.database.save_file, file, course_id, course_fullname)
+
+    def save_partial_download(self, partial: PartialDownload):
+        "Queues a partial download to be saved to the database"
+        self.queue_change(self.database.save_partial_download, partial)
+
+    def delete_partial_download(self, url_key: str):
+        "Queues the deletion of a partial download from the database"
+        self.queue_change(self.database.delete_partial_download, url_key)
+
+    def save_http_validator(self, validator: HttpValidator):
+        "Queues the validator of a downloaded URL to be saved to the database"
+        self.queue_change(self.database.save_http_validator, validator)
+
+    def run(self):
+        changes_applied = 0
+        while True:
+            self.refill_queue()
+            try:
+                change = self.queue.get(timeout=self.IDLE_FLUSH_INTERVAL)
+            except queue.Empty:
+                change = 'idle'
+
+            if self.error is not None:
+                # After an error all changes are dropped, but the queue is still emptied to not block the producer
+                if change is None:
+                    break
+                continue
+
+            try:
+                if change is None or change in ['idle', self.FLUSH]:
+                    # Do not keep the last changes uncommitted, if no more downloads finish for a while
+                    self.database.flush()
+                else:
+                    save_method, args = change
+                    save_method(*args)
+                    changes_applied += 1
+
+                with self.progress:
+                    if self.database.pending_writes == 0:
+                        self.changes_saved = changes_applied
+                    self.progress.notify_all()
+            except Exception as write_err:  # pylint: disable=broad-except
+                logging.error('Failed to save changes to the database: %s', write_err)
+                with self.progress:
+                    self.error = write_err
+                    self.progress.notify_all()
+
+            if change is None:
+                break
+
+        with self.progress:
+            self.stopped = True
+            self.progress.notify_all()
+
+    def stop(self):
+        """
+        Waits until all queued changes are saved and stops the writer.
+        Raises the error that stopped the writer, if there was one.
+        """
+        if self.thread.is_alive():
+            self.put(None)
+            self.thread.join()
+        logging.debug('%d of %d changes saved to the database', self.changes_saved, self.changes_queued)
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f'Could not save all changes to the database! Error: {self.error}') from self.error
+
+
+class FileIndex:
+    """
+    Hash indexes over the files of a course, so that matching files are found without comparing
+    every file with every other file of the course.
+    The indexes only pre-select candidates, the predicates of the StateRecorder still decide if a file matches.
+    Like a linear search, the first matching file (in the order of the given list) is returned.
+    """
+
+    def __init__(self, files: List[File]):
+        self.files = files
+        # Files with the same path have the same path identity
+        self.by_path: Dict[Tuple, List[int]] = {}
+        # Moved files are not different, so they have the same size and type and either the same url
+        # or the same timemodified
+        self.by_url: Dict[Tuple, List[int]] = {}
+        self.by_timemodified: Dict[Tuple, List[int]] = {}
+
+        for position, file in enumerate(files):
+            self.by_path.setdefault(self.path_key(file), []).append(position)
+            if self.is_moveable(file):
+                self.by_url.setdefault(self.url_key(file), []).append(position)
+                self.by_timemodified.setdefault(self.timemodified_key(file), []).append(position)
+
+    @staticmethod
+    def path_key(file: File) -> Tuple:
+        return (file.module_id, file.section_name, file.content_filepath, file.content_filename, file.content_type)
+
+    @staticmethod
+    def url_key(file: File) -> Tuple:
+        return (file.content_filesize, file.content_type, file.content_fileurl)
+
+    @staticmethod
+    def timemodified_key(file: File) -> Tuple:
+        return (file.content_filesize, file.content_type, file.content_timemodified)
+
+    @staticmethod
+    def is_moveable(file: File) -> bool:
+        return StateRecorder.files_are_moveable(file, file)
+
+    def find_file_with_same_path(self, file: File) -> File:
+        "@return: The first indexed file with the same path as the given file, or None"
+        for position in self.by_path.get(self.path_key(file), []):
+            candidate = self.files[position]
+            if StateRecorder.files_have_same_path(candidate, file):
+                return candidate
+        return None
+
+    def find_moved_file(self, file: File) -> File:
+        "@return: The first indexed file that is a moved version of the given file, or None"
+        if not self.is_moveable(file):
+            return None
+
+        positions = set(self.by_url.get(self.url_key(file), []))
+        positions.update(self.by_timemodified.get(self.timemodified_key(file), []))
+        for position in sorted(positions):
+            candidate = self.files[position]
+            if StateRecorder.file_was_moved(candidate, file):
+                return candidate
+        return None
@@ -0,0 +1,72 @@
+import logging
+import time
+
+from moodle_dl.types import CircuitState
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops downloading from a host that keeps failing, like a dead file share.
+    After some failed downloads in a row the circuit opens, and the remaining downloads from the host wait.
+    After a cooldown one download is let through as probe (half-open): if it succeeds the circuit closes
+    again, otherwise it stays open for another cooldown. Downloads that still wait when everything else is
+    done fail without trying, so they are tried again in the next run.
+    Keep in mind the breaker needs to be used in a single async loop.
+    """
+
+    def __init__(self, host: str, threshold: int, cooldown: int):
+        """
+        @param threshold: Number of failed downloads in a row that open the circuit
+        @param cooldown: Seconds until a probe download is let through
+        """
+        self.host = host
+        self.threshold = max(1, threshold)
+        self.cooldown = max(0, cooldown)
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def allow_download(self) -> bool:
+        "@return: If a download from the host can be started. After the cooldown it is started as probe."
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN and time.time() >= self.opened_at + self.cooldown:
+            logging.info('Probing if %s is reachable again', self.host)
+            self.state = CircuitState.HALF_OPEN
+            return True
+        return False
+
+    def get_error(self) -> Exception:
+        return CircuitOpenError(
+            f'Skipped, because the last {self.failures} downloads from {self.host} failed.'
+            + ' It is tried again in the next run'
+        )
+
+    def record_success(self):
+        if self.state == CircuitState.HALF_OPEN:
+            logging.info('%s is reachable again', self.host)
+            self.state = CircuitState.CLOSED
+        if self.state == CircuitState.CLOSED:
+            self.failures = 0
+
+    def record_failure(self) -> bool:
+        "@return: True if the circuit opened"
+        if self.state == CircuitState.OPEN:
+            # A download that was already running when the circuit opened
+            return False
+        self.failures += 1
+        if self.state == CircuitState.HALF_OPEN or self.failures >= self.threshold:
+            logging.warning(
+                'The last %d downloads from %s failed, pausing the downloads from it for %ds',
+                self.failures,
+                self.host,
+                self.cooldown,
+            )
+            self.state = CircuitState.OPEN
+            self.opened_at = time.time()
+            return True
+        return False
@@ -0,0 +1,112 @@
+import logging
+import os
+import shutil
+import sys
+from typing import Dict, Tuple
+
+from moodle_dl.database import StateRecorder
+from moodle_dl.utils import PathTools as PT
+from moodle_dl.utils import get_url_key
+
+if sys.platform.startswith('linux'):
+    import fcntl
+else:
+    fcntl = None
+
+
+class ContentStore:
+    """
+    Finds local files that already have the content of a download, so that the file can be linked instead of
+    being downloaded or stored again. Files are identified by their content (size and SHA-256 hash) or by their
+    Moodle identity (URL, size and time modified).
+    The files are linked with a reflink (copy on write) if the file system supports it, otherwise with a hardlink.
+    On file systems without links they are copied, which still saves the download.
+    """
+
+    FICLONE = 0x40049409  # ioctl of Linux to create a reflink
+
+    def __init__(self, database: StateRecorder, enabled: bool):
+        self.enabled = enabled
+        self.by_content: Dict[Tuple[int, str], str] = {}
+        self.by_identity: Dict[Tuple[str, int, int], Tuple[str, str]] = {}
+        self.by_path: Dict[str, Tuple[int, str]] = {}
+        if not enabled:
+            return
+
+        for file_row in database.get_files_with_content_hash():
+            self.add(
+                file_row['saved_to'],
+                file_row['content_size'] or file_row['content_filesize'],
+                file_row['content_hash'],
+                file_row['content_fileurl'],
+                file_row['content_timemodified'],
+            )
+        logging.debug('Content store contains %d different files', len(self.by_content))
+
+    def add(self, path: str, size: int, content_hash: str, url: str = None, timemodified: int = None):
+        "Registers a local file with its content"
+        if not self.enabled or content_hash is None or not path:
+            return
+        self.by_content[(size, content_hash)] = path
+        self.by_path[path] = (size, content_hash)
+        if url is not None and timemodified:
+            self.by_identity[(get_url_key(url), size, timemodified)] = (path, content_hash)
+
+    @staticmethod
+    def is_present(path: str, size: int) -> bool:
+        try:
+            return os.path.getsize(path) == size
+        except OSError:
+            return False
+
+    def find_by_content(self, size: int, content_hash: str) -> str:
+        "@return: Path of a local file with the same content, or None"
+        path = self.by_content.get((size, content_hash))
+        if path is not None and self.is_present(path, size):
+            return path
+        return None
+
+    def find_by_path(self, path: str) -> str:
+        "@return: The content hash of a registered local file, if it still has its size, or None"
+        size, content_hash = self.by_path.get(path, (None, None))
+        if size is not None and self.is_present(path, size):
+            return content_hash
+        return None
+
+    def find_by_identity(self, url: str, size: int, timemodified: int) -> Tuple[str, str]:
+        "@return: Path and content hash of a local file of the same Moodle file, or None and None"
+        if not self.enabled or not size or not timemodified:
+            return None, None
+        path, content_hash = self.by_identity.get((get_url_key(url), size, timemodified), (None, None))
+        if path is not None and self.is_present(path, size):
+            return path, content_hash
+        return None, None
+
+    @classmethod
+    def link_file(cls, src_path: str, dest_path: str, allow_copy: bool = True) -> str:
+        """
+        Replaces dest_path with a link to src_path. This is blocking, run it in an executor.
+        @param allow_copy: Copy the file if it can not be linked
+        @return: The kind of link that was created: reflink, hardlink or copy; None if nothing was done
+        """
+        tmp_path = dest_path + '.link'
+        PT.remove_file(tmp_path)
+        link_kind = None
+        if fcntl is not None:
+            try:
+                with open(src_path, 'rb') as src_file, open(tmp_path, 'wb') as tmp_file:
+                    fcntl.ioctl(tmp_file.fileno(), cls.FICLONE, src_file.fileno())
+                link_kind = 'reflink'
+            except OSError:
+                PT.remove_file(tmp_path)
+        if link_kind is None:
+            try:
+                os.link(src_path, tmp_path)
+                link_kind = 'hardlink'
+            except OSError:
+                if not allow_copy:
+                    return None
+                shutil.copyfile(src_path, tmp_path)
+                link_kind = 'copy'
+        os.replace(tmp_path, dest_path)
+        return link_kind
@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import functools
+import heapq
+import itertools
+import urllib.parse as urlparse
+from typing import Dict, List, Tuple
+
+from moodle_dl.downloader.circuit_breaker import CircuitBreaker
+from moodle_dl.downloader.task import Task
+from moodle_dl.types import CircuitState, DownloadOrder, TaskClass, TaskState
+
+
+class DownloadScheduler:
+    """
+    Decides which task of the download queue is started next.
+    Each task class (plain HTTP, yt-dlp, external downloader, local files) has its own queue and budget of
+    download slots, so that long running video downloads can not block the fast plain downloads.
+    Within a class, tasks are grouped by the host they download from (the host of their URL in Moodle, before any
+    redirect), and the hosts take turns (round robin), so that slow external hosts can not occupy all slots while
+    fast Moodle downloads wait.
+    Each host has a cap of parallel downloads. The Moodle host has its own cap, by default it is only limited by
+    the slots, because the number of parallel downloads is set (or tuned) for it.
+    Tasks that do not download anything (like descriptions) belong to no host and are not capped.
+    The queue of each host is ordered by the course priority first and then by the download order.
+    Tasks that failed with a transient error wait outside of the queues until their retry delay passed.
+    External hosts have a circuit breaker. The tasks of a host that keeps failing wait until a probe download
+    worked, or fail without being started, if nothing else is left to download.
+    Keep in mind the scheduler needs to be used in a single async loop.
+    """
+
+    LOCAL_HOST = ''  # host of tasks that create files without downloading
+    # Assumed size of files with an unknown size, for smallest-first
+    ESTIMATED_FILE_SIZES = {
+        TaskClass.HTTP: 10 * 1024 * 1024,
+        TaskClass.YT_DLP: 200 * 1024 * 1024,  # mostly videos
+        TaskClass.EXTERNAL: 200 * 1024 * 1024,
+        TaskClass.LOCAL: 0,
+    }
+
+    def __init__(
+        self,
+        moodle_host: str,
+        max_parallel_per_host: int,
+        budgets: Dict[TaskClass, int],
+        order: DownloadOrder = DownloadOrder.COURSE,
+        breaker_threshold: int = 0,
+        breaker_cooldown: int = 0,
+        max_parallel_moodle: int = 0,
+    ):
+        """
+        @param max_parallel_per_host: Max parallel downloads from each host other than the Moodle host
+        @param budgets: Number of download slots of each task class
+        @param order: Order of the tasks of a host with the same course priority
+        @param breaker_threshold: Failed downloads in a row that open the circuit of a host, 0 disables the breakers
+        @param breaker_cooldown: Seconds until a download from a host with an open circuit is tried again
+        @param max_parallel_moodle: Max parallel downloads from the Moodle host, 0 means only the slots limit it
+        """
+        self.moodle_host = moodle_host
+        self.max_parallel_per_host = max(1, max_parallel_per_host)
+        self.max_parallel_moodle = max_parallel_moodle if max_parallel_moodle > 0 else None
+        self.budgets = {task_class: max(1, budget) for task_class, budget in budgets.items()}
+        self.order = order
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+        # Heaps of (sort key, tasks added before, task); the counter keeps the order of equal keys stable
+        self.queues: Dict[TaskClass, Dict[str, List[Tuple[tuple, int, Task]]]] = {
+            task_class: collections.OrderedDict() for task_class in TaskClass
+        }
+        self.added_counter = itertools.count()
+        self.added_per_course: Dict[int, int] = collections.defaultdict(int)
+        self.running: Dict[str, int] = collections.defaultdict(int)
+        self.running_per_class: Dict[TaskClass, int] = collections.defaultdict(int)
+        self.active: Dict[asyncio.Task, Task] = {}
+        # Tasks that are cancelled, with the error they fail with, or None if they are put back into the queue
+        self.cancelled: Dict[Task, Exception] = {}
+        # Tasks that wait to be retried after an error, they do not occupy a download slot meanwhile
+        self.delayed: Dict[Task, asyncio.TimerHandle] = {}
+        self.closed = False
+        self._changed = None
+
+    @property
+    def changed(self) -> asyncio.Event:
+        "Set when tasks are added, a task finished or the scheduler is closed"
+        # Created on first use, so that it belongs to the running loop
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    @classmethod
+    def get_host(cls, task: Task) -> str:
+        if task.task_class == TaskClass.LOCAL:
+            return cls.LOCAL_HOST
+        return urlparse.urlparse(task.file.content_fileurl).hostname or cls.LOCAL_HOST
+
+    def get_cap(self, host: str) -> int:
+        "@return: Max parallel downloads from host, or None if it is not capped"
+        if host == self.LOCAL_HOST:
+            return None
+        if host == self.moodle_host:
+            return self.max_parallel_moodle
+        return self.max_parallel_per_host
+
+    def get_breaker(self, host: str) -> CircuitBreaker:
+        "@return: The circuit breaker of host, or None if the host has none"
+        if self.breaker_threshold <= 0 or host in [self.moodle_host, self.LOCAL_HOST]:
+            return None
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host, self.breaker_threshold, self.breaker_cooldown)
+        return self.breakers[host]
+
+    def get_broken_hosts(self) -> Dict[str, CircuitState]:
+        "@return: The hosts whose circuit is not closed, with the state of their circuit"
+        return {host: breaker.state for host, breaker in self.breakers.items() if breaker.state != CircuitState.CLOSED}
+
+    def set_budget(self, task_class: TaskClass, budget: int):
+        self.budgets[task_class] = max(1, budget)
+
+    @classmethod
+    def estimate_size(cls, task: Task) -> int:
+        if task.file.content_filesize is not None and task.file.content_filesize > 0:
+            return task.file.content_filesize
+        return cls.ESTIMATED_FILE_SIZES[task.task_class]
+
+    def get_sort_key(self, task: Task) -> tuple:
+        "@return: Tasks with a smaller key are started first"
+        if self.order == DownloadOrder.SMALLEST_FIRST:
+            order_key = self.estimate_size(task)
+        elif self.order == DownloadOrder.NEWEST_FIRST:
+            order_key = -task.file.content_timemodified
+        elif self.order == DownloadOrder.ROUND_ROBIN_COURSES:
+            # The n-th file of each course comes before the (n+1)-th file of any course
+            order_key = self.added_per_course[task.course.id]
+            self.added_per_course[task.course.id] += 1
+        else:
+            order_key = 0
+        return (-task.course.priority, order_key)
+
+    def add(self, tasks: List[Task]):
+        for task in tasks:
+            queue = self.queues[task.task_class].setdefault(self.get_host(task), [])
+            heapq.heappush(queue, (self.get_sort_key(task), next(self.added_counter), task))
+        self.changed.set()
+
+    def close(self):
+        "No more tasks will be added"
+        self.closed = True
+        self.changed.set()
+
+    def is_finished(self) -> bool:
+        "@return: True if the scheduler is closed and all tasks are done"
+        return self.closed and not self.has_queued_tasks() and len(self.active) == 0 and len(self.delayed) == 0
+
+    def is_blocked(self) -> bool:
+        "@return: True if only tasks of hosts with an open circuit are left, that wait for their probe"
+        return self.closed and len(self.active) == 0 and len(self.delayed) == 0 and self.has_queued_tasks()
+
+    def fail_blocked_tasks(self):
+        "Fails the waiting tasks of hosts with an open circuit without starting them"
+        for class_queues in self.queues.values():
+            for host, queue in list(class_queues.items()):
+                breaker = self.get_breaker(host)
+                if breaker is None or breaker.state == CircuitState.CLOSED:
+                    continue
+                del class_queues[host]
+                for _, _, task in queue:
+                    task.fail_without_running(breaker.get_error())
+        self.changed.set()
+
+    def has_queued_tasks(self, task_class: TaskClass = None) -> bool:
+        if task_class is not None:
+            return len(self.queues[task_class]) > 0
+        return any(len(class_queues) > 0 for class_queues in self.queues.values())
+
+    def pop_next(self) -> Task:
+        """
+        Takes the next task of a class with a free slot, from the first host of that class that is below its cap.
+        That host moves to the end of the turn order. Use start_next() to also run it.
+        @return: The next task to start, or None if no task can be started right now
+        """
+        for task_class, class_queues in self.queues.items():
+            if self.running_per_class[task_class] >= self.budgets[task_class]:
+                continue
+            for host, queue in list(class_queues.items()):
+                cap = self.get_cap(host)
+                if cap is not None and self.running[host] >= cap:
+                    continue
+                breaker = self.get_breaker(host)
+                if breaker is not None and not breaker.allow_download():
+                    # The tasks wait until the cooldown is over and a probe shows that the host works again
+                    continue
+                _, _, task = heapq.heappop(queue)
+                if len(queue) == 0:
+                    del class_queues[host]
+                else:
+                    class_queues.move_to_end(host)
+                self.running[host] += 1
+                self.running_per_class[task_class] += 1
+                return task
+        return None
+
+    def start_next(self) -> bool:
+        "@return: True if a task was started, False if no task can be started right now"
+        task = self.pop_next()
+        if task is None:
+            return False
+        dl_task = asyncio.create_task(task.run())
+        dl_task.add_done_callback(functools.partial(self.task_done, task))
+        self.active[dl_task] = task
+        return True
+
+    def get_running(self, task_class: TaskClass) -> List[Task]:
+        return [task for task in self.active.values() if task.task_class == task_class]
+
+    def cancel(self, task: Task, error: Exception = None) -> bool:
+        """
+        Cancels a running task. Once it stopped, it is put back into the queue, or fails with the given error.
+        @return: False if the task is not running
+        """
+        for dl_task, active_task in self.active.items():
+            if active_task is task and not dl_task.done() and task not in self.cancelled:
+                self.cancelled[task] = error
+                dl_task.cancel()
+                return True
+        return False
+
+    async def stop(self):
+        "Cancels the running tasks and the waiting retries, and waits until the running tasks stopped"
+        for handle in self.delayed.values():
+            handle.cancel()
+        self.delayed.clear()
+        running = list(self.active)
+        for dl_task in running:
+            dl_task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def task_done(self, task: Task, dl_task: asyncio.Task):
+        host = self.get_host(task)
+        self.running[host] -= 1
+        self.running_per_class[task.task_class] -= 1
+        self.active.pop(dl_task, None)
+        self.record_result(host, task)
+        if task in self.cancelled:
+            error = self.cancelled.pop(task)
+            if dl_task.cancelled():
+                # Requeued before anyone is notified, so that the download does not end without the task
+                task.reset_after_cancel(error)
+                if error is None:
+                    self.add([task])
+        elif task.status.retry_delay is not None:
+            self.delay(task)
+        self.changed.set()
+
+    def record_result(self, host: str, task: Task):
+        "Tells the circuit breaker of the host, if the download from it worked"
+        breaker = self.get_breaker(host)
+        if breaker is None:
+            return
+        if (
+            task in self.cancelled
+            or task.status.retry_delay is not None
+            or (task.status.state == TaskState.FAILED and Task.is_host_error(task.status.error))
+        ):
+            if breaker.record_failure():
+                # Wake up the download loop, when the probe can be started
+                asyncio.get_running_loop().call_later(breaker.cooldown, self.changed.set)
+        else:
+            # Also a download that failed for another reason, like a missing file, shows that the host answers
+            breaker.record_success()
+
+    def delay(self, task: Task):
+        "Puts the task back into the queue after its retry delay"
+        retry_delay = task.status.retry_delay
+        task.status.retry_delay = None
+        self.delayed[task] = asyncio.get_running_loop().call_later(retry_delay, self.add_delayed, task)
+
+    def add_delayed(self, task: Task):
+        del self.delayed[task]
+        self.add([task])
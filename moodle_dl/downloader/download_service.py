@@ -1,54 +1,125 @@
 import asyncio
 import logging
 import time
+import urllib.parse as urlparse
 from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from moodle_dl.config import ConfigHelper
-from moodle_dl.database import StateRecorder
+from moodle_dl.database import StateRecorder, StateWriter
+from moodle_dl.downloader.content_store import ContentStore
+from moodle_dl.downloader.download_scheduler import DownloadScheduler
+from moodle_dl.downloader.http_validators import HttpValidators
+from moodle_dl.downloader.parallelism_tuner import ParallelismTuner
+from moodle_dl.downloader.partial_downloads import PartialDownloads
+from moodle_dl.downloader.segmented_downloads import SegmentedDownloads
+from moodle_dl.downloader.session_pool import SessionPool
+from moodle_dl.downloader.stall_watchdog import StallWatchdog
 from moodle_dl.downloader.task import Task
-from moodle_dl.types import Course, DlEvent, DownloadStatus, MoodleDlOpts, TaskState
-from moodle_dl.utils import calc_speed, format_bytes, format_speed
+from moodle_dl.types import Course, DlEvent, DownloadOrder, DownloadStatus, MoodleDlOpts, TaskClass, TaskState
+from moodle_dl.utils import RetryPolicy, calc_speed, format_bytes, format_speed
 
 
 class DownloadService:
     "Manages jobs to download, delete or create files of courses"
 
+    MAX_PARALLEL_LOCAL_TASKS = 10  # creating descriptions and shortcuts is cheap
+
     def __init__(self, courses: List[Course], config: ConfigHelper, opts: MoodleDlOpts, database: StateRecorder):
         self.courses = courses
         self.config = config
         self.opts = opts
         self.database = database
+        self.state_writer = StateWriter(database)
 
         self.status = DownloadStatus()
-        self.all_tasks = self.gen_all_tasks()
 
-    def gen_all_tasks(self) -> List:
         # Set custom chunk size
         Task.CHUNK_SIZE = self.opts.download_chunk_size
-        dl_options = self.config.get_download_options(self.opts)
-        thread_pool = ThreadPoolExecutor(max_workers=self.opts.max_parallel_yt_dlp)
-        all_tasks = []
-        for course in self.courses:
+        self.dl_options = self.config.get_download_options(self.opts)
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.opts.max_parallel_yt_dlp)
+        self.session_pool = SessionPool(self.opts, self.dl_options.cookies_text)
+        self.partial_downloads = PartialDownloads(database, self.state_writer)
+        self.segmented_downloads = SegmentedDownloads(self.opts)
+        self.http_validators = HttpValidators(database, self.state_writer)
+        self.content_store = ContentStore(database, self.config.get_deduplicate_files())
+        self.retry_policy = RetryPolicy(self.opts.retry_base_delay, self.opts.retry_max_delay, self.opts.retry_budget)
+        self.parallelism_tuner = None
+        if self.opts.auto_parallel_downloads:
+            self.parallelism_tuner = ParallelismTuner(
+                self.opts.min_parallel_downloads, self.opts.max_parallel_downloads
+            )
+        self.stall_watchdog = None
+        if self.opts.stall_timeout > 0:
+            self.stall_watchdog = StallWatchdog(self.opts.min_download_speed, self.opts.stall_timeout)
+
+        # In pipeline mode courses are added while the download is already running
+        self.more_courses_expected = False
+        self.scheduler = DownloadScheduler(
+            urlparse.urlparse(self.config.get_moodle_URL().url_base).hostname,
+            self.opts.max_parallel_downloads_per_host,
+            {
+                TaskClass.HTTP: self.get_parallel_downloads(),
+                TaskClass.YT_DLP: self.opts.max_parallel_yt_dlp,
+                TaskClass.EXTERNAL: self.opts.max_parallel_external_downloads,
+                TaskClass.LOCAL: self.MAX_PARALLEL_LOCAL_TASKS,
+            },
+            DownloadOrder(self.opts.download_order),
+            self.opts.circuit_breaker_threshold,
+            self.opts.circuit_breaker_cooldown,
+            self.opts.max_parallel_moodle_downloads,
+        )
+
+        self.all_tasks = self.gen_tasks(courses)
+        if self.status.files_to_download > 0:
+            logging.info('Download queue contains %d tasks', self.status.files_to_download)
+        else:
+            logging.debug('Download queue is empty')
+
+    def gen_tasks(self, courses: List[Course]) -> List[Task]:
+        tasks = []
+        for course in courses:
             for course_file in course.files:
                 if course_file.deleted is False:
-                    all_tasks.append(
+                    tasks.append(
                         Task(
                             task_id=self.status.files_to_download,
                             file=course_file,
                             course=course,
-                            options=dl_options,
-                            thread_pool=thread_pool,
+                            options=self.dl_options,
+                            thread_pool=self.thread_pool,
+                            session_pool=self.session_pool,
+                            partial_downloads=self.partial_downloads,
+                            segmented_downloads=self.segmented_downloads,
+                            http_validators=self.http_validators,
+                            content_store=self.content_store,
+                            retry_policy=self.retry_policy,
                             callback=self.status_callback,
                         )
                     )
                     self.status.bytes_to_download += course_file.content_filesize
                     self.status.files_to_download += 1
-        if self.status.files_to_download > 0:
-            logging.info('Download queue contains %d tasks', self.status.files_to_download)
-        else:
-            logging.debug('Download queue is empty')
-        return all_tasks
+        return tasks
+
+    def expect_more_courses(self):
+        "Keeps the download running after all tasks are done, until no_more_courses() is called"
+        self.more_courses_expected = True
+
+    def add_courses(self, courses: List[Course]):
+        "Adds the changes of courses to the download queue, also while the download is running"
+        self.courses = self.courses + courses
+        # delete files, that should be deleted
+        self.database.batch_delete_files(courses)
+
+        new_tasks = self.gen_tasks(courses)
+        self.all_tasks += new_tasks
+        self.scheduler.add(new_tasks)
+        logging.debug('Added %d tasks to the download queue', len(new_tasks))
+
+    def no_more_courses(self):
+        "Lets the download finish as soon as all tasks are done"
+        self.more_courses_expected = False
+        self.scheduler.close()
 
     def status_callback(self, event: DlEvent, task: Task, **extra_args):
         self.status.lock.acquire()
@@ -57,43 +128,129 @@ class DownloadService:
         elif event == DlEvent.FAILED:
             self.status.files_failed += 1
         elif event == DlEvent.FINISHED:
-            self.database.save_file(task.file, task.course.id, task.course.fullname)
+            self.state_writer.save_file(task.file, task.course.id, task.course.fullname)
             self.status.files_downloaded += 1
         elif event == DlEvent.TOTAL_SIZE:
             self.status.bytes_to_download += extra_args['content_length']
         elif event == DlEvent.TOTAL_SIZE_UPDATE:
             self.status.bytes_to_download += extra_args['content_length_diff']
+        elif event == DlEvent.RETRY:
+            self.status.files_failed -= 1
         self.status.lock.release()
 
     def run(self):
         asyncio.run(self.real_run())
 
+    def get_parallel_downloads(self) -> int:
+        if self.parallelism_tuner is not None:
+            return self.parallelism_tuner.parallel
+        return self.opts.max_parallel_downloads
+
     async def real_run(self):
         "Starts all tasks and issues status messages at regular intervals"
 
         # delete files, that should be deleted
         self.database.batch_delete_files(self.courses)
 
-        if len(self.all_tasks) <= 0:
+        if len(self.all_tasks) <= 0 and not self.more_courses_expected:
             return
 
+        self.scheduler.add(self.all_tasks)
+        if not self.more_courses_expected:
+            self.scheduler.close()
+
         # run all other tasks
         status_logger_task = asyncio.create_task(self.log_download_status())
+        tuner_task = None
+        if self.parallelism_tuner is not None:
+            tuner_task = asyncio.create_task(self.tune_parallel_downloads())
+        watchdog_task = None
+        if self.stall_watchdog is not None:
+            watchdog_task = asyncio.create_task(self.watch_stalled_downloads())
+        self.state_writer.start()
 
-        dl_tasks = set()
-        for task in self.all_tasks:
-            if len(dl_tasks) >= self.opts.max_parallel_downloads:
-                # Wait for some download to finish before adding a new one
-                _done, dl_tasks = await asyncio.wait(dl_tasks, return_when=asyncio.FIRST_COMPLETED)
-            dl_tasks.add(asyncio.create_task(task.run()))
+        try:
+            await self.run_scheduler()
+
+            # Downloads that failed because of a flaky connection or server get one more try at the end
+            retry_tasks = [task for task in self.all_tasks if task.is_worth_final_retry()]
+            if len(retry_tasks) > 0:
+                logging.info('Retrying %d failed downloads', len(retry_tasks))
+                for task in retry_tasks:
+                    task.reset_after_failure()
+                self.scheduler.add(retry_tasks)
+                await self.run_scheduler()
+        finally:
+            status_logger_task.cancel()
+            if tuner_task is not None:
+                tuner_task.cancel()
+            if watchdog_task is not None:
+                watchdog_task.cancel()
+            # If the run is cancelled, the running downloads keep their .part files, before the connections close
+            await self.scheduler.stop()
+            # Release all pooled connections of this run
+            await self.session_pool.close()
+            # Wait for the last finished downloads to be saved
+            await asyncio.get_running_loop().run_in_executor(None, self.state_writer.stop)
+
+    async def run_scheduler(self):
+        "Starts the queued tasks, until all tasks are done"
+        while True:
+            self.scheduler.changed.clear()
+            self.scheduler.set_budget(TaskClass.HTTP, self.get_parallel_downloads())
+            if self.state_writer.is_full():
+                # The database can not keep up, so no more downloads are started until the writer caught up
+                await self.state_writer.wait_for_room()
+            while self.scheduler.start_next():
+                pass
+            if self.scheduler.is_blocked():
+                # Do not wait for the probes of hosts that keep failing, when everything else is done
+                self.scheduler.fail_blocked_tasks()
+            if self.scheduler.is_finished():
+                break
 
-        # Wait for the remaining downloads to finish
-        await asyncio.wait(dl_tasks)
-        status_logger_task.cancel()
+            # Wait for a download to finish or for new tasks
+            # The tuner can raise the number of parallel downloads meanwhile, so check it regularly
+            try:
+                await asyncio.wait_for(
+                    self.scheduler.changed.wait(), timeout=1 if self.parallelism_tuner is not None else None
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def tune_parallel_downloads(self):
+        "Measures the throughput in windows and lets the tuner adjust the number of parallel downloads"
+        while True:
+            window_start = time.time()
+            bytes_at_start = self.status.bytes_downloaded
+            saturated_at_start = self.scheduler.has_queued_tasks(TaskClass.HTTP)
+            await asyncio.sleep(self.parallelism_tuner.WINDOW)
+
+            throughput = calc_speed(window_start, time.time(), self.status.bytes_downloaded - bytes_at_start) or 0.0
+            saturated = saturated_at_start and self.scheduler.has_queued_tasks(TaskClass.HTTP)
+            self.parallelism_tuner.on_window(throughput, saturated)
+
+    async def watch_stalled_downloads(self):
+        "Cancels downloads that stalled, they are put back into the download queue or fail"
+        while True:
+            await asyncio.sleep(self.stall_watchdog.CHECK_INTERVAL)
+
+            running = self.scheduler.get_running(TaskClass.HTTP)
+            for task in self.stall_watchdog.find_stalled(running, time.time()):
+                error = self.stall_watchdog.get_error(task)
+                if not self.scheduler.cancel(task, error):
+                    continue
+                if error is None:
+                    logging.warning(
+                        '[%d] Download stalled, putting it back into the queue: %s', task.task_id, task.filename
+                    )
+                else:
+                    logging.warning('[%d] %s: %s', task.task_id, error, task.filename)
 
     async def log_download_status(self):
         last_bytes_downloaded = 0
         last_status_timestamp = time.time()
+        started = last_status_timestamp
         while True:
             # Print every 2 sec the current status
             await asyncio.sleep(2)
@@ -112,15 +269,27 @@ class DownloadService:
             last_status_timestamp = time.time()
             last_bytes_downloaded = self.status.bytes_downloaded
 
+            files_done = self.status.files_downloaded + self.status.files_failed
+            files_per_minute = files_done * 60 / max(1.0, time.time() - started)
+
             message_line = (
                 f'Total: {percentage}'
                 + f' {format_bytes(self.status.bytes_downloaded):>5} / {format_bytes(self.status.bytes_to_download):<5}'
-                + f' | Done: {(self.status.files_downloaded + self.status.files_failed):>5}'
+                + f' | Done: {files_done:>5}'
                 + f' / {self.status.files_to_download:<5}'
+                + f' ({files_per_minute:.0f}/min)'
                 + f' | Speed: {format_speed(speed)}'
             )
             if self.status.files_failed > 0:
                 message_line += f' | Failed: {self.status.files_failed}'
+            if self.state_writer.is_full():
+                unsaved_changes = self.state_writer.changes_queued - self.state_writer.changes_saved
+                message_line += f' | Saving: {unsaved_changes}'
+            broken_hosts = self.scheduler.get_broken_hosts()
+            if len(broken_hosts) > 0:
+                message_line += ' | Circuit: ' + ', '.join(
+                    f'{host} {state.value}' for host, state in broken_hosts.items()
+                )
 
             logging.info(message_line)
 
@@ -56,4 +56,5 @@ class FakeDownloadService:
 
                     self.database.save_file(file, course.id, course.fullname)
 
+        self.database.flush()
         logging.info('All files stored in the Database!')
@@ -0,0 +1,65 @@
+import os
+import time
+from typing import Dict, List
+
+from moodle_dl.database import StateRecorder, StateWriter
+from moodle_dl.types import HttpValidator
+
+
+class HttpValidators:
+    """
+    Remembers the ETag and Last-Modified header of downloaded URLs, so that the next download of the same URL
+    can be sent as conditional request. If the server answers with 304 Not Modified, a local copy of the file
+    is used instead of transferring the same bytes again.
+    The validators are loaded once from the database, changes are saved through the state writer.
+    URLs are identified without the token, because the token can change between runs.
+    """
+
+    def __init__(self, database: StateRecorder, state_writer: StateWriter):
+        self.state_writer = state_writer
+        self.records: Dict[str, HttpValidator] = database.get_http_validators()
+
+    def get(self, url_key: str) -> HttpValidator:
+        return self.records.get(url_key)
+
+    @staticmethod
+    def get_local_copy(validator: HttpValidator, other_paths: List[str]) -> str:
+        """
+        Searches a local file with the content the validator belongs to. Besides the path the URL was saved to,
+        other paths can be checked, for example the renamed old version of a modified file.
+        @return: Path of the local copy, or None if there is none
+        """
+        if validator is None or not validator.content_length:
+            return None
+        for path in [validator.saved_to] + other_paths:
+            try:
+                if path and os.path.getsize(path) == validator.content_length:
+                    return path
+            except OSError:
+                pass
+        return None
+
+    @staticmethod
+    def get_conditional_headers(validator: HttpValidator) -> Dict[str, str]:
+        headers = {}
+        if validator.etag is not None:
+            headers['If-None-Match'] = validator.etag
+        if validator.last_modified is not None:
+            headers['If-Modified-Since'] = validator.last_modified
+        return headers
+
+    def save(self, url_key: str, etag: str, last_modified: str, content_length: int, content_type: str, saved_to: str):
+        "Remembers the validators of a downloaded URL, if the server sent some"
+        if etag is None and last_modified is None:
+            return
+        validator = HttpValidator(
+            url_key=url_key,
+            etag=etag,
+            last_modified=last_modified,
+            content_length=content_length,
+            content_type=content_type,
+            saved_to=saved_to,
+            time_stamp=int(time.time()),
+        )
+        self.records[url_key] = validator
+        self.state_writer.save_http_validator(validator)
@@ -0,0 +1,61 @@
+import logging
+
+from moodle_dl.utils import format_speed
+
+
+class ParallelismTuner:
+    """
+    Searches the number of parallel downloads with the highest throughput (hill climbing).
+    The aggregate throughput is measured over windows of some seconds. After each window the number of
+    parallel downloads is moved one step: further in the same direction if the throughput improved, back if
+    it got worse. On a plateau fewer parallel downloads are preferred, because more of them only add
+    contention (disk, proxy, server). Windows in which the download queue ran empty are not comparable and
+    are skipped.
+    """
+
+    WINDOW = 5  # seconds a throughput measurement lasts
+    INITIAL_PARALLEL_DOWNLOADS = 4
+    SIGNIFICANT_CHANGE = 0.1  # throughput changes below 10% count as plateau
+
+    def __init__(self, min_parallel: int, max_parallel: int):
+        self.max_parallel = max(1, max_parallel)
+        self.min_parallel = min(max(1, min_parallel), self.max_parallel)
+        self.parallel = min(max(self.INITIAL_PARALLEL_DOWNLOADS, self.min_parallel), self.max_parallel)
+        self.direction = 1
+        self.last_throughput = None
+
+    def on_window(self, throughput: float, saturated: bool):
+        """
+        Adjusts the number of parallel downloads after a measurement window
+        @param throughput: Aggregate bytes per second in the window
+        @param saturated: If the download queue had waiting tasks during the whole window
+        """
+        if not saturated:
+            self.last_throughput = None
+            return
+
+        if self.last_throughput is None:
+            decision = 'probing'
+        elif throughput > self.last_throughput * (1 + self.SIGNIFICANT_CHANGE):
+            decision = 'throughput improved'
+        elif throughput < self.last_throughput * (1 - self.SIGNIFICANT_CHANGE):
+            decision = 'throughput dropped'
+            self.direction = -self.direction
+        else:
+            decision = 'throughput plateau'
+            self.direction = -1
+        self.last_throughput = throughput
+
+        old_parallel = self.parallel
+        self.parallel = min(max(self.parallel + self.direction, self.min_parallel), self.max_parallel)
+        if self.parallel == old_parallel:
+            # At a bound, so probe the other direction next time
+            self.direction = -self.direction
+            return
+        logging.debug(
+            'Changing parallel downloads from %d to %d (%s, %s)',
+            old_parallel,
+            self.parallel,
+            decision,
+            format_speed(throughput).strip(),
+        )
@@ -0,0 +1,51 @@
+import logging
+import os
+import time
+from typing import Dict
+
+from moodle_dl.database import StateRecorder, StateWriter
+from moodle_dl.types import PartialDownload
+from moodle_dl.utils import PathTools as PT
+
+
+class PartialDownloads:
+    """
+    Keeps track of interrupted downloads, so that they can be continued in a later run instead of starting from zero.
+    The records are loaded once from the database, changes are saved through the state writer.
+    Downloads are identified by their URL without the token, because the token can change between runs.
+    """
+
+    MAX_AGE = 30 * 24 * 60 * 60  # seconds; older partial downloads are dropped
+
+    def __init__(self, database: StateRecorder, state_writer: StateWriter):
+        self.state_writer = state_writer
+        self.records: Dict[str, PartialDownload] = {}
+
+        oldest_time_stamp = int(time.time()) - self.MAX_AGE
+        for url_key, partial in database.get_partial_downloads().items():
+            if partial.time_stamp < oldest_time_stamp or not os.path.isfile(partial.part_path):
+                logging.debug('Dropping outdated partial download: %s', partial.part_path)
+                PT.remove_file(partial.part_path)
+                database.delete_partial_download(url_key)
+                continue
+            self.records[url_key] = partial
+
+        if len(self.records) > 0:
+            logging.info('%d interrupted downloads can be continued', len(self.records))
+
+    def get(self, url_key: str) -> PartialDownload:
+        "Returns the partial download of an url key, if it can be continued"
+        partial = self.records.get(url_key)
+        if partial is not None and not os.path.isfile(partial.part_path):
+            self.remove(url_key)
+            return None
+        return partial
+
+    def save(self, partial: PartialDownload):
+        partial.time_stamp = int(time.time())
+        self.records[partial.url_key] = partial
+        self.state_writer.save_partial_download(partial)
+
+    def remove(self, url_key: str):
+        if self.records.pop(url_key, None) is not None:
+            self.state_writer.delete_partial_download(url_key)
@@ -0,0 +1,38 @@
+import asyncio
+from typing import List, Tuple
+
+from moodle_dl.types import MoodleDlOpts
+
+
+class SegmentedDownloads:
+    """
+    Large files can be downloaded with several connections in parallel, each fetching one byte range (segment)
+    of the file. This helps if the speed of a single connection is limited, for example by a proxy.
+    All segmented downloads share their own budget of connections, so that they do not take the slots of the
+    normal download queue.
+    Keep in mind the semaphore needs to be created in the same async loop as it is used.
+    """
+
+    def __init__(self, opts: MoodleDlOpts):
+        self.segments = max(1, opts.download_segments)
+        self.min_size = opts.segmented_download_min_size
+        self.max_parallel_segments = max(1, opts.max_parallel_segments)
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use, so that it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel_segments)
+        return self._semaphore
+
+    def should_segment(self, file_size: int) -> bool:
+        return self.segments > 1 and file_size is not None and file_size >= self.min_size
+
+    def get_ranges(self, total_size: int) -> List[Tuple[int, int]]:
+        """
+        Splits a file into byte ranges of nearly the same size
+        @return: List of (first byte, last byte) of each segment, both inclusive like in the Range header
+        """
+        segment_size = -(-total_size // self.segments)
+        return [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
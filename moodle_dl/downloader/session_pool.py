@@ -0,0 +1,72 @@
+import sys
+import urllib.parse as urlparse
+from io import StringIO
+from typing import Dict, Tuple
+
+import aiohttp
+
+from moodle_dl.types import MoodleDlOpts
+from moodle_dl.utils import MoodleDLCookieJar, SslHelper, convert_to_aiohttp_cookie_jar
+
+
+class SessionPool:
+    """
+    Shares HTTP sessions between all download tasks, so that keep-alive connections to the same host are reused
+    instead of doing a new DNS lookup, TCP and TLS handshake for every single file.
+    There is one session per host and cookie requirement. Each session with cookies has its own cookie jar, that
+    only gets the cookies of the cookie file that belong to its host, so that for example the Moodle session cookie
+    is never sent to an external host. Cookies set by responses (also after redirects) are kept by the domain rules
+    of aiohttp.
+    Keep in mind the sessions need to be created and closed in the same async loop as they are used.
+    """
+
+    DNS_CACHE_TTL = 300  # seconds
+
+    def __init__(self, opts: MoodleDlOpts, cookies_text: str = None):
+        self.cookies_text = cookies_text
+        self.limit_per_host = opts.max_connections_per_host
+        self.ssl_context = SslHelper.get_ssl_context(
+            opts.skip_cert_verify, opts.allow_insecure_ssl, opts.use_all_ciphers
+        )
+        self.sessions: Dict[Tuple[str, str, int, bool], aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def get_pool_key(url: str, with_cookies: bool) -> Tuple[str, str, int, bool]:
+        url_parsed = urlparse.urlparse(url)
+        try:
+            port = url_parsed.port
+        except ValueError:
+            port = None
+        return (url_parsed.scheme, url_parsed.hostname, port, with_cookies)
+
+    def get_session(self, url: str, with_cookies: bool) -> aiohttp.ClientSession:
+        """
+        Returns the shared session for the host of the given URL
+        @param with_cookies: If the session should send the cookies of the cookie file
+        """
+        key = self.get_pool_key(url, with_cookies and self.cookies_text is not None)
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                resolver=aiohttp.ThreadedResolver() if sys.platform == 'win32' else aiohttp.AsyncResolver(),
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.DNS_CACHE_TTL,
+                ssl=self.ssl_context,
+            )
+            cookie_jar = self.create_cookie_jar(key[1]) if key[3] else None
+            session = aiohttp.ClientSession(connector=connector, cookie_jar=cookie_jar, raise_for_status=True)
+            self.sessions[key] = session
+        return session
+
+    def create_cookie_jar(self, hostname: str) -> aiohttp.CookieJar:
+        "@return: A cookie jar with the cookies of the cookie file that are sent to hostname"
+        cookie_jar = MoodleDLCookieJar(StringIO(self.cookies_text))
+        cookie_jar.load(ignore_discard=True, ignore_expires=True)
+        return convert_to_aiohttp_cookie_jar(cookie_jar, hostname)
+
+    async def close(self):
+        "Closes all sessions and their pooled connections"
+        for session in self.sessions.values():
+            if not session.closed:
+                await session.close()
+        self.sessions = {}
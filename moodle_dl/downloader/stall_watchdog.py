@@ -0,0 +1,65 @@
+import logging
+from typing import Dict, List, Tuple
+
+from moodle_dl.downloader.task import Task
+from moodle_dl.utils import format_speed
+
+
+class DownloadStalledError(ConnectionError):
+    pass
+
+
+class StallWatchdog:
+    """
+    Finds downloads that stalled, because their throughput stayed below a floor for a whole window.
+    Downloads have no overall timeout, so a connection that stops sending bytes would hold its download slot
+    forever. Stalled downloads are cancelled and put back into the queue a few times before they fail.
+    Only the time a response body is received is measured. Waiting for a free connection, a segment slot,
+    a HEAD request or local work like hashing can not make a download stall.
+    If the server supports range requests, a requeued download continues its .part file.
+    """
+
+    CHECK_INTERVAL = 5  # seconds between two checks
+    MAX_RESTARTS = 2
+
+    def __init__(self, min_speed: int, window: int):
+        """
+        @param min_speed: Bytes per second a download needs to reach in each window
+        @param window: Seconds the throughput is measured over
+        """
+        self.min_speed = max(0, min_speed)
+        self.window = max(self.CHECK_INTERVAL, window)
+        # Start time and downloaded bytes of the current window of each running task
+        self.windows: Dict[Task, Tuple[float, int]] = {}
+
+    def find_stalled(self, running: List[Task], now: float) -> List[Task]:
+        "@return: The running tasks whose throughput was below the floor in their last window"
+        stalled = []
+        windows = {}
+        for task in running:
+            if task.status.open_transfers <= 0:
+                # The window starts again, once bytes are flowing
+                continue
+            window_start, bytes_at_start = self.windows.get(task, (now, task.status.bytes_downloaded))
+            if now - window_start >= self.window:
+                speed = (task.status.bytes_downloaded - bytes_at_start) / (now - window_start)
+                if speed < self.min_speed:
+                    logging.debug(
+                        '[%d] Download stalled at %s for %ds', task.task_id, format_speed(speed).strip(), self.window
+                    )
+                    stalled.append(task)
+                    continue
+                window_start, bytes_at_start = now, task.status.bytes_downloaded
+            windows[task] = (window_start, bytes_at_start)
+        # Finished tasks are forgotten
+        self.windows = windows
+        return stalled
+
+    def get_error(self, task: Task) -> Exception:
+        "@return: The error a stalled task fails with, or None if it should be put back into the queue"
+        if task.status.restarts < self.MAX_RESTARTS:
+            return None
+        return DownloadStalledError(
+            f'Download stalled below {format_speed(self.min_speed).strip()} for {self.window}s'
+            + f' (tried {task.status.restarts + 1} times)'
+        )
@@ -1,5 +1,7 @@
 import asyncio
+import contextlib
 import functools
+import hashlib
 import logging
 import os
 import posixpath
@@ -7,7 +9,6 @@ import re
 import shlex
 import shutil
 import subprocess
-import sys
 import time
 import traceback
 import urllib
@@ -16,7 +17,7 @@ from concurrent.futures import ThreadPoolExecutor
 from email.utils import unquote
 from io import StringIO
 from pathlib import Path
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Tuple
 from urllib.error import ContentTooShortError
 
 import aiofiles
@@ -24,24 +25,31 @@ import aiohttp
 import html2text
 import yt_dlp
 
+from moodle_dl.downloader.content_store import ContentStore
 from moodle_dl.downloader.extractors import add_additional_extractors
+from moodle_dl.downloader.http_validators import HttpValidators
+from moodle_dl.downloader.partial_downloads import PartialDownloads
+from moodle_dl.downloader.segmented_downloads import SegmentedDownloads
+from moodle_dl.downloader.session_pool import SessionPool
 from moodle_dl.types import (
     Course,
     DlEvent,
     DownloadOptions,
     File,
     HeadInfo,
+    HttpValidator,
+    PartialDownload,
+    TaskClass,
     TaskState,
     TaskStatus,
 )
 from moodle_dl.utils import (
     LINK_TEMPLATES,
-    MoodleDLCookieJar,
-    SslHelper,
+    RetryPolicy,
     Timer,
-    convert_to_aiohttp_cookie_jar,
     format_bytes,
     format_seconds,
+    get_url_key,
     timeconvert,
 )
 from moodle_dl.utils import PathTools as PT
@@ -52,6 +60,8 @@ class Task:
 
     CHUNK_SIZE = 102400  # default: 1024 * 100 = 100kb; will be overwritten with download_chunk_size
     MAX_DL_RETRIES = 3
+    # Only downloads of at least this size are kept as .part file to be continued in the next run
+    MIN_RESUMABLE_SIZE = 1024 * 1024  # 1 MiB
 
     RQ_HEADER = {
         'User-Agent': (
@@ -69,6 +79,12 @@ class Task:
         course: Course,
         options: DownloadOptions,
         thread_pool: ThreadPoolExecutor,
+        session_pool: SessionPool,
+        partial_downloads: PartialDownloads,
+        segmented_downloads: SegmentedDownloads,
+        http_validators: HttpValidators,
+        content_store: ContentStore,
+        retry_policy: RetryPolicy,
         callback: Callable[[], None],
     ):
         self.task_id = task_id
@@ -76,11 +92,18 @@ class Task:
         self.course = course
         self.opts = options
         self.thread_pool = thread_pool
+        self.session_pool = session_pool
+        self.partial_downloads = partial_downloads
+        self.segmented_downloads = segmented_downloads
+        self.http_validators = http_validators
+        self.content_store = content_store
+        self.retry_policy = retry_policy
         self.callback = callback
 
         self.destination = self.gen_path(options.download_path, course, file)
         self.filename = PT.to_valid_name(self.file.content_filename, is_file=True)
         self.status = TaskStatus()
+        self.task_class = self.get_task_class()
 
     @staticmethod
     def gen_path(storage_path: str, course: Course, file: File):
@@ -105,6 +128,27 @@ class Task:
             )
         return PT.path_of_file(storage_path, course_name, file.section_name, file.content_filepath)
 
+    def get_task_class(self) -> TaskClass:
+        """
+        Guesses the kind of work of this task, before anything is requested. Follows the branches of real_run().
+        The class is decided by the host of the URL in Moodle, before any redirect. The task keeps its class and
+        slot for the whole download: external links that turn out to be plain files, or that redirect to a host
+        with an external downloader (which real_run() then uses), still run in the slots of their class.
+        """
+        if self.file.content_type in ['description', 'html'] or self.file.content_fileurl.startswith('data:'):
+            return TaskClass.LOCAL
+        is_moodle_page = self.file.module_modname.startswith(('index_mod', 'cookie_mod'))
+        is_external_link = self.file.module_modname.startswith('url')
+        if not is_moodle_page and not is_external_link:
+            return TaskClass.HTTP
+        if is_external_link and (not self.opts.download_linked_files or self.is_filtered_external_domain()):
+            # Only the shortcut is created
+            return TaskClass.LOCAL
+        host = urlparse.urlparse(self.file.content_fileurl).hostname
+        if self.opts.external_file_downloaders.get(host, '') != '':
+            return TaskClass.EXTERNAL
+        return TaskClass.YT_DLP
+
     def add_token_to_url(self, url: str) -> str:
         """
         Adds the Moodle token to a URL
@@ -126,6 +170,60 @@ class Task:
         PT.touch_file(target_path)
         return target_path
 
+    def set_content_info(self, content_size: int, content_hash: str):
+        "Remembers the size and SHA-256 hash of the content that was saved to the file of this task"
+        self.file.content_size = content_size
+        self.file.content_hash = content_hash
+
+    @staticmethod
+    def encode_text(text: str, newline: str = os.linesep) -> bytes:
+        "Encodes text like a file opened in text mode would do it"
+        return text.replace('\n', newline).encode('utf-8')
+
+    async def write_content(self, content: bytes):
+        "Writes content to the file of this task and remembers its size and hash"
+        async with aiofiles.open(self.file.saved_to, 'wb') as target_file:
+            await target_file.write(content)
+        self.set_content_info(len(content), hashlib.sha256(content).hexdigest())
+
+    @classmethod
+    def hash_file(cls, file_path: str, max_bytes: int = None):
+        """
+        Reads a file to hash its content. This is blocking, run it in an executor.
+        Only use it if the content did not pass through moodle-dl, like files written by yt-dlp.
+        @param max_bytes: Only hash the first bytes of the file
+        @return: The SHA-256 hash object and the number of hashed bytes
+        """
+        hasher = hashlib.sha256()
+        hashed_bytes = 0
+        with open(file_path, 'rb') as file_obj:
+            while max_bytes is None or hashed_bytes < max_bytes:
+                chunk_size = cls.CHUNK_SIZE if max_bytes is None else min(cls.CHUNK_SIZE, max_bytes - hashed_bytes)
+                chunk = file_obj.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                hashed_bytes += len(chunk)
+        return hasher, hashed_bytes
+
+    @classmethod
+    def copy_and_hash_file(cls, src_path: str, dest_path: str) -> (int, str):
+        """
+        Copies a file and hashes the content on the way. This is blocking, run it in an executor.
+        @return: The size and SHA-256 hash of the copied content
+        """
+        hasher = hashlib.sha256()
+        copied_bytes = 0
+        with open(src_path, 'rb') as src_file, open(dest_path, 'wb') as dest_file:
+            while True:
+                chunk = src_file.read(cls.CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                dest_file.write(chunk)
+                copied_bytes += len(chunk)
+        return copied_bytes, hasher.hexdigest()
+
     def rename_old_file(self) -> bool:
         """
         Try to rename an existing modified file. Add the extension '_old' to the filename if possible.
@@ -277,6 +375,13 @@ class Task:
             final_filename = final_filename[rel_pos:]
         self.file.saved_to = final_filename
 
+        # yt-dlp writes the file itself, so it needs to be read to hash it. We are already in a worker thread here.
+        try:
+            hasher, hashed_bytes = self.hash_file(final_filename)
+            self.set_content_info(hashed_bytes, hasher.hexdigest())
+        except OSError as hash_err:
+            logging.debug('[%d] Could not hash %s: %s', self.task_id, final_filename, hash_err)
+
     def is_blocked_for_yt_dlp(self, url: str):
         url_parsed = urlparse.urlparse(url)
         # Do not download whole YT channels
@@ -314,70 +419,62 @@ class Task:
         Do a Head request to collect some information about the URL
         @return: If download should be aborted then None; else HeadInfo
         """
-        ssl_context = SslHelper.get_ssl_context(
-            self.opts.global_opts.skip_cert_verify,
-            self.opts.global_opts.allow_insecure_ssl,
-            self.opts.global_opts.use_all_ciphers,
-        )
-        connector = aiohttp.TCPConnector(
-            resolver=aiohttp.ThreadedResolver() if sys.platform == 'win32' else aiohttp.AsyncResolver()
-        )
-        async with aiohttp.ClientSession(
-            connector=connector, cookie_jar=self.get_cookie_jar(), raise_for_status=True
-        ) as session:
-            try:
-                async with session.request("HEAD", dl_url, headers=self.RQ_HEADER, ssl=ssl_context, timeout=20) as resp:
-                    if resp.url != dl_url:
-                        if resp.history and len(resp.history) > 0:
-                            logging.debug('[%d] URL was %s time(s) redirected', self.task_id, len(resp.history))
-                        else:
-                            logging.debug('[%d] URL has changed after information retrieval', self.task_id)
-
-                    guessed_file_name = posixpath.basename(resp.url.path)
-                    if "Content-Disposition" in resp.headers.keys():
-                        # Exp: Content-Disposition: attachment; filename="filename.jpg"
-                        found_names = re.findall("filename=(.+)", resp.headers["Content-Disposition"])
-                        if len(found_names) > 0:
-                            guessed_file_name = unquote(found_names[0])
-
-                    return HeadInfo(
-                        # Exp: Content-Type: text/html; charset=utf-8
-                        content_type=resp.headers.get('Content-Type', 'text/html').split(';')[0],
-                        content_length=int(resp.headers.get('Content-Length', -1)),
-                        # Exp: Last-Modified: Wed, 21 Oct 2015 07:28:00 GMT
-                        last_modified=resp.headers.get('Last-Modified', None),
-                        final_url=str(resp.url),
-                        guessed_file_name=guessed_file_name,
-                        host=resp.url.host,
-                    )
-
-            except aiohttp.InvalidURL:
-                # don't download urls like 'mailto:name@provider.com'
-                logging.debug(
-                    '[%d] Download of the external file was canceled because the URL has an invalid format',
-                    self.task_id,
+        session = self.session_pool.get_session(dl_url, with_cookies=True)
+        try:
+            async with session.request("HEAD", dl_url, headers=self.RQ_HEADER, timeout=20) as resp:
+                if resp.url != dl_url:
+                    if resp.history and len(resp.history) > 0:
+                        logging.debug('[%d] URL was %s time(s) redirected', self.task_id, len(resp.history))
+                    else:
+                        logging.debug('[%d] URL has changed after information retrieval', self.task_id)
+
+                guessed_file_name = posixpath.basename(resp.url.path)
+                if "Content-Disposition" in resp.headers.keys():
+                    # Exp: Content-Disposition: attachment; filename="filename.jpg"
+                    found_names = re.findall("filename=(.+)", resp.headers["Content-Disposition"])
+                    if len(found_names) > 0:
+                        guessed_file_name = unquote(found_names[0])
+
+                return HeadInfo(
+                    # Exp: Content-Type: text/html; charset=utf-8
+                    content_type=resp.headers.get('Content-Type', 'text/html').split(';')[0],
+                    content_length=int(resp.headers.get('Content-Length', -1)),
+                    # Exp: Last-Modified: Wed, 21 Oct 2015 07:28:00 GMT
+                    last_modified=resp.headers.get('Last-Modified', None),
+                    final_url=str(resp.url),
+                    guessed_file_name=guessed_file_name,
+                    host=resp.url.host,
                 )
-                return None
-            except aiohttp.ClientResponseError as head_err:
-                if head_err.status in [408, 409, 429]:
-                    # 408 (timeout) or 409 (conflict) and 429 (too many requests)
-                    logging.warning(
-                        '[%d] Head request failed with status: %s %s', self.task_id, head_err.status, head_err.message
-                    )
-                    raise head_err from None
 
+        except aiohttp.InvalidURL:
+            # don't download urls like 'mailto:name@provider.com'
+            logging.debug(
+                '[%d] Download of the external file was canceled because the URL has an invalid format',
+                self.task_id,
+            )
+            return None
+        except aiohttp.ClientResponseError as head_err:
+            if self.is_retryable_error(head_err):
                 logging.warning(
-                    '[%d] Download of the external file was canceled because of HTTP error: %s %s',
-                    self.task_id,
-                    head_err.status,
-                    head_err.message,
+                    '[%d] Head request failed with status: %s %s', self.task_id, head_err.status, head_err.message
                 )
-                return None
-
-            except (aiohttp.ClientError, OSError, ValueError, ContentRangeError) as head_err:
-                logging.warning('[%d] Head request for external file failed with unexpected error', self.task_id)
+                self.retry_later(dl_url, self.status.retries + 1, head_err)
                 raise head_err from None
 
+            logging.warning(
+                '[%d] Download of the external file was canceled because of HTTP error: %s %s',
+                self.task_id,
+                head_err.status,
+                head_err.message,
+            )
+            return None
+
+        except (aiohttp.ClientError, OSError, ValueError, ContentRangeError) as head_err:
+            logging.warning('[%d] Head request for external file failed with unexpected error', self.task_id)
+            if not isinstance(head_err, ValueError):
+                self.retry_later(dl_url, self.status.retries + 1, head_err)
+            raise head_err from None
+
     async def download_using_yt_dlp(self, dl_url: str, infos: HeadInfo, delete_if_successful: bool):
         """
         @param delete_if_successful: Deletes the tmp file if download was successful
@@ -493,6 +590,12 @@ class Task:
             raise RuntimeError('The external downloader could not download the URL')
 
         self.file.saved_to = str(Path(self.destination) / self.filename)
+        if os.path.isfile(self.file.saved_to):
+            # The file is written by the external downloader, so it needs to be read to hash it
+            hasher, hashed_bytes = await asyncio.get_running_loop().run_in_executor(
+                None, self.hash_file, self.file.saved_to
+            )
+            self.set_content_info(hashed_bytes, hasher.hexdigest())
 
     async def external_download_url(self, add_token: bool, delete_if_successful: bool, needs_moodle_cookies: bool):
         """
@@ -597,13 +700,12 @@ class Task:
         for link_type, should_write in self.opts.write_links.items():
             if should_write:
                 self.set_path(True, link_type)
-                async with aiofiles.open(
-                    self.file.saved_to, 'w+', encoding='utf-8', newline='\r\n' if link_type == 'url' else '\n'
-                ) as shortcut:
-                    template_vars = {'url': self.file.content_fileurl}
-                    if link_type == 'desktop':
-                        template_vars['filename'] = self.file.saved_to[: -(len(link_type) + 1)]
-                    await shortcut.write(LINK_TEMPLATES[link_type] % template_vars)
+                template_vars = {'url': self.file.content_fileurl}
+                if link_type == 'desktop':
+                    template_vars['filename'] = self.file.saved_to[: -(len(link_type) + 1)]
+                await self.write_content(
+                    self.encode_text(LINK_TEMPLATES[link_type] % template_vars, '\r\n' if link_type == 'url' else '\n')
+                )
 
     def set_path(self, ignore_attributes: bool = False, force_file_extension=None):
         """Set the path where a file should be created. The file type is used to set the needed file extension.
@@ -638,10 +740,10 @@ class Task:
         if md_content == '':
             logging.debug('[%d] Remove target file because description file would be empty', self.task_id)
             os.remove(self.file.saved_to)
+            self.set_content_info(0, None)
             return
 
-        async with aiofiles.open(self.file.saved_to, 'w+', encoding='utf-8') as md_file:
-            await md_file.write(md_content)
+        await self.write_content(self.encode_text(md_content))
 
     async def create_html_file(self):
         "Create a HTML file"
@@ -654,10 +756,10 @@ class Task:
         if html_content == '':
             logging.debug('[%d] Remove target file because html file would be empty', self.task_id)
             os.remove(self.file.saved_to)
+            self.set_content_info(0, None)
             return
 
-        async with aiofiles.open(self.file.saved_to, 'w+', encoding='utf-8') as html_file:
-            await html_file.write(html_content)
+        await self.write_content(self.encode_text(html_content))
 
     def move_old_file(self) -> bool:
         """
@@ -677,6 +779,7 @@ class Task:
             # On Windows, the temporary file must be deleted first.
             os.remove(self.file.saved_to)
             shutil.move(old_path, self.file.saved_to)
+            self.set_content_info(self.file.old_file.content_size, self.file.old_file.content_hash)
             return True
         except OSError as e:
             logging.warning('[%d] Moving the old file %s failed unexpectedly!  Error: %s', self.task_id, old_path, e)
@@ -690,8 +793,7 @@ class Task:
         with urllib.request.urlopen(url_to_download) as response:
             data = response.read()
 
-        async with aiofiles.open(self.file.saved_to, "wb") as target_file:
-            await target_file.write(data)
+        await self.write_content(data)
 
     async def run(self):
         if self.status.state != TaskState.INIT:
@@ -703,11 +805,7 @@ class Task:
             return
         self.status.state = TaskState.STARTED
 
-        success = await self.real_run()
-
-        if success:
-            self.set_utime()
-            self.file.time_stamp = int(time.time())
+        await self.real_run()
 
     async def real_run(self) -> bool:
         try:
@@ -715,7 +813,7 @@ class Task:
             PT.make_dirs(self.destination)
 
             # If file was modified try rename the old file, before create new one
-            if self.file.modified:
+            if self.file.modified and self.status.restarts == 0:
                 self.rename_old_file()
 
             # Create an empty destination file
@@ -756,11 +854,22 @@ class Task:
                 url_to_download = self.file.content_fileurl
                 logging.debug('[%d] Downloading %s', self.task_id, url_to_download)
                 url_to_download = self.add_token_to_url(self.file.content_fileurl)
-                await self.download_url(url_to_download, self.file.saved_to)
+                if not await self.link_stored_content():
+                    await self.download_url(url_to_download, self.file.saved_to)
 
             logging.debug('[%d] Download finished', self.task_id)
+            # Set before reporting, so that the saved file entry contains them
+            self.set_utime()
+            self.file.time_stamp = int(time.time())
             self.report_success()
             return True
+        except RetryLaterError as retry:
+            # The download slot is free for other tasks in the meantime
+            logging.debug('[%d] Retrying in %.1fs: %s', self.task_id, retry.delay, retry.error)
+            self.clean_up_unfinished()
+            self.status.retries += 1
+            self.status.retry_delay = retry.delay
+            self.status.state = TaskState.INIT
         except Exception as dl_err:
             self.status.error = dl_err
 
@@ -783,31 +892,57 @@ class Task:
             logging.debug('[%d] Traceback:\n%s', self.task_id, traceback.format_exc())
 
             # TODO: Do this in the error handlers of download functions
-            # TODO: See download_url; remove only if not recoverable
+            # Resumable downloads keep their own .part file, see download_url
             PT.remove_file(self.file.saved_to)
             self.report_received_bytes(-self.status.bytes_downloaded)
             self.report_failure()
 
         return False
 
-    def get_cookie_jar(self) -> aiohttp.CookieJar:
-        # TODO: Since we currently do not modify the cookieJar we could just use a deep copied instance.
-        if self.opts.cookies_text is not None:
-            cookie_jar = MoodleDLCookieJar(StringIO(self.opts.cookies_text))
-            cookie_jar.load(ignore_discard=True, ignore_expires=True)
-            return convert_to_aiohttp_cookie_jar(cookie_jar)
-        return None
-
     async def check_range_download_opt(self, url, session):
         try:
             headers = self.RQ_HEADER.copy()
             headers['Range'] = 'bytes=0-4'
-            resp = await session.request("GET", url, headers=headers)
-            return resp.headers.get('Content-Range') is not None and resp.status == 206
+            async with session.request("GET", url, headers=headers) as resp:
+                return resp.headers.get('Content-Range') is not None and resp.status == 206
         except Exception as err:
             logging.debug("Failed to check if download can be continued on fail: %s", err)
         return False
 
+    def clean_up_unfinished(self):
+        "Removes the traces of a task that stopped early. A .part file of a download that can be continued is kept."
+        PT.remove_file(self.file.saved_to)
+        self.report_received_bytes(-self.status.bytes_downloaded)
+        if self.status.external_total_size != 0:
+            # The size is reported again when the task is started again
+            self.callback(DlEvent.TOTAL_SIZE_UPDATE, self, content_length_diff=-self.status.external_total_size)
+            self.status.external_total_size = 0
+
+    def reset_after_cancel(self, error: Exception = None):
+        """
+        Cleans up after the task was cancelled while it was running, like a stalled download.
+        @param error: The error the task fails with, or None if it is started again
+        """
+        self.clean_up_unfinished()
+        if error is not None:
+            self.status.error = error
+            self.report_failure()
+            return
+        self.status.restarts += 1
+        self.status.state = TaskState.INIT
+
+    def fail_without_running(self, error: Exception):
+        "Reports the task as failed without starting it"
+        self.status.error = error
+        self.report_failure()
+
+    def reset_after_failure(self):
+        "Prepares a failed task to be started again"
+        self.clean_up_unfinished()
+        self.status.error = None
+        self.status.state = TaskState.INIT
+        self.callback(DlEvent.RETRY, self)
+
     def report_success(self):
         self.status.state = TaskState.FINISHED
         self.callback(DlEvent.FINISHED, self)
@@ -816,6 +951,15 @@ class Task:
         self.status.state = TaskState.FAILED
         self.callback(DlEvent.FAILED, self)
 
+    @contextlib.contextmanager
+    def receiving(self):
+        "Marks that the body of a response is received, only then the stall watchdog measures the throughput"
+        self.status.open_transfers += 1
+        try:
+            yield
+        finally:
+            self.status.open_transfers -= 1
+
     def report_received_bytes(self, bytes_received: int):
         self.status.bytes_downloaded += bytes_received
         self.callback(DlEvent.RECEIVED, self, bytes_received=bytes_received)
@@ -827,119 +971,310 @@ class Task:
                     self.status.external_total_size = content_length
                 self.callback(DlEvent.TOTAL_SIZE, self, content_length=content_length)
 
+    @staticmethod
+    def is_transient_error(err: Exception) -> bool:
+        "Returns if a download error is worth to be retried later, like a broken connection or an overloaded server"
+        if isinstance(err, aiohttp.ClientResponseError):
+            return err.status in [408, 409, 429] or err.status >= 500
+        return True
+
+    def is_worth_final_retry(self) -> bool:
+        """
+        Returns if the task failed with an error, that is worth to be retried once at the end of the download.
+        The retry costs a token of the retry budget, so that hosts that are down are not tried again.
+        """
+        return (
+            self.status.state == TaskState.FAILED
+            and not self.status.skip_requested
+            and self.is_host_error(self.status.error)
+            and self.retry_policy.take_token(self.file.content_fileurl)
+        )
+
+    @classmethod
+    def is_host_error(cls, err: Exception) -> bool:
+        "Returns if a download error is caused by a broken connection or an overloaded server"
+        return isinstance(err, (aiohttp.ClientError, OSError)) and cls.is_transient_error(err)
+
+    @staticmethod
+    def is_retryable_error(err: Exception) -> bool:
+        "Returns if a download error is worth to be retried in this run"
+        if isinstance(err, aiohttp.ClientResponseError):
+            # 408 (timeout), 409 (conflict), 429 (too many requests) and 503 (unavailable)
+            return err.status in [408, 409, 429, 503]
+        return True
+
+    def get_retry_delay(self, dl_url: str, done_tries: int, err: Exception) -> float:
+        "@return: Seconds to wait before the next try, or None if the download should not be retried"
+        if done_tries >= self.MAX_DL_RETRIES or not self.is_retryable_error(err):
+            return None
+        retry_after = None
+        if isinstance(err, aiohttp.ClientResponseError) and err.headers is not None:
+            retry_after = err.headers.get('Retry-After')
+        return self.retry_policy.next_delay(dl_url, done_tries, retry_after)
+
+    def retry_later(self, dl_url: str, done_tries: int, err: Exception):
+        "Raises RetryLaterError, if the download should be retried"
+        retry_delay = self.get_retry_delay(dl_url, done_tries, err)
+        if retry_delay is not None:
+            raise RetryLaterError(retry_delay, err) from None
+
+    def load_partial_download(self, url_key: str) -> (PartialDownload, int):
+        """
+        Looks up an interrupted download of an earlier run
+        @return: The partial download and the number of bytes in its .part file, or None and 0
+        """
+        partial = self.partial_downloads.get(url_key)
+        if partial is None:
+            return None, 0
+        try:
+            # The .part file is the truth, it can contain more bytes than recorded, if moodle-dl was killed
+            part_size = os.path.getsize(partial.part_path)
+        except OSError:
+            part_size = 0
+        if part_size == 0 or partial.get_validator() is None:
+            PT.remove_file(partial.part_path)
+            self.partial_downloads.remove(url_key)
+            return None, 0
+        logging.info(
+            '[%d] Continue interrupted download at %s: %s', self.task_id, format_bytes(part_size), partial.part_path
+        )
+        return partial, part_size
+
     async def download_url(self, dl_url: str, dest_path: str, timeout: int = None):
-        total_bytes_received = 0
-        done_tries = 0
-        can_continue_on_fail = False
-        file_obj = None
+        """
+        Downloads a URL to dest_path. The data is written to a .part file, that is renamed when the download is
+        complete. If a big download fails, but the server supports range requests, the .part file is kept
+        and the download is continued in the next run (as long as the file did not change on the server).
+        If the URL was downloaded before and a local copy still exists, the request is sent conditional and
+        the local copy is used, if the file did not change on the server.
+        """
+        url_key = get_url_key(dl_url)
+        partial, total_bytes_received = self.load_partial_download(url_key)
+        part_path = partial.part_path if partial is not None else dest_path + '.part'
+        session = self.session_pool.get_session(dl_url, with_cookies=True)
+
+        local_copy = None
         headers = self.RQ_HEADER.copy()
-        ssl_context = SslHelper.get_ssl_context(
-            self.opts.global_opts.skip_cert_verify,
-            self.opts.global_opts.allow_insecure_ssl,
-            self.opts.global_opts.use_all_ciphers,
-        )
-        with Timer() as watch:
-            connector = aiohttp.TCPConnector(
-                resolver=aiohttp.ThreadedResolver() if sys.platform == 'win32' else aiohttp.AsyncResolver()
-            )
-            async with aiohttp.ClientSession(
-                connector=connector, cookie_jar=self.get_cookie_jar(), raise_for_status=True
-            ) as session:
-                while done_tries < self.MAX_DL_RETRIES:
-                    try:
-                        if done_tries > 0:
-                            logging.debug(
-                                '[%d] Start downloading (Try %d of %d)',
-                                self.task_id,
-                                done_tries + 1,
-                                self.MAX_DL_RETRIES,
-                            )
+        if partial is None:
+            validator = self.http_validators.get(url_key)
+            other_paths = [self.file.old_file.saved_to] if self.file.old_file is not None else []
+            local_copy = self.http_validators.get_local_copy(validator, other_paths)
+            if local_copy is not None:
+                headers.update(self.http_validators.get_conditional_headers(validator))
+
+        if (
+            partial is None
+            and local_copy is None
+            and self.segmented_downloads.should_segment(self.file.content_filesize)
+        ):
+            if await self.download_segmented(dl_url, url_key, part_path, dest_path, session, timeout):
+                os.replace(part_path, dest_path)
+                # The segments are written in parallel at their offsets, so the file needs to be read to hash it
+                content_hasher, hashed_bytes = await asyncio.get_running_loop().run_in_executor(
+                    None, self.hash_file, dest_path
+                )
+                await self.store_content(dest_path, hashed_bytes, content_hasher.hexdigest())
+                logging.debug('[%d] Successfully downloaded %s in segments', self.task_id, dest_path)
+                return
 
-                        if done_tries > 0 and can_continue_on_fail:
-                            headers['Range'] = f'bytes={total_bytes_received}-'
-                        elif not can_continue_on_fail and 'Range' in headers:
-                            del headers['Range']
+        if total_bytes_received > 0:
+            self.report_received_bytes(total_bytes_received)
 
-                        async with session.request(
-                            "GET", dl_url, headers=headers, ssl=ssl_context, timeout=timeout
-                        ) as resp:
-                            content_length = int(resp.headers.get("Content-Length", 0))
-                            self.report_content_length(content_length)
-                            content_range = resp.headers.get("Content-Range")  # Exp: bytes 200-1000/67589
+        done_tries = self.status.retries
+        can_continue_on_fail = partial is not None
+        content_hasher = None
+        if total_bytes_received > 0:
+            # The received part of an interrupted download needs to be read once to continue the hash
+            content_hasher, _hashed_bytes = await asyncio.get_running_loop().run_in_executor(
+                None, self.hash_file, part_path, total_bytes_received
+            )
+        with Timer() as watch:
+            while done_tries < self.MAX_DL_RETRIES:
+                file_obj = None
+                try:
+                    if done_tries > 0:
+                        logging.debug(
+                            '[%d] Start downloading (Try %d of %d)',
+                            self.task_id,
+                            done_tries + 1,
+                            self.MAX_DL_RETRIES,
+                        )
+
+                    headers.pop('Range', None)
+                    headers.pop('If-Range', None)
+                    if total_bytes_received > 0 and can_continue_on_fail:
+                        headers.pop('If-None-Match', None)
+                        headers.pop('If-Modified-Since', None)
+                        headers['Range'] = f'bytes={total_bytes_received}-'
+                        if partial is not None:
+                            # The server sends the whole file instead, if it changed in the meantime
+                            headers['If-Range'] = partial.get_validator()
+
+                    async with session.request("GET", dl_url, headers=headers, timeout=timeout) as resp:
+                        if resp.status == 304:
+                            if local_copy is not None and await self.use_local_copy(
+                                local_copy, part_path, dest_path, url_key, validator
+                            ):
+                                return
+                            if local_copy is None:
+                                # Only conditional requests may be answered with 304
+                                raise aiohttp.ClientResponseError(
+                                    resp.request_info,
+                                    resp.history,
+                                    status=resp.status,
+                                    message='Not Modified, but no conditional request was sent',
+                                    headers=resp.headers,
+                                )
+                            # The local copy is gone, so the whole file is requested again
+                            local_copy = None
+                            headers.pop('If-None-Match', None)
+                            headers.pop('If-Modified-Since', None)
+                            continue
 
-                            if resp.status not in [200, 206]:
-                                logging.debug('[%d] Warning got status %s', self.task_id, resp.status)
+                        content_length = int(resp.headers.get("Content-Length", 0))
+                        content_range = resp.headers.get("Content-Range")  # Exp: bytes 200-1000/67589
+                        etag = resp.headers.get('ETag')
+                        last_modified = resp.headers.get('Last-Modified')
+                        content_type = resp.headers.get('Content-Type')
 
-                            if done_tries > 0 and can_continue_on_fail and not content_range and resp.status != 206:
+                        if resp.status not in [200, 206]:
+                            logging.debug('[%d] Warning got status %s', self.task_id, resp.status)
+
+                        if 'Range' in headers and resp.status == 206:
+                            if content_range is None or not content_range.startswith(f'bytes {total_bytes_received}-'):
                                 raise ContentRangeError(
                                     f"[{self.task_id}] Server did not response with requested range data"
                                 )
-
-                            file_obj = file_obj or await aiofiles.open(dest_path, "wb")
+                            total_size = content_range.rsplit('/', 1)[-1]
+                            if total_size.isdigit():
+                                self.report_content_length(int(total_size))
+                        else:
+                            if total_bytes_received > 0:
+                                logging.debug('[%d] Server sent the whole file, restarting the download', self.task_id)
+                                self.report_received_bytes(-total_bytes_received)
+                                total_bytes_received = 0
+                            self.report_content_length(content_length)
+                            partial = self.record_partial_download(url_key, part_path, resp, content_length, partial)
+                            can_continue_on_fail = partial is not None
+
+                        bytes_expected = total_bytes_received + content_length
+                        if total_bytes_received == 0:
+                            content_hasher = hashlib.sha256()
+                        file_obj = await aiofiles.open(part_path, "ab" if total_bytes_received > 0 else "wb")
+                        if total_bytes_received > 0:
+                            # Drop everything after the last byte we know was received completely
+                            await file_obj.truncate(total_bytes_received)
+                        with self.receiving():
                             async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
                                 if self.status.skip_requested:
                                     logging.info('[%d] Download skipped by user', self.task_id)
-                                    if file_obj is not None and not file_obj.closed:
-                                        await file_obj.close()
-                                    PT.remove_file(dest_path)
+                                    await file_obj.close()
+                                    PT.remove_file(part_path)
+                                    self.partial_downloads.remove(url_key)
                                     self.report_received_bytes(-total_bytes_received)
                                     raise RuntimeError('Download skipped by user')
+                                await file_obj.write(chunk)
+                                if content_hasher is not None:
+                                    content_hasher.update(chunk)
                                 bytes_received = len(chunk)
                                 total_bytes_received += bytes_received
                                 self.report_received_bytes(bytes_received)
-                                await file_obj.write(chunk)
 
-                        if file_obj is not None and not file_obj.closed:
-                            await file_obj.close()
+                    await file_obj.close()
 
-                        if content_length >= 0 and total_bytes_received < content_length:
-                            raise ContentTooShortError(
-                                f'[{self.task_id}] Download incomplete: Got only {format_bytes(total_bytes_received)}'
-                                + f' out of {format_bytes(content_length)} bytes',
-                                dest_path,
-                            )
-
-                        logging.debug('[%d] Successfully downloaded %s', self.task_id, dest_path)
-                        break
+                    if content_length >= 0 and total_bytes_received < bytes_expected:
+                        raise ContentTooShortError(
+                            f'[{self.task_id}] Download incomplete: Got only {format_bytes(total_bytes_received)}'
+                            + f' out of {format_bytes(bytes_expected)} bytes',
+                            dest_path,
+                        )
 
-                    except (aiohttp.ClientError, OSError, ValueError, ContentRangeError) as err:
-                        if done_tries == 0:
-                            can_continue_on_fail = await self.check_range_download_opt(dl_url, session)
-
-                        done_tries += 1
+                    os.replace(part_path, dest_path)
+                    self.partial_downloads.remove(url_key)
+                    self.http_validators.save(
+                        url_key, etag, last_modified, total_bytes_received, content_type, dest_path
+                    )
+                    if content_hasher is not None:
+                        await self.store_content(dest_path, total_bytes_received, content_hasher.hexdigest())
+                    self.retry_policy.record_success(dl_url)
+                    logging.debug('[%d] Successfully downloaded %s', self.task_id, dest_path)
+                    break
+
+                except asyncio.CancelledError:
+                    if file_obj is not None and not file_obj.closed:
+                        await file_obj.close()
+                    if partial is not None and total_bytes_received > 0:
+                        # Keep the .part file, the download is continued when the task is started again
+                        partial.bytes_received = total_bytes_received
+                        self.partial_downloads.save(partial)
+                    else:
+                        PT.remove_file(part_path)
+                    raise
+
+                except (aiohttp.ClientError, OSError, ValueError, ContentRangeError) as err:
+                    if file_obj is not None and not file_obj.closed:
+                        await file_obj.close()
+
+                    done_tries += 1
+                    if isinstance(err, aiohttp.ClientResponseError) and err.status == 416 and 'Range' in headers:
+                        # The .part file does not fit to the file on the server anymore, so start from zero
+                        logging.debug('[%d] Requested range is not available, restarting the download', self.task_id)
+                        PT.remove_file(part_path)
+                        self.partial_downloads.remove(url_key)
+                        partial = None
+                        can_continue_on_fail = False
+                        self.report_received_bytes(-total_bytes_received)
+                        total_bytes_received = 0
+                        continue
+
+                    if done_tries == 1 and not can_continue_on_fail:
+                        can_continue_on_fail = await self.check_range_download_opt(dl_url, session)
+
+                    retry_delay = self.get_retry_delay(dl_url, done_tries, err)
+                    if (
+                        (not can_continue_on_fail and total_bytes_received > 0)
+                        or isinstance(err, ContentRangeError)
+                        or retry_delay is None
+                        or not self.is_transient_error(err)
+                    ):
                         if (
-                            (not can_continue_on_fail and total_bytes_received > 0)
-                            or isinstance(err, ContentRangeError)
-                            or (done_tries >= self.MAX_DL_RETRIES)
+                            partial is not None
+                            and total_bytes_received > 0
+                            and self.is_transient_error(err)
+                            and not isinstance(err, ContentRangeError)
                         ):
-                            can_continue_on_fail = False
+                            # Keep the .part file, the download is continued in the next run
+                            logging.info(
+                                '[%d] Keeping %s of the interrupted download for the next run',
+                                self.task_id,
+                                format_bytes(total_bytes_received),
+                            )
+                            partial.bytes_received = total_bytes_received
+                            self.partial_downloads.save(partial)
+                        else:
                             # Clean up failed file because we can not recover
-                            if file_obj is not None and not file_obj.closed:
-                                await file_obj.close()
-                            file_obj = None
-
-                            # TODO: If download can be continued and size > 0,
-                            #  remember that the file started downloading, and continue downloading
-                            #  on next run instead of deleting it.
-                            PT.remove_file(dest_path)
-                            self.report_received_bytes(-total_bytes_received)
-                            total_bytes_received = 0
-
-                        if isinstance(err, aiohttp.ClientResponseError):
-                            if err.status not in [408, 409, 429]:  # pylint: disable=no-member
-                                # 408 (timeout) or 409 (conflict) and 429 (too many requests)
-                                logging.warning(
-                                    '[%d] Download failed with status: %s %s', self.task_id, err.status, err.message
-                                )
-                                raise err from None
+                            PT.remove_file(part_path)
+                            self.partial_downloads.remove(url_key)
+                        partial = None
+                        can_continue_on_fail = False
+                        self.report_received_bytes(-total_bytes_received)
+                        total_bytes_received = 0
+
+                    if not self.is_retryable_error(err):
+                        logging.warning(
+                            '[%d] Download failed with status: %s %s', self.task_id, err.status, err.message
+                        )
+                        raise err from None
 
-                        if done_tries < self.MAX_DL_RETRIES:
-                            logging.debug('[%d] Download error occurred: %s', self.task_id, err)
-                            await asyncio.sleep(1)
-                            continue
+                    if retry_delay is not None:
+                        if partial is not None and total_bytes_received > 0:
+                            # Keep the .part file, the download is continued when the task is started again
+                            partial.bytes_received = total_bytes_received
+                            self.partial_downloads.save(partial)
+                        raise RetryLaterError(retry_delay, err) from None
 
-                        # No more tries
-                        raise err from None
+                    # No more tries
+                    raise err from None
         logging.debug(
             '[%d] Download of %s finished in %s',
             self.task_id,
@@ -947,9 +1282,283 @@ class Task:
             format_seconds(watch.duration),
         )
 
+    async def use_local_copy(
+        self, local_copy: str, part_path: str, dest_path: str, url_key: str, validator: HttpValidator
+    ) -> bool:
+        """
+        Uses the local copy of a file that the server reported as not modified, instead of downloading it.
+        With deduplication the local copy is linked, if its content is known, otherwise it is copied.
+        @return: False if the local copy can not be read anymore
+        """
+        content_hash = self.content_store.find_by_path(local_copy)
+        try:
+            if content_hash is not None:
+                logging.debug('[%d] Not modified, linking the local copy %s', self.task_id, local_copy)
+                await self.link_content(local_copy, dest_path, validator.content_length, content_hash)
+            else:
+                logging.debug('[%d] Not modified, copying the local copy %s', self.task_id, local_copy)
+                content_size, content_hash = await asyncio.get_running_loop().run_in_executor(
+                    None, self.copy_and_hash_file, local_copy, part_path
+                )
+                os.replace(part_path, dest_path)
+                await self.store_content(dest_path, content_size, content_hash)
+        except OSError as copy_err:
+            logging.debug('[%d] Local copy is gone, downloading the whole file: %s', self.task_id, copy_err)
+            PT.remove_file(part_path)
+            return False
+        self.http_validators.save(
+            url_key,
+            validator.etag,
+            validator.last_modified,
+            validator.content_length,
+            validator.content_type,
+            dest_path,
+        )
+        return True
+
+    async def probe_range_download(self, dl_url: str, session: aiohttp.ClientSession, timeout: int) -> (int, Dict):
+        """
+        Tests if the server sends byte ranges of a URL
+        @return: The total size of the file and the response headers, or None and None
+        """
+        try:
+            headers = self.RQ_HEADER.copy()
+            headers['Range'] = 'bytes=0-0'
+            async with session.request("GET", dl_url, headers=headers, timeout=timeout) as resp:
+                content_range = resp.headers.get('Content-Range')  # Exp: bytes 0-0/67589
+                total_size = content_range.rsplit('/', 1)[-1] if content_range is not None else ''
+                if resp.status != 206 or not total_size.isdigit():
+                    return None, None
+                return int(total_size), resp.headers
+        except (aiohttp.ClientError, OSError, ValueError) as err:
+            logging.debug('[%d] Failed to check if the file can be downloaded in segments: %s', self.task_id, err)
+        return None, None
+
+    async def download_segmented(
+        self, dl_url: str, url_key: str, part_path: str, dest_path: str, session: aiohttp.ClientSession, timeout: int
+    ) -> bool:
+        """
+        Downloads a large file with several connections, each fetching one byte range into a preallocated .part file.
+        In case of an failure an exception will be raised and the .part file is removed.
+        @return: False if the file can not be downloaded in segments and needs to be downloaded normally
+        """
+        total_size, probe_headers = await self.probe_range_download(dl_url, session, timeout)
+        if total_size is None or not self.segmented_downloads.should_segment(total_size):
+            return False
+        etag = probe_headers.get('ETag')
+        last_modified = probe_headers.get('Last-Modified')
+        validator = etag if etag is not None and not etag.startswith('W/') else last_modified
+
+        ranges = self.segmented_downloads.get_ranges(total_size)
+        logging.debug('[%d] Downloading %s in %d segments', self.task_id, format_bytes(total_size), len(ranges))
+        self.report_content_length(total_size)
+        async with aiofiles.open(part_path, "wb") as file_obj:
+            await file_obj.truncate(total_size)
+
+        bytes_per_segment = [0] * len(ranges)
+        segment_tasks = [
+            asyncio.ensure_future(
+                self.download_segment(dl_url, part_path, session, timeout, validator, ranges, idx, bytes_per_segment)
+            )
+            for idx in range(len(ranges))
+        ]
+        with Timer() as watch:
+            try:
+                await asyncio.gather(*segment_tasks)
+                part_size = os.path.getsize(part_path)
+                if sum(bytes_per_segment) != total_size or part_size != total_size:
+                    raise ContentTooShortError(
+                        f'[{self.task_id}] Segmented download incomplete: Got {format_bytes(sum(bytes_per_segment))}'
+                        + f' with a file size of {format_bytes(part_size)} out of {format_bytes(total_size)} bytes',
+                        part_path,
+                    )
+            except BaseException as err:
+                for segment_task in segment_tasks:
+                    segment_task.cancel()
+                await asyncio.gather(*segment_tasks, return_exceptions=True)
+                PT.remove_file(part_path)
+                self.report_received_bytes(-sum(bytes_per_segment))
+                if isinstance(err, ContentRangeError):
+                    logging.debug('[%d] %s, downloading without segments', self.task_id, err)
+                    return False
+                raise
+
+        logging.debug(
+            '[%d] Download of %s in %d segments finished in %s',
+            self.task_id,
+            format_bytes(total_size),
+            len(ranges),
+            format_seconds(watch.duration),
+        )
+        self.http_validators.save(
+            url_key, etag, last_modified, total_size, probe_headers.get('Content-Type'), dest_path
+        )
+        return True
+
+    async def download_segment(
+        self,
+        dl_url: str,
+        part_path: str,
+        session: aiohttp.ClientSession,
+        timeout: int,
+        validator: str,
+        ranges: List[Tuple[int, int]],
+        idx: int,
+        bytes_per_segment: List[int],
+    ):
+        "Downloads the byte range idx of a segmented download and writes it at its offset into the .part file"
+        first_byte, last_byte = ranges[idx]
+        position = first_byte
+        done_tries = 0
+        headers = self.RQ_HEADER.copy()
+        async with self.segmented_downloads.semaphore:
+            async with aiofiles.open(part_path, "r+b") as file_obj:
+                while True:
+                    try:
+                        headers['Range'] = f'bytes={position}-{last_byte}'
+                        if validator is not None:
+                            # The server sends the whole file instead, if it changed in the meantime
+                            headers['If-Range'] = validator
+
+                        async with session.request("GET", dl_url, headers=headers, timeout=timeout) as resp:
+                            content_range = resp.headers.get("Content-Range")
+                            if (
+                                resp.status != 206
+                                or content_range is None
+                                or not content_range.startswith(f'bytes {position}-')
+                            ):
+                                raise ContentRangeError(
+                                    f"[{self.task_id}] Server did not response with requested range data"
+                                )
+
+                            await file_obj.seek(position)
+                            with self.receiving():
+                                async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                                    if self.status.skip_requested:
+                                        logging.info('[%d] Download skipped by user', self.task_id)
+                                        raise RuntimeError('Download skipped by user')
+                                    # Never write into the next segment
+                                    chunk = chunk[: last_byte + 1 - position]
+                                    await file_obj.write(chunk)
+                                    position += len(chunk)
+                                    bytes_per_segment[idx] += len(chunk)
+                                    self.report_received_bytes(len(chunk))
+
+                        if position <= last_byte:
+                            raise ContentTooShortError(
+                                f'[{self.task_id}] Segment {idx} incomplete: Got only'
+                                + f' {format_bytes(position - first_byte)}'
+                                + f' out of {format_bytes(last_byte + 1 - first_byte)} bytes',
+                                part_path,
+                            )
+                        self.retry_policy.record_success(dl_url)
+                        return
+
+                    except (aiohttp.ClientError, OSError, ValueError) as err:
+                        done_tries += 1
+                        retry_delay = None
+                        if not isinstance(err, ContentRangeError):
+                            retry_delay = self.get_retry_delay(dl_url, done_tries, err)
+                        if retry_delay is None:
+                            raise err from None
+                        logging.debug(
+                            '[%d] Error in segment %d occurred, retrying in %.1fs: %s',
+                            self.task_id,
+                            idx,
+                            retry_delay,
+                            err,
+                        )
+                        await asyncio.sleep(retry_delay)
+
+    async def link_stored_content(self) -> bool:
+        """
+        Links the file of the task to a local file of the same Moodle file, if one was downloaded before
+        @return: True if the file was linked and does not need to be downloaded
+        """
+        stored_path, content_hash = self.content_store.find_by_identity(
+            self.file.content_fileurl, self.file.content_filesize, self.file.content_timemodified
+        )
+        if stored_path is None or stored_path == self.file.saved_to:
+            return False
+        await self.link_content(stored_path, self.file.saved_to, self.file.content_filesize, content_hash)
+        return True
+
+    async def link_content(self, stored_path: str, dest_path: str, content_size: int, content_hash: str):
+        "Creates dest_path as link to a stored local file with the same content"
+        link_kind = await asyncio.get_running_loop().run_in_executor(
+            None, ContentStore.link_file, stored_path, dest_path
+        )
+        logging.debug('[%d] Same file is already stored, created %s to %s', self.task_id, link_kind, stored_path)
+        if dest_path == self.file.saved_to:
+            self.set_content_info(content_size, content_hash)
+        self.content_store.add(
+            dest_path, content_size, content_hash, self.file.content_fileurl, self.file.content_timemodified
+        )
+
+    async def store_content(self, dest_path: str, content_size: int, content_hash: str):
+        """
+        Saves the content hash of a downloaded file. If a local file with the same content exists,
+        the downloaded file is replaced with a link to it.
+        """
+        if dest_path == self.file.saved_to:
+            self.set_content_info(content_size, content_hash)
+        stored_path = self.content_store.find_by_content(content_size, content_hash)
+        if stored_path is not None and stored_path != dest_path:
+            link_kind = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(ContentStore.link_file, stored_path, dest_path, allow_copy=False)
+            )
+            if link_kind is not None:
+                logging.debug(
+                    '[%d] Same content is already stored, created %s to %s', self.task_id, link_kind, stored_path
+                )
+        self.content_store.add(
+            dest_path, content_size, content_hash, self.file.content_fileurl, self.file.content_timemodified
+        )
+
+    def record_partial_download(
+        self,
+        url_key: str,
+        part_path: str,
+        resp: aiohttp.ClientResponse,
+        content_length: int,
+        old_partial: PartialDownload,
+    ) -> PartialDownload:
+        """
+        Records a starting download in the database, if it can be continued in a later run.
+        This is done before any data is received, so that even a killed moodle-dl can continue the download.
+        @return: The recorded partial download, or None if the download can not be continued
+        """
+        partial = PartialDownload(
+            url_key=url_key,
+            part_path=part_path,
+            bytes_received=0,
+            etag=resp.headers.get('ETag'),
+            last_modified=resp.headers.get('Last-Modified'),
+            time_stamp=int(time.time()),
+        )
+        if (
+            partial.get_validator() is not None
+            and resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            and content_length >= self.MIN_RESUMABLE_SIZE
+        ):
+            self.partial_downloads.save(partial)
+            return partial
+        if old_partial is not None:
+            self.partial_downloads.remove(url_key)
+        return None
+
     def __str__(self):
         return f'Task ({self.task_id}, {self.file}, {self.course}, {self.status})'
 
 
 class ContentRangeError(ConnectionError):
     pass
+
+
+class RetryLaterError(Exception):
+    "Stops a task, that is started again after a delay"
+
+    def __init__(self, delay: float, error: Exception):
+        super().__init__(f'Retry in {delay:.1f}s: {error}')
+        self.delay = delay
+        self.error = error
@@ -147,8 +147,8 @@ class DatabaseManagementDialog(QDialog):
         from moodle_dl.database import StateRecorder
 
         files = [item.data(0, Qt.ItemDataRole.UserRole) for item in selected]
-        database = StateRecorder(self.config, self.opts)
-        database.batch_delete_files_from_db(files)
+        with StateRecorder(self.config, self.opts) as database:
+            database.batch_delete_files_from_db(files)
         set_status_text(
             self.status_label, self.tr('Deleted {} entry(ies). Refreshing\u2026').format(len(files)), 'success'
         )
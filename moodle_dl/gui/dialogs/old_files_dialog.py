@@ -162,8 +162,8 @@ class OldFilesDialog(QDialog):
                     logging.warning('Failed to delete %s: %s', f.saved_to, e)
 
         # Delete entries from database
-        database = StateRecorder(self.config, self.opts)
-        database.batch_delete_files_from_db(files)
+        with StateRecorder(self.config, self.opts) as database:
+            database.batch_delete_files_from_db(files)
         set_status_text(
             self.status_label,
             self.tr('Deleted {} file(s) from disk and {} DB entry(ies). Refreshing\u2026').format(
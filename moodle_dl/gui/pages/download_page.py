@@ -174,6 +174,7 @@ class DownloadPage(QWidget):
     def _on_fetch_finished(self, courses, database) -> None:
         """Scan complete — populate preview table."""
         self._fetched_courses = courses
+        self._close_fetched_database()
         self._fetched_database = database
         self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(0)
@@ -303,15 +304,20 @@ class DownloadPage(QWidget):
             self.progress_bar.setValue(pct)
 
         done = status.files_downloaded + status.files_failed
-        self.stats_label.setText(
-            self.tr('{} / {} | Done: {} / {} | Failed: {}').format(
-                format_bytes(status.bytes_downloaded),
-                format_bytes(status.bytes_to_download),
-                done,
-                status.files_to_download,
-                status.files_failed,
-            )
+        stats_text = self.tr('{} / {} | Done: {} / {} | Failed: {}').format(
+            format_bytes(status.bytes_downloaded),
+            format_bytes(status.bytes_to_download),
+            done,
+            status.files_to_download,
+            status.files_failed,
         )
+        # The fake download service of --without-downloading-files saves directly
+        state_writer = getattr(self._download_service, 'state_writer', None)
+        if state_writer is not None and state_writer.is_full():
+            # Downloads are held back until the database caught up
+            unsaved_changes = state_writer.changes_queued - state_writer.changes_saved
+            stats_text += self.tr(' | Saving: {}').format(unsaved_changes)
+        self.stats_label.setText(stats_text)
 
         self._task_model.refresh()
 
@@ -457,6 +463,9 @@ class DownloadPage(QWidget):
         if self._notify_worker is not None and self._notify_worker.isRunning():
             self._notify_worker.quit()
             self._notify_worker.wait(3000)
+        workers = [self._fetch_worker, self._download_worker, self._notify_worker]
+        if all(worker is None or not worker.isRunning() for worker in workers):
+            self._close_fetched_database()
 
     # -------------------------------------------------------------------
     # Helpers
@@ -472,6 +481,12 @@ class DownloadPage(QWidget):
         self.table_view.setItemDelegateForColumn(TaskTableModel.COL_SKIP, self._skip_delegate)
         self.table_view.setItemDelegateForColumn(PreviewTableModel.COL_SELECT, None)
 
+    def _close_fetched_database(self) -> None:
+        """Save the pending writes of the scanned database and close it."""
+        if self._fetched_database is not None:
+            self._fetched_database.close()
+            self._fetched_database = None
+
     def _reset_to_idle(self) -> None:
         """Reset all UI state to idle."""
         self._phase = Phase.IDLE
@@ -485,7 +500,7 @@ class DownloadPage(QWidget):
         self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(0)
         self._fetched_courses = None
-        self._fetched_database = None
+        self._close_fetched_database()
 
         # Switch back to preview model
         self.table_view.setModel(self._preview_model)
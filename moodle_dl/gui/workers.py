@@ -136,8 +136,13 @@ class FetchWorker(AsyncWorker):
         database = StateRecorder(self.config, self.opts)
 
         logging.info('Checking for changes...')
-        changed_courses = await moodle.fetch_state(database)
+        try:
+            changed_courses = await moodle.fetch_state(database)
+        except Exception:
+            database.close()
+            raise
 
+        # The receiver owns the database from now on and has to close it
         self.fetch_finished.emit(changed_courses, database)
 
 
@@ -370,8 +375,8 @@ class FetchStoredFilesWorker(AsyncWorker):
     async def do_work(self) -> None:
         import os
 
-        database = StateRecorder(self.config, self.opts)
-        courses = database.get_stored_files()
+        with StateRecorder(self.config, self.opts) as database:
+            courses = database.get_stored_files()
         # Filter to files that no longer exist on disk
         for course in courses:
             course.files = [f for f in course.files if f.saved_to and not os.path.exists(f.saved_to)]
@@ -390,6 +395,6 @@ class FetchOldFilesWorker(AsyncWorker):
         self.opts = opts
 
     async def do_work(self) -> None:
-        database = StateRecorder(self.config, self.opts)
-        courses = database.get_old_files()
+        with StateRecorder(self.config, self.opts) as database:
+            courses = database.get_old_files()
         self.files_fetched.emit(courses)
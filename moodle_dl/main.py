@@ -33,7 +33,7 @@ from moodle_dl.downloader.download_service import DownloadService
 from moodle_dl.downloader.fake_download_service import FakeDownloadService
 from moodle_dl.moodle.moodle_service import MoodleService
 from moodle_dl.notifications import get_all_notify_services
-from moodle_dl.types import MoodleDlOpts
+from moodle_dl.types import DownloadOrder, MoodleDlOpts
 from moodle_dl.utils import PathTools as PT
 from moodle_dl.utils import ProcessLock, check_debug
 from moodle_dl.version import __version__
@@ -66,6 +66,8 @@ def choose_task(config: ConfigHelper, opts: MoodleDlOpts):
         DatabaseManager(config, opts).delete_old_files()
     elif opts.manage_database:
         DatabaseManager(config, opts).interactively_manage_database()
+    elif opts.verify_local_files:
+        DatabaseManager(config, opts).verify_local_files()
     elif opts.new_token:
         MoodleWizard(config, opts).interactively_acquire_token(use_stored_url=True)
     else:
@@ -84,6 +86,21 @@ def connect_sentry(config: ConfigHelper) -> bool:
     return False
 
 
+async def run_pipeline(moodle: MoodleService, database: StateRecorder, downloader: DownloadService):
+    "Downloads the changes of every course as soon as they are known, while other courses are still loading"
+    downloader.expect_more_courses()
+    download_run = asyncio.create_task(downloader.real_run())
+    try:
+        await moodle.fetch_state(database, changes_callback=downloader.add_courses)
+    except asyncio.CancelledError:
+        download_run.cancel()
+        raise
+    finally:
+        downloader.no_more_courses()
+        # Also if the fetch failed, the download of the already queued courses is finished and saved
+        await download_run
+
+
 def run_main(config: ConfigHelper, opts: MoodleDlOpts):
     sentry_connected = connect_sentry(config)
     notify_services = get_all_notify_services(config)
@@ -91,26 +108,34 @@ def run_main(config: ConfigHelper, opts: MoodleDlOpts):
     # TODO: Change this
     PT.restricted_filenames = config.get_restricted_filenames()
 
+    database = None
     try:
         moodle = MoodleService(config, opts)
 
         logging.debug('Checking for changes for the configured Moodle-Account....')
         database = StateRecorder(config, opts)
-        changed_courses = asyncio.run(moodle.fetch_state(database))
+        if opts.pipeline and not opts.without_downloading_files and not opts.log_responses:
+            downloader = DownloadService([], config, opts, database)
+            asyncio.run(run_pipeline(moodle, database, downloader))
+        else:
+            changed_courses = asyncio.run(moodle.fetch_state(database))
 
-        if opts.log_responses:
-            logging.info("All JSON-responses from Moodle have been written to the responses.log file.")
-            return
+            if opts.log_responses:
+                logging.info("All JSON-responses from Moodle have been written to the responses.log file.")
+                return
 
-        logging.debug('Start downloading changed files...')
+            logging.debug('Start downloading changed files...')
 
-        if opts.without_downloading_files:
-            downloader = FakeDownloadService(changed_courses, config, opts, database)
-        else:
-            downloader = DownloadService(changed_courses, config, opts, database)
-        downloader.run()
+            if opts.without_downloading_files:
+                downloader = FakeDownloadService(changed_courses, config, opts, database)
+            else:
+                downloader = DownloadService(changed_courses, config, opts, database)
+            downloader.run()
         failed_downloads = downloader.get_failed_tasks()
 
+        if opts.incremental_sync:
+            moodle.courses_synced(database, [task.course.id for task in failed_downloads])
+
         changed_courses_to_notify = database.changes_to_notify()
 
         if len(changed_courses_to_notify) > 0:
@@ -139,6 +164,11 @@ def run_main(config: ConfigHelper, opts: MoodleDlOpts):
 
         raise base_err
 
+    finally:
+        if database is not None:
+            # Also keep the changes that were saved before an interruption
+            database.close()
+
 
 def setup_logger(opts: MoodleDlOpts):
     file_log_handler = RotatingFileHandler(
@@ -310,6 +340,18 @@ def get_parser():
         ),
     )
 
+    group.add_argument(
+        '-vlf',
+        '--verify-local-files',
+        dest='verify_local_files',
+        default=False,
+        action='store_true',
+        help=(
+            'Compare the downloaded files with the database and report missing, truncated, locally changed'
+            + ' and orphaned files. Use it together with --verify-hashes and --requeue-broken-files.'
+        ),
+    )
+
     group.add_argument(
         '--log-responses',
         dest='log_responses',
@@ -396,6 +438,43 @@ def get_parser():
         help=('Sets the number of max parallel Moodle Mobile API calls. (default: %(default)s)'),
     )
 
+    parser.add_argument(
+        '-aac',
+        '--adaptive-api-calls',
+        dest='adaptive_api_calls',
+        default=False,
+        action='store_true',
+        help=(
+            'Adapt the number of parallel Moodle Mobile API calls to the load of the Moodle server.'
+            + ' It grows while the server answers fast and shrinks if the server is overloaded,'
+            + ' but never exceeds --max-parallel-api-calls. The changes are logged with --verbose.'
+        ),
+    )
+
+    parser.add_argument(
+        '-abs',
+        '--api-batch-size',
+        dest='api_batch_size',
+        default=1,
+        type=int,
+        help=(
+            'Sets the number of max Moodle Mobile API calls that are combined into one request, for example 10.'
+            + ' Batching requires Moodle 3.7 or newer, 1 disables batching. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-abw',
+        '--api-batch-window',
+        dest='api_batch_window',
+        default=0.05,
+        type=float,
+        help=(
+            'Sets the max time in seconds an API call waits for other calls to join its batch.'
+            + ' (default: %(default)s)'
+        ),
+    )
+
     parser.add_argument(
         '-mpd',
         '--max-parallel-downloads',
@@ -405,13 +484,151 @@ def get_parser():
         help=('Sets the number of max parallel downloads. (default: %(default)s)'),
     )
 
+    parser.add_argument(
+        '-apd',
+        '--auto-parallel-downloads',
+        dest='auto_parallel_downloads',
+        default=False,
+        action='store_true',
+        help=(
+            'Adjust the number of parallel downloads to the measured throughput. It is searched between'
+            + ' --min-parallel-downloads and --max-parallel-downloads. The changes are logged with --verbose.'
+        ),
+    )
+
+    parser.add_argument(
+        '-mipd',
+        '--min-parallel-downloads',
+        dest='min_parallel_downloads',
+        default=1,
+        type=int,
+        help=('Sets the number of min parallel downloads for --auto-parallel-downloads. (default: %(default)s)'),
+    )
+
     parser.add_argument(
         '-mpyd',
         '--max-parallel-yt-dlp',
         dest='max_parallel_yt_dlp',
         default=5,
         type=int,
-        help=('Sets the number of max parallel downloads using yt-dlp. (default: %(default)s)'),
+        help=(
+            'Sets the number of max parallel downloads using yt-dlp. External links that may be downloaded'
+            + ' with yt-dlp have their own download slots. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-mped',
+        '--max-parallel-external-downloads',
+        dest='max_parallel_external_downloads',
+        default=2,
+        type=int,
+        help=(
+            'Sets the number of max parallel downloads using an external downloader command'
+            + ' (see external_file_downloaders in the config). (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-mpdh',
+        '--max-parallel-downloads-per-host',
+        dest='max_parallel_downloads_per_host',
+        default=2,
+        type=int,
+        help=(
+            'Sets the number of max parallel downloads from a single host other than the Moodle host,'
+            + ' for example external file hosts. Hosts take turns, so that slow hosts do not block all downloads.'
+            + ' (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-mpdm',
+        '--max-parallel-moodle-downloads',
+        dest='max_parallel_moodle_downloads',
+        default=0,
+        type=int,
+        help=(
+            'Sets the number of max parallel downloads from the Moodle host. With 0 the Moodle host can use all'
+            + ' slots of --max-parallel-downloads, which are already tuned for it. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-do',
+        '--download-order',
+        dest='download_order',
+        default=DownloadOrder.COURSE.value,
+        choices=[order.value for order in DownloadOrder],
+        help=(
+            'Sets the order in which files are downloaded. With smallest-first many small files are done before a'
+            + ' few big recordings, newest-first prefers recently modified files and round-robin-courses lets the'
+            + ' courses take turns. Courses with a higher "priority" in options_of_courses are always downloaded'
+            + ' first. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-mcph',
+        '--max-connections-per-host',
+        dest='max_connections_per_host',
+        default=10,
+        type=int,
+        help=(
+            'Sets the number of max open connections to a single host while downloading files.'
+            + ' Connections are kept alive and reused by the following downloads. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-st',
+        '--stall-timeout',
+        dest='stall_timeout',
+        default=120,
+        type=int,
+        help=(
+            'Sets the number of seconds after which a download that is slower than --min-download-speed is'
+            + ' cancelled and put back into the queue. If the server supports it, the download is continued'
+            + ' afterwards. Use 0 to never cancel stalled downloads. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-mds',
+        '--min-download-speed',
+        dest='min_download_speed',
+        default=1024,
+        type=int,
+        help=(
+            'Sets the speed in bytes per second, below which a download counts as stalled'
+            + ' (see --stall-timeout). (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-cbt',
+        '--circuit-breaker-threshold',
+        dest='circuit_breaker_threshold',
+        default=5,
+        type=int,
+        help=(
+            'Sets the number of failed downloads in a row from an external host, after which the remaining'
+            + ' downloads from that host are paused. After --circuit-breaker-cooldown one download is tried again.'
+            + ' Downloads that are still paused when everything else is done are skipped until the next run.'
+            + ' Use 0 to never pause downloads. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-cbc',
+        '--circuit-breaker-cooldown',
+        dest='circuit_breaker_cooldown',
+        default=60,
+        type=int,
+        help=(
+            'Sets the number of seconds after which a download from a paused host is tried again'
+            + ' (see --circuit-breaker-threshold). (default: %(default)s)'
+        ),
     )
 
     parser.add_argument(
@@ -423,6 +640,101 @@ def get_parser():
         help=('Sets the chunk size in bytes used when downloading files. (default: %(default)s)'),
     )
 
+    parser.add_argument(
+        '-ds',
+        '--download-segments',
+        dest='download_segments',
+        default=1,
+        type=int,
+        help=(
+            'Sets the number of connections used to download a single large file in segments.'
+            + ' This helps if the speed of a single connection is limited. Set it to 1 to disable segmented'
+            + ' downloads. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-sdms',
+        '--segmented-download-min-size',
+        dest='segmented_download_min_size',
+        default=50 * 1024 * 1024,
+        type=int,
+        help=('Sets the min size in bytes of files that are downloaded in segments. (default: %(default)s)'),
+    )
+
+    parser.add_argument(
+        '-mps',
+        '--max-parallel-segments',
+        dest='max_parallel_segments',
+        default=8,
+        type=int,
+        help=(
+            'Sets the number of max parallel segment connections of all segmented downloads together.'
+            + ' They are not counted in max parallel downloads. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-vh',
+        '--verify-hashes',
+        dest='verify_hashes',
+        default=False,
+        action='store_true',
+        help=(
+            'When verifying the local files, also compare the content of each file with its stored hash.'
+            + ' This reads all downloaded files and can take a while.'
+        ),
+    )
+
+    parser.add_argument(
+        '-rbf',
+        '--requeue-broken-files',
+        dest='requeue_broken_files',
+        default=False,
+        action='store_true',
+        help=(
+            'When verifying the local files, remove missing, truncated and corrupt files from the database,'
+            + ' so that they are downloaded again in the next run. Files that were changed locally after'
+            + ' their download are kept.'
+        ),
+    )
+
+    parser.add_argument(
+        '-rbd',
+        '--retry-base-delay',
+        dest='retry_base_delay',
+        default=1.0,
+        type=float,
+        help=(
+            'Sets the max delay in seconds before the first retry of a failed request. It doubles with every'
+            + ' further retry, the actual delay is chosen randomly below it. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-rmd',
+        '--retry-max-delay',
+        dest='retry_max_delay',
+        default=60.0,
+        type=float,
+        help=(
+            'Sets the max delay in seconds before any retry of a failed request,'
+            + ' also if the server asks to wait longer with Retry-After. (default: %(default)s)'
+        ),
+    )
+
+    parser.add_argument(
+        '-rb',
+        '--retry-budget',
+        dest='retry_budget',
+        default=50,
+        type=int,
+        help=(
+            'Sets the number of retries per host. Every successful request earns a tenth of a retry back.'
+            + ' If the budget is used up, failed requests to that host are not retried. (default: %(default)s)'
+        ),
+    )
+
     parser.add_argument(
         '-iye',
         '--ignore-ytdl-errors',
@@ -449,6 +761,32 @@ def get_parser():
         ),
     )
 
+    parser.add_argument(
+        '-pl',
+        '--pipeline',
+        dest='pipeline',
+        default=False,
+        action='store_true',
+        help=(
+            'Start downloading the changes of a course as soon as the course is loaded,'
+            + ' while other courses are still being loaded. Has no effect together with --without-downloading-files.'
+        ),
+    )
+
+    parser.add_argument(
+        '-is',
+        '--incremental-sync',
+        dest='incremental_sync',
+        default=False,
+        action='store_true',
+        help=(
+            'Ask Moodle which courses have changed since the last run and only fetch those courses again.'
+            + ' All other courses keep their known files. Changes that Moodle does not report per course module'
+            + ' (like deleted modules) are detected by the next complete run, which is done after'
+            + ' incremental_sync_max_age seconds (default one day) or when the configuration changes.'
+        ),
+    )
+
     parser.add_argument(
         '-mplw',
         '--max-path-length-workaround',
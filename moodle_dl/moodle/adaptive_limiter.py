@@ -0,0 +1,142 @@
+import asyncio
+import logging
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of parallel requests to a server like a semaphore, but adapts the limit to the load of
+    the server (AIMD: additive increase, multiplicative decrease).
+    As long as the latency of the requests stays stable, the limit grows by one per round of requests.
+    If the server is overloaded (429, 5xx or timeouts), the limit is halved. The limit never exceeds the
+    configured maximum.
+    Keep in mind the limiter needs to be used in a single async loop.
+    """
+
+    INITIAL_LIMIT = 4
+    MIN_LIMIT = 1
+    DECREASE_FACTOR = 0.5
+    LATENCY_TOLERANCE = 2.0  # latency up to this multiple of the baseline latency counts as stable
+    LATENCY_SMOOTHING = 0.3  # weight of the newest latency in the smoothed latency
+    BASELINE_DRIFT = 0.01  # the baseline latency slowly follows a higher latency, so that it adapts to the server
+
+    def __init__(self, name: str, max_limit: int, adaptive: bool = True):
+        """
+        @param name: Name of the limited resource, used in the log
+        @param max_limit: The limit never exceeds this maximum
+        @param adaptive: If false, the limiter works like a semaphore with max_limit
+        """
+        self.name = name
+        self.max_limit = max(self.MIN_LIMIT, max_limit)
+        self.adaptive = adaptive
+        self.limit = float(min(self.INITIAL_LIMIT, self.max_limit) if adaptive else self.max_limit)
+        self.in_flight = 0
+
+        self.smoothed_latency = None
+        self.baseline_latency = None
+        # Overload reports of requests started before the last decrease are already handled by that decrease
+        self.last_decrease = float('-inf')
+        # Futures of the requests that wait for a free slot
+        self.waiters = []
+
+    def slot(self) -> 'LimiterSlot':
+        "@return: A slot that is used with 'async with' around one request"
+        return LimiterSlot(self)
+
+    async def acquire(self) -> float:
+        "@return: The loop time when the slot was acquired"
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= int(self.limit):
+            waiter = loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+        return loop.time()
+
+    def release(self, started: float, succeeded: bool, overloaded: bool):
+        """
+        Frees a slot. It is synchronous, so that a cancelled request can not lose its slot while releasing it.
+        All waiting requests are woken up and check again if there is a free slot, because the limit can change.
+        """
+        now = asyncio.get_running_loop().time()
+        used_limit = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if self.adaptive:
+            if overloaded:
+                self.on_overload(started, now)
+            elif succeeded:
+                self.on_success(now - started, used_limit)
+
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def on_success(self, latency: float, used_limit: bool):
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency += self.LATENCY_SMOOTHING * (latency - self.smoothed_latency)
+        if self.baseline_latency is None:
+            self.baseline_latency = self.smoothed_latency
+        else:
+            self.baseline_latency = min(self.smoothed_latency, self.baseline_latency * (1 + self.BASELINE_DRIFT))
+
+        # Only grow if the current limit is used, otherwise it grows without being tested
+        if not used_limit or self.limit >= self.max_limit:
+            return
+        if self.smoothed_latency > self.baseline_latency * self.LATENCY_TOLERANCE:
+            return
+
+        old_limit = int(self.limit)
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        if int(self.limit) != old_limit:
+            logging.debug(
+                'Increasing parallel %s to %d (latency %.2fs, baseline %.2fs)',
+                self.name,
+                int(self.limit),
+                self.smoothed_latency,
+                self.baseline_latency,
+            )
+
+    def on_overload(self, started: float, now: float):
+        if started < self.last_decrease:
+            return
+        self.last_decrease = now
+        old_limit = int(self.limit)
+        self.limit = max(float(self.MIN_LIMIT), self.limit * self.DECREASE_FACTOR)
+        logging.debug(
+            'Server is overloaded, decreasing parallel %s from %d to %d', self.name, old_limit, int(self.limit)
+        )
+
+
+class LimiterSlot:
+    """
+    One request in an AdaptiveLimiter. Requests that end with an exception or are reported as failed
+    do not count as success.
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.started = None
+        self.failed = False
+        self.overloaded = False
+
+    def report_failure(self):
+        "Marks that this request failed for a reason that says nothing about the load of the server"
+        self.failed = True
+
+    def report_overload(self):
+        "Marks that the server answered this request with an overload error"
+        self.failed = True
+        self.overloaded = True
+
+    async def __aenter__(self) -> 'LimiterSlot':
+        self.started = await self.limiter.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.limiter.release(self.started, exc_type is None and not self.failed, self.overloaded)
@@ -164,3 +164,16 @@ class CoreHandler:
     async def async_load_course_core(self, course: Course) -> List[Dict]:
         data = {'courseid': course.id}
         return await self.client.async_post('core_course_get_contents', data)
+
+    async def async_fetch_course_updates_since(self, course_id: int, since: int) -> List[Dict]:
+        """
+        Asks the Moodle system which modules of a course have changed since a point in time
+        @param since: Unix timestamp of the last check
+        @return: A list of all changed module instances
+        """
+        if self.version < 2017051500:  # 3.3
+            raise RuntimeError('Moodle version is too old to check for updates')
+
+        data = {'courseid': course_id, 'since': since}
+        result = await self.client.async_post('core_course_get_updates_since', data)
+        return result.get('instances', [])
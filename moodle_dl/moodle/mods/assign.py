@@ -21,9 +21,9 @@ class AssignMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        assign_courses = (
-            await self.client.async_post('mod_assign_get_assignments', self.get_data_for_mod_entries_endpoint(courses))
-        ).get('courses', [])
+        assign_courses = await self.fetch_entries_by_courses(
+            'mod_assign_get_assignments', courses, 'courses', course_id_key='id'
+        )
 
         result = {}
         for assign_course in assign_courses:
@@ -25,11 +25,7 @@ class BookMod(MoodleMod):
         if not self.config.get_download_books():
             return result
 
-        books = (
-            await self.client.async_post(
-                'mod_book_get_books_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('books', [])
+        books = await self.fetch_entries_by_courses('mod_book_get_books_by_courses', courses, 'books')
 
         for book in books:
             course_id = book.get('course', 0)
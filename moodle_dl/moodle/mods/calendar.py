@@ -37,13 +37,19 @@ class CalendarMod(MoodleMod):
             return result
 
         last_timestamp = self.last_timestamps.get(self.MOD_NAME, {}).get(course_events_module_id, 0)
-        calendar_req_data = {
-            'options': {'timestart': last_timestamp, 'userevents': 0},
-            'events': self.get_data_for_mod_entries_endpoint(courses),
-        }
 
-        events = (await self.client.async_post('core_calendar_get_calendar_events', calendar_req_data)).get(
-            'events', []
+        def get_calendar_req_data(courses_to_list: List[Course]) -> Dict:
+            return {
+                'options': {'timestart': last_timestamp, 'userevents': 0},
+                'events': self.get_data_for_mod_entries_endpoint(courses_to_list),
+            }
+
+        events = await self.fetch_entries_by_courses(
+            'core_calendar_get_calendar_events',
+            courses,
+            'events',
+            course_id_key='courseid',
+            get_data=get_calendar_req_data,
         )
 
         events_per_course = self.sort_by_courseid(events)
@@ -2,7 +2,7 @@ import asyncio
 import logging
 import math
 from abc import ABCMeta, abstractmethod
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from moodle_dl.config import ConfigHelper
 from moodle_dl.moodle.request_helper import RequestHelper
@@ -39,6 +39,10 @@ class MoodleMod(metaclass=ABCMeta):
         self.last_timestamps = last_timestamps
         self.config = config
 
+        # Courses of which the mod entries are listed together, even if they are fetched one by one
+        self.listed_courses: List[Course] = None
+        self.listings: Dict[str, asyncio.Future] = {}
+
     @classmethod
     @abstractmethod
     def download_condition(cls, config: ConfigHelper, file: File) -> bool:
@@ -79,6 +83,47 @@ class MoodleMod(metaclass=ABCMeta):
             course_ids[str(idx)] = course.id
         return {'courseids': course_ids}
 
+    def list_courses_together(self, courses: List[Course]):
+        """
+        Lets fetches of single courses share the requests that list the mod entries, so that every listing endpoint
+        is called once for all the given courses, and not once per course
+        """
+        self.listed_courses = courses
+        self.listings = {}
+
+    async def fetch_entries_by_courses(
+        self,
+        function: str,
+        courses: List[Course],
+        entries_key: str = None,
+        course_id_key: str = 'course',
+        get_data: Callable[[List[Course]], Dict] = None,
+    ) -> List[Dict]:
+        """
+        Calls an endpoint that lists the mod entries of courses
+        @param entries_key: The key of the entries in the response, None if the response is the list of entries
+        @param course_id_key: The key of the course id in an entry
+        @param get_data: Creates the request data for a list of courses, defaults to the courseids parameter
+        @return: The entries of the given courses
+        """
+        if get_data is None:
+            get_data = self.get_data_for_mod_entries_endpoint
+
+        course_ids = {course.id for course in courses}
+        if self.listed_courses is None or not course_ids <= {course.id for course in self.listed_courses}:
+            response = await self.client.async_post(function, get_data(courses))
+            return response if entries_key is None else response.get(entries_key, [])
+
+        listing = self.listings.get(function)
+        if listing is None:
+            listing = asyncio.ensure_future(self.client.async_post(function, get_data(self.listed_courses)))
+            self.listings[function] = listing
+        # Do not cancel the listing for the other courses, if this fetch gets cancelled
+        response = await asyncio.shield(listing)
+
+        entries = response if entries_key is None else response.get(entries_key, [])
+        return [entry for entry in entries if entry.get(course_id_key) in course_ids]
+
     @abstractmethod
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
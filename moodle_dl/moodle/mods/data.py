@@ -18,11 +18,7 @@ class DataMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        databases = (
-            await self.client.async_post(
-                'mod_data_get_databases_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('databases', [])
+        databases = await self.fetch_entries_by_courses('mod_data_get_databases_by_courses', courses, 'databases')
 
         result = {}
         for database in databases:
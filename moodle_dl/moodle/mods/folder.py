@@ -18,11 +18,7 @@ class FolderMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        folders = (
-            await self.client.async_post(
-                'mod_folder_get_folders_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('folders', [])
+        folders = await self.fetch_entries_by_courses('mod_folder_get_folders_by_courses', courses, 'folders')
 
         result = {}
         for folder in folders:
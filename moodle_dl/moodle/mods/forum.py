@@ -21,9 +21,7 @@ class ForumMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        forums = await self.client.async_post(
-            'mod_forum_get_forums_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-        )
+        forums = await self.fetch_entries_by_courses('mod_forum_get_forums_by_courses', courses)
 
         result = {}
         for forum in forums:
@@ -22,11 +22,7 @@ class LessonMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        lessons = (
-            await self.client.async_post(
-                'mod_lesson_get_lessons_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('lessons', [])
+        lessons = await self.fetch_entries_by_courses('mod_lesson_get_lessons_by_courses', courses, 'lessons')
 
         result = {}
         for lesson in lessons:
@@ -18,11 +18,7 @@ class PageMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        pages = (
-            await self.client.async_post(
-                'mod_page_get_pages_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('pages', [])
+        pages = await self.fetch_entries_by_courses('mod_page_get_pages_by_courses', courses, 'pages')
 
         result = {}
         for page in pages:
@@ -21,11 +21,7 @@ class QuizMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        quizzes = (
-            await self.client.async_post(
-                'mod_quiz_get_quizzes_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('quizzes', [])
+        quizzes = await self.fetch_entries_by_courses('mod_quiz_get_quizzes_by_courses', courses, 'quizzes')
 
         result = {}
         for quiz in quizzes:
@@ -19,11 +19,7 @@ class WorkshopMod(MoodleMod):
     async def real_fetch_mod_entries(
         self, courses: List[Course], core_contents: Dict[int, List[Dict]]
     ) -> Dict[int, Dict[int, Dict]]:
-        workshops = (
-            await self.client.async_post(
-                'mod_workshop_get_workshops_by_courses', self.get_data_for_mod_entries_endpoint(courses)
-            )
-        ).get('workshops', [])
+        workshops = await self.fetch_entries_by_courses('mod_workshop_get_workshops_by_courses', courses, 'workshops')
 
         result = {}
         for workshop in workshops:
@@ -1,7 +1,9 @@
+import asyncio
 import base64
 import logging
 import re
-from typing import List, Tuple
+import time
+from typing import Callable, List, Tuple
 from urllib.parse import urlparse
 
 from moodle_dl.config import ConfigHelper
@@ -9,6 +11,7 @@ from moodle_dl.database import StateRecorder
 from moodle_dl.moodle.cookie_handler import CookieHandler
 from moodle_dl.moodle.core_handler import CoreHandler
 from moodle_dl.moodle.mods import (
+    MoodleMod,
     fetch_mods_files,
     get_all_mods,
     get_all_mods_classes,
@@ -21,10 +24,19 @@ from moodle_dl.utils import determine_ext, is_base_64
 
 
 class MoodleService:
+    # Updates are requested a bit before the last sync, so that a clock difference to the Moodle system is no problem
+    SYNC_TIME_MARGIN = 5 * 60  # seconds
+    # Changes of these config options do not change which files are fetched
+    SYNC_IGNORED_CONFIG_KEYS = ['token', 'privatetoken']
+
     def __init__(self, config: ConfigHelper, opts: MoodleDlOpts):
         self.config = config
         self.opts = opts
 
+        # Time and courses of the last fetch, used to remember the sync of the courses
+        self.sync_started = None
+        self.fetched_course_ids = []
+
     def obtain_login_token(self, username: str, password: str, moodle_url: MoodleURL) -> str:
         "Send the login credentials to the Moodle-System and extracts the resulting Login-Token"
         login_data = {'username': username, 'password': password, 'service': 'moodle_mobile_app'}
@@ -101,43 +113,223 @@ class MoodleService:
             core_handler.version = version
         return user_id, version
 
-    async def fetch_state(self, database: StateRecorder) -> List[Course]:
+    async def fetch_state(
+        self, database: StateRecorder, changes_callback: Callable[[List[Course]], None] = None
+    ) -> List[Course]:
         """
         Fetch the current status of the configured Moodle account and compare it with the last known state
         It does not change the known state, nor does it download the files.
+        @param changes_callback: If set, every course is fetched and compared on its own, and its changes are
+                                 passed to the callback as soon as they are known (while other courses are still
+                                 loading)
         @return: List with detected changes between the new and old state
         """
         logging.debug('Fetching current Moodle state...')
+        self.sync_started = int(time.time())
         token = self.config.get_token()
         privatetoken = self.config.get_privatetoken()
         moodle_url = self.config.get_moodle_URL()
 
         request_helper = RequestHelper(self.config, self.opts, moodle_url, token)
-        core_handler = CoreHandler(request_helper)
-        user_id, version = self.get_user_id_and_version(core_handler)
+        try:
+            core_handler = CoreHandler(request_helper)
+            user_id, version = self.get_user_id_and_version(core_handler)
+            request_helper.enable_batching(version)
+
+            cookie_handler = None
+            if self.config.get_download_also_with_cookie():
+                cookie_handler = CookieHandler(request_helper, version, self.config, self.opts)
+                cookie_handler.check_and_fetch_cookies(privatetoken, user_id)
+
+            courses = self.get_courses_list(core_handler, user_id)
+            self.fetched_course_ids = [course.id for course in courses]
+
+            stored_courses = None
+            unchanged_courses = []
+            if self.opts.incremental_sync:
+                stored_courses = database.get_stored_files()
+                courses, unchanged_courses = await self.split_unchanged_courses(
+                    core_handler, database, courses, stored_courses
+                )
 
-        cookie_handler = None
-        if self.config.get_download_also_with_cookie():
-            cookie_handler = CookieHandler(request_helper, version, self.config, self.opts)
-            cookie_handler.check_and_fetch_cookies(privatetoken, user_id)
+            mods = get_all_mods(
+                request_helper, version, user_id, database.get_last_timestamp_per_mod_module(), self.config
+            )
+            result_builder = ResultBuilder(moodle_url, version, get_mod_plurals())
+
+            if changes_callback is not None:
+                if stored_courses is None:
+                    stored_courses = database.get_stored_files()
+                changes = await self.stream_changes(
+                    core_handler,
+                    mods,
+                    result_builder,
+                    database,
+                    courses,
+                    courses + unchanged_courses,
+                    stored_courses,
+                    cookie_handler,
+                    changes_callback,
+                )
+                return changes
+
+            core_contents = await core_handler.async_load_core_contents(courses)
+            fetched_mods_files = await fetch_mods_files(mods, courses, core_contents)
 
-        courses = self.get_courses_list(core_handler, user_id)
+            logging.debug('Combine API results...')
+            result_builder.add_files_to_courses(courses, core_contents, fetched_mods_files)
+            courses += unchanged_courses
 
-        core_contents = await core_handler.async_load_core_contents(courses)
-        mods = get_all_mods(request_helper, version, user_id, database.get_last_timestamp_per_mod_module(), self.config)
-        fetched_mods_files = await fetch_mods_files(mods, courses, core_contents)
+            logging.debug('Checking for changes...')
+            changes = database.changes_of_new_version(courses, stored_courses)
+            changes = self.add_options_to_courses(changes)
+            changes = self.filter_courses(changes, self.config, cookie_handler, courses)
+        finally:
+            # Release all pooled connections of this run
+            await request_helper.close()
+
+        return changes
+
+    async def stream_changes(
+        self,
+        core_handler: CoreHandler,
+        mods: List[MoodleMod],
+        result_builder: ResultBuilder,
+        database: StateRecorder,
+        courses: List[Course],
+        online_courses: List[Course],
+        stored_courses: List[Course],
+        cookie_handler: CookieHandler,
+        changes_callback: Callable[[List[Course]], None],
+    ) -> List[Course]:
+        """
+        Fetches, combines, compares and filters every course on its own, so that the changes of a course
+        can already be downloaded while other courses are still loading.
+        Only the endpoints that list the mod entries of courses are shared, they are called once for all courses.
+        @param courses: The courses that need to be fetched
+        @param online_courses: All courses that are available online
+        @param stored_courses: The known state, it is read once before any change is stored
+        @return: List with all detected changes
+        """
+        cookies_valid = None
+        if cookie_handler is not None:
+            cookies_valid = cookie_handler.test_cookies()
+
+        stored_courses_by_id = {}
+        for stored_course in stored_courses:
+            stored_courses_by_id.setdefault(stored_course.id, stored_course)
+
+        def pass_changes(current_courses: List[Course], known_courses: List[Course]) -> List[Course]:
+            changes = database.changes_of_new_version(current_courses, known_courses)
+            changes = self.add_options_to_courses(changes)
+            changes = self.filter_courses(changes, self.config, None, online_courses, cookies_valid)
+            if len(changes) > 0:
+                changes_callback(changes)
+            return changes
+
+        async def fetch_course_changes(course: Course) -> List[Course]:
+            core_contents = {course.id: await core_handler.async_load_course_core(course)}
+            fetched_mods_files = await fetch_mods_files(mods, [course], core_contents)
+            result_builder.add_files_to_courses([course], core_contents, fetched_mods_files)
+
+            stored_course = stored_courses_by_id.get(course.id)
+            changes = pass_changes([course], [stored_course] if stored_course is not None else [])
+            logging.info('Loaded course %d "%s" with %d changes', course.id, course.fullname, len(changes))
+            return changes
+
+        # The listing endpoints of the mods are called once for all courses, the entries are split by course
+        for mod in mods:
+            mod.list_courses_together(courses)
+
+        fetch_tasks = [asyncio.ensure_future(fetch_course_changes(course)) for course in courses]
+        try:
+            courses_changes = await asyncio.gather(*fetch_tasks)
+        finally:
+            # If one course fails, the other courses must not pass changes after the download queue is closed
+            for fetch_task in fetch_tasks:
+                fetch_task.cancel()
+
+        # Courses that are no longer available online
+        online_course_ids = {course.id for course in online_courses}
+        removed_courses = [course for course in stored_courses if course.id not in online_course_ids]
+        courses_changes.append(pass_changes([], removed_courses))
+
+        return [course for course_changes in courses_changes for course in course_changes]
+
+    def get_sync_config_hash(self) -> str:
+        return self.config.get_config_hash(self.SYNC_IGNORED_CONFIG_KEYS)
+
+    async def split_unchanged_courses(
+        self, core_handler: CoreHandler, database: StateRecorder, courses: List[Course], stored_courses: List[Course]
+    ) -> Tuple[List[Course], List[Course]]:
+        """
+        Asks the Moodle system which courses have changed since their last sync.
+        Courses without a sync, with a sync older than the max age or with a sync under a different configuration
+        are always fetched again.
+        @param stored_courses: All stored files, the unchanged courses get their stored files
+        @return: The courses that need to be fetched again, and the unchanged courses
+        """
+        if core_handler.version < 2017051500:  # 3.3
+            logging.warning('Incremental sync needs Moodle 3.3 or newer, all courses are fetched again')
+            return courses, []
 
-        logging.debug('Combine API results...')
-        ResultBuilder(moodle_url, version, get_mod_plurals()).add_files_to_courses(
-            courses, core_contents, fetched_mods_files
+        course_syncs = database.get_course_syncs()
+        config_hash = self.get_sync_config_hash()
+        max_age = self.config.get_incremental_sync_max_age()
+
+        courses_to_check = []
+        for course in courses:
+            course_sync = course_syncs.get(course.id)
+            if (
+                course_sync is not None
+                and course_sync['config_hash'] == config_hash
+                and self.sync_started - course_sync['last_sync'] <= max_age
+            ):
+                courses_to_check.append((course, course_sync['last_sync']))
+
+        courses_changed = await asyncio.gather(
+            *[self.has_course_changed(core_handler, course, last_sync) for course, last_sync in courses_to_check]
         )
+        unchanged_course_ids = set()
+        for (course, _last_sync), changed in zip(courses_to_check, courses_changed):
+            if not changed:
+                unchanged_course_ids.add(course.id)
 
-        logging.debug('Checking for changes...')
-        changes = database.changes_of_new_version(courses)
-        changes = self.add_options_to_courses(changes)
-        changes = self.filter_courses(changes, self.config, cookie_handler, courses)
+        stored_courses_by_id = {}
+        for stored_course in stored_courses:
+            stored_courses_by_id.setdefault(stored_course.id, stored_course)
 
-        return changes
+        changed_courses = []
+        unchanged_courses = []
+        for course in courses:
+            if course.id in unchanged_course_ids:
+                stored_course = stored_courses_by_id.get(course.id)
+                course.files = stored_course.files if stored_course is not None else []
+                unchanged_courses.append(course)
+            else:
+                changed_courses.append(course)
+
+        logging.info('%d of %d courses have not changed since their last sync', len(unchanged_courses), len(courses))
+        return changed_courses, unchanged_courses
+
+    async def has_course_changed(self, core_handler: CoreHandler, course: Course, last_sync: int) -> bool:
+        try:
+            updates = await core_handler.async_fetch_course_updates_since(course.id, last_sync - self.SYNC_TIME_MARGIN)
+        except Exception as update_err:
+            logging.debug('Could not check course %d for updates, it is fetched again: %s', course.id, update_err)
+            return True
+        return len(updates) > 0
+
+    def courses_synced(self, database: StateRecorder, failed_course_ids: List[int]):
+        """
+        Saves the sync of all courses of the last fetch, whose changes are all downloaded and stored
+        @param failed_course_ids: Courses that had failed downloads, they are fetched again in the next run
+        """
+        if self.sync_started is None:
+            return
+
+        synced_course_ids = [course_id for course_id in self.fetched_course_ids if course_id not in failed_course_ids]
+        database.courses_synced(synced_course_ids, self.sync_started, self.get_sync_config_hash())
 
     def add_options_to_courses(self, courses: List[Course]):
         "Updates the courses with their options"
@@ -148,6 +340,7 @@ class MoodleService:
                 course.overwrite_name_with = options.get('overwrite_name_with', None)
                 course.create_directory_structure = options.get('create_directory_structure', True)
                 course.excluded_sections = options.get("excluded_sections", [])
+                course.priority = options.get('priority', 0)
 
         return courses
 
@@ -157,6 +350,7 @@ class MoodleService:
         config: ConfigHelper,
         cookie_handler: CookieHandler = None,
         courses_list: List[Course] = None,
+        cookies_valid: bool = None,
     ) -> List[Course]:
         """
         Filters the changes course list from courses that
@@ -164,6 +358,7 @@ class MoodleService:
         @param config: ConfigHelper to obtain all the different filter configs
         @param cookie_handler: CookieHandler to check if the cookie is valid
         @param courses_list: A list of all courses that are available online
+        @param cookies_valid: Result of an earlier cookie test, used instead of testing the cookies again
         @return: filtered changes course list
         """
 
@@ -177,7 +372,9 @@ class MoodleService:
         course_filter_mode = config.get_course_filter_mode()
 
         download_also_with_cookie = config.get_download_also_with_cookie()
-        if cookie_handler is not None:
+        if cookies_valid is not None:
+            download_also_with_cookie = cookies_valid
+        elif cookie_handler is not None:
             download_also_with_cookie = cookie_handler.test_cookies()
 
         all_mods_classes = get_all_mods_classes()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, List
+
+from moodle_dl.moodle.request_helper import (
+    RequestHelper,
+    RequestRejectedError,
+    RetryableRequestError,
+)
+
+
+@dataclass
+class BatchedCall:
+    function: str
+    data: Dict
+    timeout: int
+    future: asyncio.Future
+
+
+class RequestBatcher:
+    """
+    Coalesces concurrent web service calls into batched requests using tool_mobile_call_external_functions,
+    which executes many web service functions in one HTTP round-trip.
+    Callers still await their individual results and errors.
+    If the Moodle system does not support batching, all calls are sent one by one again.
+    Keep in mind the batcher needs to be used in a single async loop.
+    """
+
+    BATCH_FUNCTION = 'tool_mobile_call_external_functions'
+    MIN_VERSION = 2019052000  # 3.7
+    # Moodle runs the calls of a batch one after the other, so heavy calls are better sent in parallel
+    UNBATCHABLE_FUNCTIONS = {BATCH_FUNCTION, 'tool_mobile_get_autologin_key', 'core_course_get_contents'}
+    # Error codes Moodle answers with if the batch function does not exist or is not part of the mobile service
+    UNAVAILABLE_ERRORS = {'accessexception', 'invalidrecord', 'servicenotavailable', 'webservicesnotenabled'}
+    # Seconds a batch may take longer than its slowest call
+    TIMEOUT_MARGIN = 30
+
+    def __init__(self, client: RequestHelper, batch_size: int, flush_window: float):
+        """
+        @param client: The RequestHelper that is used to send the requests
+        @param batch_size: Max number of calls that are sent in one batched request
+        @param flush_window: Max seconds a call waits for other calls to join its batch
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_window = flush_window
+        self.available = True
+
+        self.pending: List[BatchedCall] = []
+        self.flush_handle = None
+        self.running_batches = set()
+
+    def is_batchable(self, function: str) -> bool:
+        return self.available and function not in self.UNBATCHABLE_FUNCTIONS
+
+    async def call(self, function: str, data: Dict[str, str], timeout: int) -> Dict:
+        "Queues a call for the next batch and waits for its result"
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(BatchedCall(function, data, timeout, future))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.flush_window, self.flush)
+
+        return await future
+
+    def flush(self):
+        "Sends all pending calls as one batch"
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        calls, self.pending = self.pending, []
+        if len(calls) == 0:
+            return
+
+        batch_task = asyncio.create_task(self.send_batch(calls))
+        # Keep a reference, so that the task does not get garbage collected
+        self.running_batches.add(batch_task)
+        batch_task.add_done_callback(self.running_batches.discard)
+
+    @staticmethod
+    def resolve(call: BatchedCall, result: Dict = None, error: Exception = None):
+        if call.future.done():
+            # The caller is no longer waiting for the result
+            return
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    async def send_direct(self, call: BatchedCall):
+        try:
+            self.resolve(call, result=await self.client.async_post_direct(call.function, call.data, call.timeout))
+        except Exception as call_err:
+            self.resolve(call, error=call_err)
+
+    async def send_batch(self, calls: List[BatchedCall]):
+        if len(calls) == 1 or not self.available:
+            await asyncio.gather(*[self.send_direct(call) for call in calls])
+            return
+
+        requests = {}
+        for idx, call in enumerate(calls):
+            requests[str(idx)] = {
+                'function': call.function,
+                'arguments': json.dumps(self.nest_arguments(call.data)),
+                'settingfilter': 1,
+                'settingfileurl': 1,
+            }
+
+        try:
+            result = await self.client.async_post_direct(
+                self.BATCH_FUNCTION,
+                {'requests': requests},
+                max(call.timeout for call in calls) + self.TIMEOUT_MARGIN,
+            )
+        except RequestRejectedError as batch_err:
+            if batch_err.error_code not in self.UNAVAILABLE_ERRORS:
+                for call in calls:
+                    self.resolve(call, error=batch_err)
+                return
+            # The function is not available on this Moodle system (or is not part of the mobile service)
+            if self.available:
+                logging.debug('Batching of API calls is not supported, falling back to single calls: %s', batch_err)
+            self.available = False
+            await asyncio.gather(*[self.send_direct(call) for call in calls])
+            return
+        except Exception as batch_err:
+            for call in calls:
+                self.resolve(call, error=batch_err)
+            return
+
+        responses = result.get('responses', [])
+        retry_calls = []
+        for idx, call in enumerate(calls):
+            if idx >= len(responses):
+                self.resolve(call, error=ConnectionError('Connection error: Batched response is incomplete'))
+                continue
+            try:
+                self.resolve(call, result=self.parse_response(call, responses[idx]))
+            except RetryableRequestError:
+                # Retry transient errors with the retry logic of single calls
+                retry_calls.append(call)
+            except Exception as call_err:
+                self.resolve(call, error=call_err)
+
+        if len(retry_calls) > 0:
+            await asyncio.gather(*[self.send_direct(call) for call in retry_calls])
+
+    def parse_response(self, call: BatchedCall, response: Dict) -> Dict:
+        """
+        Parses a single response of a batched request
+        @return: The JSON response of the call, already checked for errors
+        """
+        url = self.client._get_REST_POST_URL(self.client.url_base, call.function)  # pylint: disable=protected-access
+        if response.get('error', False):
+            exception = json.loads(response.get('exception') or '{}')
+            if 'exception' not in exception and 'error' not in exception:
+                exception['exception'] = 'Unknown exception'
+            self.client.check_json_for_moodle_error(exception, url, call.data)
+
+        resp_json = json.loads(response.get('data') or 'null')
+        if isinstance(resp_json, dict):
+            self.client.check_json_for_moodle_error(resp_json, url, call.data)
+        self.client.log_response(call.function, call.data, url, resp_json)
+        return resp_json
+
+    @classmethod
+    def nest_arguments(cls, data: Dict) -> Dict:
+        """
+        Converts POST data, that can contain flat keys like 'options[0][name]', into nested arguments
+        like {'options': {'0': {'name': ...}}}, as they are expected in the JSON arguments of a batched call.
+        All values are converted to strings, the same way as they are URL-encoded for single calls.
+        """
+        result = {}
+        if data is None:
+            return result
+
+        for key, value in data.items():
+            path = re.findall(r'[^\[\]]+', str(key))
+            if len(path) == 0:
+                continue
+            target = result
+            for part in path[:-1]:
+                target = target.setdefault(part, {})
+            if hasattr(value, 'values'):
+                target[path[-1]] = cls.nest_arguments(value)
+            else:
+                target[path[-1]] = str(value)
+        return result
@@ -12,8 +12,9 @@ import requests
 from requests.exceptions import RequestException
 
 from moodle_dl.config import ConfigHelper
+from moodle_dl.moodle.adaptive_limiter import AdaptiveLimiter
 from moodle_dl.types import MoodleDlOpts, MoodleURL
-from moodle_dl.utils import MoodleDLCookieJar, SslHelper
+from moodle_dl.utils import MoodleDLCookieJar, RetryPolicy, SslHelper
 from moodle_dl.utils import PathTools as PT
 
 
@@ -31,6 +32,8 @@ class RequestHelper:
     }
     MAX_RETRIES = 5
     RETRYABLE_MOODLE_ERRORS = {'ex_unabletolock'}
+    OVERLOAD_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+    DNS_CACHE_TTL = 300  # seconds
 
     def __init__(self, config: ConfigHelper, opts: MoodleDlOpts, moodle_url: MoodleURL, token: str):
         self.token = token
@@ -40,9 +43,17 @@ class RequestHelper:
 
         self.url_base = moodle_url.url_base
 
-        # Semaphore for async requests
-        # Keep in mind Semaphore needs to be initialized in the same async loop as it is used
-        self.semaphore = asyncio.Semaphore(opts.max_parallel_api_calls)
+        # Limits the parallel async requests, adapted to the load of the Moodle server if enabled
+        self.limiter = AdaptiveLimiter('API calls', opts.max_parallel_api_calls, opts.adaptive_api_calls)
+        self.retry_policy = RetryPolicy(opts.retry_base_delay, opts.retry_max_delay, opts.retry_budget)
+
+        # Shared connection pool for all async requests of a run, it is created lazily by get_session()
+        self._session = None
+        # Coalesces async requests into batched requests, see enable_batching()
+        self.batcher = None
+        self.ssl_context = SslHelper.get_ssl_context(
+            opts.skip_cert_verify, opts.allow_insecure_ssl, opts.use_all_ciphers
+        )
 
         self.log_responses_to = None
         if opts.log_responses:
@@ -114,9 +125,54 @@ class RequestHelper:
 
         return response, session
 
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Returns the session that is shared by all async requests, so that connections (DNS, TCP and TLS) are reused.
+        Keep in mind the session needs to be created in the same async loop as it is used,
+        and it needs to be closed with close() before that loop ends.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                resolver=aiohttp.ThreadedResolver() if sys.platform == 'win32' else aiohttp.AsyncResolver(),
+                limit_per_host=self.opts.max_parallel_api_calls,
+                ttl_dns_cache=self.DNS_CACHE_TTL,
+                ssl=self.ssl_context,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        "Closes the shared session and all its pooled connections"
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def enable_batching(self, moodle_version: int):
+        """
+        Batch concurrent async requests, if the Moodle system supports it and it is not disabled by the options
+        Keep in mind the batcher needs to be used in the same async loop as it is enabled
+        """
+        from moodle_dl.moodle.request_batcher import RequestBatcher
+
+        if self.opts.api_batch_size <= 1 or moodle_version < RequestBatcher.MIN_VERSION:
+            return
+        self.batcher = RequestBatcher(self, self.opts.api_batch_size, self.opts.api_batch_window)
+
     async def async_post(self, function: str, data: Dict[str, str] = None, timeout: int = 60) -> Dict:
         """
-        Sends async a POST request to the REST endpoint of the Moodle system
+        Sends async a POST request to the REST endpoint of the Moodle system.
+        If batching is enabled, the request may be sent together with other concurrent requests.
+        @param function: The Web service function to be called.
+        @param data: The optional data is added to the POST body.
+        @return: The JSON response returned by the Moodle system, already checked for errors..
+        """
+        if self.batcher is not None and self.batcher.is_batchable(function):
+            return await self.batcher.call(function, data, timeout)
+        return await self.async_post_direct(function, data, timeout)
+
+    async def async_post_direct(self, function: str, data: Dict[str, str] = None, timeout: int = 60) -> Dict:
+        """
+        Sends async a single POST request to the REST endpoint of the Moodle system
         @param function: The Web service function to be called.
         @param data: The optional data is added to the POST body.
         @return: The JSON response returned by the Moodle system, already checked for errors..
@@ -128,28 +184,25 @@ class RequestHelper:
         data = self._get_POST_DATA(function, self.token, data)
         data_urlencoded = self.recursive_urlencode(data)
         url = self._get_REST_POST_URL(self.url_base, function)
-        ssl_context = SslHelper.get_ssl_context(
-            self.opts.skip_cert_verify, self.opts.allow_insecure_ssl, self.opts.use_all_ciphers
-        )
 
         error_ctr = 0
-        connector = aiohttp.TCPConnector(
-            resolver=aiohttp.ThreadedResolver() if sys.platform == 'win32' else aiohttp.AsyncResolver()
-        )
-        async with self.semaphore, aiohttp.ClientSession(connector=connector) as session:
-            while error_ctr < self.MAX_RETRIES:
+        session = self.get_session()
+        while True:
+            # The slot is only held during the request, not while waiting for a retry
+            async with self.limiter.slot() as slot:
                 try:
                     async with session.post(
                         url,
                         data=data_urlencoded,
                         headers=self.RQ_HEADER,
                         timeout=timeout,
-                        ssl=ssl_context,
+                        ssl=self.ssl_context,
                         raise_for_status=True,
                     ) as resp:
                         resp_json = await resp.json()
                     self.check_json_for_moodle_error(resp_json, url, data)
                     self.log_response(function, data, str(resp.url), resp_json)
+                    self.retry_policy.record_success(url)
                     break
                 except (
                     aiohttp.client_exceptions.ClientError,
@@ -158,25 +211,42 @@ class RequestHelper:
                     ValueError,
                     RetryableRequestError,
                 ) as req_err:
-                    if (isinstance(req_err, aiohttp.client_exceptions.ClientResponseError)) and (
-                        req_err.status not in [408, 409, 429]  # pylint: disable=no-member
-                    ):
-                        # 408 (timeout) or 409 (conflict) and 429 (too many requests)
-                        raise ConnectionError(f"Connection error: {req_err}") from None
+                    if self.is_overload_error(req_err):
+                        slot.report_overload()
+                    else:
+                        slot.report_failure()
+                    retry_after = None
+                    if isinstance(req_err, aiohttp.client_exceptions.ClientResponseError):
+                        if req_err.status not in [408, 409, 429, 503]:  # pylint: disable=no-member
+                            # 408 (timeout), 409 (conflict), 429 (too many requests) and 503 (unavailable)
+                            raise ConnectionError(f"Connection error: {req_err}") from None
+                        if req_err.headers is not None:
+                            retry_after = req_err.headers.get('Retry-After')
                     if isinstance(req_err, aiohttp.client_exceptions.ContentTypeError):
                         raise RequestRejectedError(
                             'The Moodle Mobile API does not appear to be available at this time.'
                         ) from None
 
                     error_ctr += 1
+                    retry_delay = None
                     if error_ctr < self.MAX_RETRIES:
-                        logging.debug("The %sth connection error occurred, retrying. %s", error_ctr, req_err)
-                        await asyncio.sleep(1)
-                        continue
-                    raise ConnectionError(f"Connection error: {req_err}") from None
+                        retry_delay = self.retry_policy.next_delay(url, error_ctr, retry_after)
+                    if retry_delay is None:
+                        raise ConnectionError(f"Connection error: {req_err}") from None
+                    logging.debug(
+                        "The %sth connection error occurred, retrying in %.1fs. %s", error_ctr, retry_delay, req_err
+                    )
+            await asyncio.sleep(retry_delay)
 
         return resp_json
 
+    @classmethod
+    def is_overload_error(cls, req_err: Exception) -> bool:
+        "Checks if an error of an async request means that the Moodle server is overloaded"
+        if isinstance(req_err, aiohttp.client_exceptions.ClientResponseError):
+            return req_err.status in cls.OVERLOAD_STATUS_CODES
+        return isinstance(req_err, asyncio.exceptions.TimeoutError)
+
     def post(self, function: str, data: Dict[str, str] = None, timeout: int = 60) -> Dict:
         """
         Sends a POST request to the REST endpoint of the Moodle system
@@ -196,25 +266,42 @@ class RequestHelper:
             self.opts.skip_cert_verify, self.opts.allow_insecure_ssl, self.opts.use_all_ciphers
         )
         error_ctr = 0
-        while error_ctr <= self.MAX_RETRIES:
+        while True:
+            retry_after = None
             try:
                 response = session.post(url, data=data_urlencoded, headers=self.RQ_HEADER, timeout=timeout)
+                if response.status_code in [429, 503]:
+                    retry_after = response.headers.get('Retry-After')
+                    raise RetryableRequestError(
+                        f'The Moodle System is overloaded. Status-Code: {str(response.status_code)}'
+                    )
                 json_result = self._initial_parse(response, url, data)
+                self.retry_policy.record_success(url)
                 break
             except RetryableRequestError as req_err:
                 error_ctr += 1
+                retry_delay = None
                 if error_ctr < self.MAX_RETRIES:
-                    logging.debug("Retryable Moodle error (attempt %s), retrying. %s", error_ctr, req_err)
-                    sleep(1)
+                    retry_delay = self.retry_policy.next_delay(url, error_ctr, retry_after)
+                if retry_delay is not None:
+                    logging.debug(
+                        "Retryable Moodle error (attempt %s), retrying in %.1fs. %s", error_ctr, retry_delay, req_err
+                    )
+                    sleep(retry_delay)
                     continue
                 raise
             except (requests.ConnectionError, requests.Timeout) as req_err:
                 # We treat requests.ConnectionErrors here specially, since they normally mean,
                 # that something went wrong, which could be fixed by a restart.
                 error_ctr += 1
+                retry_delay = None
                 if error_ctr < self.MAX_RETRIES:
-                    logging.debug("The %sth Connection Error occurred, retrying. %s", error_ctr, str(req_err))
-                    sleep(1)
+                    retry_delay = self.retry_policy.next_delay(url, error_ctr)
+                if retry_delay is not None:
+                    logging.debug(
+                        "The %sth Connection Error occurred, retrying in %.1fs. %s", error_ctr, retry_delay, req_err
+                    )
+                    sleep(retry_delay)
                     continue
                 raise ConnectionError(f"Connection error: {req_err}") from None
             except RequestException as req_err:
@@ -225,7 +312,10 @@ class RequestHelper:
         return json_result
 
     def log_response(self, function: str, data: Dict[str, str], url: str, json_result: Dict):
-        if self.opts.log_responses and function not in ['tool_mobile_get_autologin_key']:
+        if self.opts.log_responses and function not in [
+            'tool_mobile_get_autologin_key',
+            'tool_mobile_call_external_functions',  # Batched calls are logged one by one
+        ]:
             with open(self.log_responses_to, 'a', encoding='utf-8') as response_log_file:
                 response_log_file.write(f'URL: {url}\n')
                 response_log_file.write(f'Function: {function}\n\n')
@@ -340,8 +430,8 @@ class RequestHelper:
                 + f" Reproduction link: {resp_json.get('reproductionlink', '')})"
             )
             if error_code in self.RETRYABLE_MOODLE_ERRORS:
-                raise RetryableRequestError(error_msg)
-            raise RequestRejectedError(error_msg)
+                raise RetryableRequestError(error_msg, error_code)
+            raise RequestRejectedError(error_msg, error_code)
 
         if 'exception' in resp_json:
             self.log_failed_request(url, data)
@@ -350,7 +440,8 @@ class RequestHelper:
             if error_code == 'invalidtoken':
                 raise RequestRejectedError(
                     'Your Moodle token has expired.'
-                    + ' To create a new one run "moodle-dl -nt -u USERNAME -pw PASSWORD" or "moodle-dl -nt -sso"'
+                    + ' To create a new one run "moodle-dl -nt -u USERNAME -pw PASSWORD" or "moodle-dl -nt -sso"',
+                    error_code,
                 )
 
             error_msg = (
@@ -359,8 +450,8 @@ class RequestHelper:
                 + f" Message: {resp_json.get('message', '')})"
             )
             if error_code in self.RETRYABLE_MOODLE_ERRORS:
-                raise RetryableRequestError(error_msg)
-            raise RequestRejectedError(error_msg)
+                raise RetryableRequestError(error_msg, error_code)
+            raise RequestRejectedError(error_msg, error_code)
 
     @staticmethod
     def recursive_urlencode(data):
@@ -396,7 +487,9 @@ class RequestRejectedError(Exception):
     """An Exception which gets thrown if the Moodle-System answered with an
     Error to our Request"""
 
-    pass
+    def __init__(self, message: str = '', error_code: str = None):
+        super().__init__(message)
+        self.error_code = error_code
 
 
 class RetryableRequestError(RequestRejectedError):
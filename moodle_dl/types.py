@@ -30,6 +30,8 @@ class File:
         file_hash: str = None,
         file_id: int = None,
         old_file_id: int = None,
+        content_hash: str = None,
+        content_size: int = None,
     ):
         self.file_id = file_id
 
@@ -83,6 +85,10 @@ class File:
 
         self.hash = file_hash
 
+        # SHA-256 and size in bytes of the downloaded content
+        self.content_hash = content_hash
+        self.content_size = content_size
+
         # For text label
         self.text_content = None
 
@@ -118,6 +124,8 @@ class File:
             'notified': 1 if self.notified else 0,
             'hash': self.hash,
             'old_file_id': self.old_file_id,
+            'content_hash': self.content_hash,
+            'content_size': self.content_size,
         }
 
     @staticmethod
@@ -144,6 +152,8 @@ class File:
             notified=row['notified'],
             file_hash=row['hash'],
             old_file_id=row['old_file_id'],
+            content_hash=row['content_hash'],
+            content_size=row['content_size'],
         )
 
     INSERT = """INSERT INTO files
@@ -152,14 +162,14 @@ class File:
             content_fileurl, content_filesize, content_timemodified,
             module_modname, content_type, content_isexternalfile,
             saved_to, time_stamp, modified, moved, deleted, notified,
-            hash, old_file_id)
+            hash, old_file_id, content_hash, content_size)
             VALUES (:course_id, :course_fullname, :module_id,
             :section_name, :section_id, :module_name, :content_filepath,
             :content_filename, :content_fileurl, :content_filesize,
             :content_timemodified, :module_modname, :content_type,
             :content_isexternalfile, :saved_to, :time_stamp,
             :modified, :moved, :deleted, :notified,  :hash,
-            :old_file_id);
+            :old_file_id, :content_hash, :content_size);
             """
 
     def __str__(self):
@@ -200,6 +210,8 @@ class File:
         message += f', hash: {self.hash}'
         message += f', file_id: {self.file_id}'
         message += f', old_file_id: {self.old_file_id}'
+        message += f', content_hash: {self.content_hash}'
+        message += f', content_size: {self.content_size}'
 
         message += ')'
         return message
@@ -217,6 +229,7 @@ class Course:
         self.overwrite_name_with = None
         self.create_directory_structure = True
         self.excluded_sections = []
+        self.priority = 0  # files of courses with a higher priority are downloaded first
 
     def __str__(self):
         message = 'Course ('
@@ -258,6 +271,7 @@ class MoodleDlOpts:
     change_notification_xmpp: bool
     manage_database: bool
     delete_old_files: bool
+    verify_local_files: bool
     log_responses: bool
     add_all_visible_courses: bool
     sso: bool
@@ -266,11 +280,35 @@ class MoodleDlOpts:
     token: str
     path: str
     max_parallel_api_calls: int
+    adaptive_api_calls: bool
+    api_batch_size: int
+    api_batch_window: float
     max_parallel_downloads: int
+    auto_parallel_downloads: bool
+    min_parallel_downloads: int
+    max_parallel_downloads_per_host: int
+    max_parallel_moodle_downloads: int
+    download_order: str
     max_parallel_yt_dlp: int
+    max_parallel_external_downloads: int
+    max_connections_per_host: int
+    stall_timeout: int
+    min_download_speed: int
+    circuit_breaker_threshold: int
+    circuit_breaker_cooldown: int
     download_chunk_size: int
+    download_segments: int
+    segmented_download_min_size: int
+    max_parallel_segments: int
+    verify_hashes: bool
+    requeue_broken_files: bool
+    retry_base_delay: float
+    retry_max_delay: float
+    retry_budget: int
     ignore_ytdl_errors: bool
     without_downloading_files: bool
+    pipeline: bool
+    incremental_sync: bool
     max_path_length_workaround: bool
     allow_insecure_ssl: bool
     use_all_ciphers: bool
@@ -289,6 +327,32 @@ class TaskState(Enum):
     FINISHED = 'FINISHED'
 
 
+class TaskClass(Enum):
+    "Kind of work of a task; each class has its own download slots"
+
+    HTTP = 'HTTP'  # plain file downloads
+    YT_DLP = 'YT_DLP'  # external links, that are probably downloaded with yt-dlp
+    EXTERNAL = 'EXTERNAL'  # external links, that are downloaded with an external downloader command
+    LOCAL = 'LOCAL'  # files that are created without downloading, like descriptions
+
+
+class CircuitState(Enum):
+    "State of the circuit breaker of a host"
+
+    CLOSED = 'closed'  # downloads are started
+    OPEN = 'open'  # downloads fail without trying
+    HALF_OPEN = 'half-open'  # one probe download is running
+
+
+class DownloadOrder(Enum):
+    "Order in which the download queue is worked off, within files of the same course priority"
+
+    COURSE = 'course'  # course by course, file by file, like the files were fetched
+    SMALLEST_FIRST = 'smallest-first'
+    NEWEST_FIRST = 'newest-first'  # by the time the file was modified in Moodle
+    ROUND_ROBIN_COURSES = 'round-robin-courses'  # courses take turns
+
+
 @dataclass
 class TaskStatus:
     state: TaskState = field(init=False, default=TaskState.INIT)
@@ -301,6 +365,10 @@ class TaskStatus:
     yt_dlp_total_size_per_file: Dict[str, int] = field(init=False, default_factory=dict)
     yt_dlp_bytes_downloaded_per_file: Dict[str, int] = field(init=False, default_factory=dict)
     skip_requested: bool = field(init=False, default=False)
+    restarts: int = field(init=False, default=0)  # how often the task was cancelled and put back into the queue
+    open_transfers: int = field(init=False, default=0)  # responses whose body is received at the moment
+    retries: int = field(init=False, default=0)  # how often the task was put back into the queue after an error
+    retry_delay: float = field(init=False, default=None)  # seconds until the task is started again
 
     def get_error_text(self) -> str:
         str_error = str(self.error).strip()
@@ -327,6 +395,7 @@ class DlEvent(Enum):
     RECEIVED = 'RECEIVED'
     TOTAL_SIZE = 'TOTAL_SIZE'
     TOTAL_SIZE_UPDATE = 'TOTAL_SIZE_UPDATE'
+    RETRY = 'RETRY'  # a failed task is started again
 
 
 @dataclass
@@ -358,3 +427,30 @@ class HeadInfo:
     def __post_init__(self):
         if self.content_type in ('text/html', 'text/plain'):
             self.is_html = True
+
+
+@dataclass
+class PartialDownload:
+    url_key: str
+    part_path: str
+    bytes_received: int
+    etag: str
+    last_modified: str
+    time_stamp: int
+
+    def get_validator(self) -> str:
+        # return the validator that is send in the If-Range header, weak ETags are not allowed there
+        if self.etag is not None and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+
+@dataclass
+class HttpValidator:
+    url_key: str
+    etag: str
+    last_modified: str
+    content_length: int
+    content_type: str
+    saved_to: str
+    time_stamp: int
@@ -10,12 +10,15 @@ import itertools
 import logging
 import math
 import os
+import random
 import re
 import shutil
 import ssl
 import sys
+import threading
 import time
 import unicodedata
+import urllib.parse as urlparse
 from functools import cache
 from pathlib import Path
 from typing import Dict, List, Optional
@@ -25,6 +28,7 @@ import requests
 import urllib3
 from aiohttp.cookiejar import CookieJar
 from requests.utils import DEFAULT_CA_BUNDLE_PATH, extract_zipped_paths
+from yarl import URL
 
 
 def check_verbose() -> bool:
@@ -146,6 +150,17 @@ def determine_ext(url, default_ext='unknown_file'):
         return default_ext
 
 
+def get_url_key(url: str) -> str:
+    """
+    Removes the token from the query of an URL, so that the URL can be used as key across runs
+    even if the token changed.
+    """
+    url_parts = list(urlparse.urlparse(url))
+    query = [(key, value) for key, value in urlparse.parse_qsl(url_parts[4]) if key != 'token']
+    url_parts[4] = urlparse.urlencode(query)
+    return urlparse.urlunparse(url_parts)
+
+
 def timeconvert(timestr):
     """Convert RFC 2822 defined time string into system timestamp"""
     timestamp = None
@@ -215,35 +230,30 @@ def str_or_none(v, default=None):
     return default if v is None else str(v)
 
 
-def convert_to_aiohttp_cookie_jar(mozilla_cookie_jar: http.cookiejar.MozillaCookieJar):
+def convert_to_aiohttp_cookie_jar(mozilla_cookie_jar: http.cookiejar.MozillaCookieJar, hostname: str = None):
     """
     Convert an http.cookiejar.MozillaCookieJar that uses a Netscape HTTP Cookie File to an aiohttp.cookiejar.CookieJar
-    Tested with aiohttp v3.8.4
+    The cookies are added like the server of their domain had set them, so that aiohttp only sends them to the
+    hosts they belong to (host only cookies to their host, domain cookies also to the subdomains).
+    @param hostname: Only take the cookies that are sent to this host, None takes all cookies
     """
     aiohttp_cookie_jar = CookieJar(unsafe=True)  # unsafe = Allow also cookies for IPs
 
-    # pylint: disable=protected-access
-    for cookie_domain, domain_cookies in mozilla_cookie_jar._cookies.items():
-        for cookie_path, path_cookies in domain_cookies.items():
-            for cookie_name, cookie in path_cookies.items():
-                # cookie_name is cookie.name; cookie_path is cookie.path; cookie_domain is cookie.domain
-                morsel = http.cookies.Morsel()
-                morsel.update(
-                    {
-                        "expires": cookie.expires,
-                        "path": cookie.path,
-                        "comment": cookie.comment,
-                        "domain": cookie.domain,
-                        # "max-age"  : "Max-Age",
-                        "secure": cookie.secure,
-                        # "httponly": "HttpOnly",
-                        "version": cookie.version,
-                        # "samesite": "SameSite",
-                    }
-                )
-                # pylint: disable=protected-access
-                morsel.set(cookie.name, cookie.value, http.cookies._quote(cookie.value))
-                aiohttp_cookie_jar._cookies[(cookie_domain, cookie_path)][cookie_name] = morsel
+    for cookie in mozilla_cookie_jar:
+        cookie_domain = cookie.domain.lstrip('.')
+        if hostname is not None and not (
+            hostname == cookie_domain or (cookie.domain_specified and hostname.endswith('.' + cookie_domain))
+        ):
+            continue
+        morsel = http.cookies.Morsel()
+        # pylint: disable=protected-access
+        morsel.set(cookie.name, cookie.value, http.cookies._quote(cookie.value))
+        morsel['path'] = cookie.path or '/'
+        morsel['secure'] = cookie.secure
+        if cookie.domain_specified:
+            # Without a domain attribute the cookie is only sent to the host that set it
+            morsel['domain'] = cookie_domain
+        aiohttp_cookie_jar.update_cookies({cookie.name: morsel}, URL(f'https://{cookie_domain}/'))
 
     return aiohttp_cookie_jar
 
@@ -416,6 +426,92 @@ class Timer:
             self.duration = end - self.start
 
 
+class RetryPolicy:
+    """
+    Decides if and when a failed request is retried. It is shared by all requests to spread the retries.
+    The delay grows exponentially with each attempt and is fully randomized (full jitter), so that many
+    requests that failed at the same moment do not hit the server again at the same moment.
+    A Retry-After header of the server is honored, but capped at the max delay.
+    Each host has a retry budget: every retry costs one token, every success earns a part of a token back.
+    If the budget of a host is used up, requests to it are not retried anymore until it recovers.
+    """
+
+    BUDGET_REFILL = 0.1  # tokens a successful request earns back
+
+    def __init__(self, base_delay: float, max_delay: float, budget: int):
+        """
+        @param base_delay: Max delay in seconds before the first retry
+        @param max_delay: Max delay in seconds before any retry
+        @param budget: Max number of retries per host, that are not earned back by successful requests
+        """
+        self.base_delay = max(0.0, base_delay)
+        self.max_delay = max(self.base_delay, max_delay)
+        self.budget = max(0, budget)
+        self.tokens: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlparse.urlparse(url).hostname or ''
+
+    @staticmethod
+    def parse_retry_after(retry_after: str) -> Optional[float]:
+        "@return: Seconds to wait according to a Retry-After header (seconds or HTTP date), or None"
+        if retry_after is None:
+            return None
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return float(retry_after)
+        timestamp = timeconvert(retry_after)
+        if timestamp is None:
+            return None
+        return max(0.0, timestamp - time.time())
+
+    def get_delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        @param attempt: Number of the failed attempt, starting with 1
+        @param retry_after: Value of the Retry-After header of the failed response
+        @return: Seconds to wait before the next attempt
+        """
+        server_delay = self.parse_retry_after(retry_after)
+        if server_delay is not None:
+            # A small jitter on top, so that throttled requests do not come back all at once
+            return min(self.max_delay, server_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def take_token(self, url: str) -> bool:
+        """
+        Takes a token from the retry budget of the host of url
+        @return: False if the budget is used up and the request should not be retried
+        """
+        host = self.get_host(url)
+        with self.lock:
+            tokens = self.tokens.get(host, float(self.budget))
+            if tokens < 1:
+                logging.debug('Retry budget of %s is used up, not retrying', host)
+                return False
+            self.tokens[host] = tokens - 1
+        return True
+
+    def next_delay(self, url: str, attempt: int, retry_after: str = None) -> Optional[float]:
+        """
+        Takes a token from the retry budget of the host of url
+        @return: Seconds to wait before the next attempt, or None if the request should not be retried
+        """
+        if not self.take_token(url):
+            return None
+        return self.get_delay(attempt, retry_after)
+
+    def record_success(self, url: str):
+        "Earns back a part of the retry budget of the host of url"
+        host = self.get_host(url)
+        with self.lock:
+            tokens = self.tokens.get(host)
+            if tokens is not None:
+                # Rounded, so that ten refills of 0.1 add up to a whole token
+                self.tokens[host] = min(float(self.budget), round(tokens + self.BUDGET_REFILL, 6))
+
+
 PathParts = collections.namedtuple('PathParts', ('dir_name', 'file_name', 'file_extension'))
 
 
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+from typing import Callable, Dict
+
+import pytest
+from aiohttp import web
+
+
+@pytest.fixture
+def serve():
+    """
+    Runs aiohttp handlers on a local server in a background thread
+    @return: A function that takes a dict of route paths to handlers and returns the base URL of the server
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    runners = []
+
+    async def start(routes: Dict[str, Callable]) -> str:
+        app = web.Application()
+        for path, handler in routes.items():
+            app.router.add_route('*', path, handler)
+        runner = web.AppRunner(app)
+        runners.append(runner)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        return f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+    yield lambda routes: asyncio.run_coroutine_threadsafe(start(routes), loop).result()
+
+    for runner in runners:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
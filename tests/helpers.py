@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from moodle_dl.config import ConfigHelper
+from moodle_dl.database import StateRecorder
+from moodle_dl.downloader.download_service import DownloadService
+from moodle_dl.main import get_parser
+from moodle_dl.types import Course, File, MoodleDlOpts
+
+
+def make_config(tmp_path: Path, args: List[str] = (), config: Dict = None) -> (MoodleDlOpts, ConfigHelper):
+    "Creates a configuration that downloads to tmp_path/dl"
+    config_data = {
+        'token': 'token',
+        'moodle_domain': '127.0.0.1',
+        'moodle_path': '/',
+        'download_path': str(tmp_path / 'dl'),
+    }
+    config_data.update(config or {})
+    (tmp_path / 'config.json').write_text(json.dumps(config_data), encoding='utf-8')
+    opts = MoodleDlOpts(**vars(get_parser().parse_args(['-p', str(tmp_path), *args])))
+    config_helper = ConfigHelper(opts)
+    config_helper.load()
+    return opts, config_helper
+
+
+def make_course(urls: List[str], course_id: int = 1) -> Course:
+    "Creates a course with one file resource per URL"
+    course = Course(course_id, f'course{course_id}')
+    for idx, url in enumerate(urls):
+        course.files.append(File(idx, 'sec', 0, 'mod', '/', f'file{idx}.bin', url, 0, 0, 'resource', 'file', False))
+    return course
+
+
+def run_downloads(tmp_path: Path, courses: List[Course], args: List[str] = (), config: Dict = None) -> DownloadService:
+    "Downloads the files of the courses and returns the finished download service"
+    opts, config_helper = make_config(tmp_path, args, config)
+    database = StateRecorder(config_helper, opts)
+    try:
+        download_service = DownloadService(courses, config_helper, opts, database)
+        download_service.run()
+    finally:
+        database.close()
+    return download_service
+
+
+class FakeFileHost:
+    """
+    Serves files like a web server, with ETags, byte ranges, If-Range and If-None-Match.
+    Use it with the serve fixture: serve({'/f/{name}': host.handle})
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, files: Dict[str, bytes], accept_ranges: bool = True, chunk_delay: float = 0):
+        self.files = files
+        self.accept_ranges = accept_ranges
+        self.chunk_delay = chunk_delay
+        # Breaks the connection of the next response of a file, after the given number of bytes of the body
+        self.break_after: Dict[str, int] = {}
+        # Breaks the connection of the next range responses of a file (longer than a byte), after half of the range
+        self.break_ranges: Dict[str, int] = {}
+        self.requests: List[Tuple[str, Dict[str, str]]] = []
+
+    @staticmethod
+    def get_etag(content: bytes) -> str:
+        return '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+
+    def get_requests(self, name: str) -> List[Dict[str, str]]:
+        "@return: The headers of the requests of a file"
+        return [headers for requested_name, headers in self.requests if requested_name == name]
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info['name']
+        content = self.files[name]
+        etag = self.get_etag(content)
+        self.requests.append((name, dict(request.headers)))
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        first_byte, last_byte, status = 0, len(content) - 1, 200
+        range_header = request.headers.get('Range')
+        if range_header is not None and self.accept_ranges and request.headers.get('If-Range', etag) == etag:
+            first, last = range_header[len('bytes=') :].split('-')
+            first_byte, last_byte, status = int(first), min(int(last or last_byte), last_byte), 206
+
+        headers = {'ETag': etag, 'Content-Length': str(last_byte + 1 - first_byte)}
+        if self.accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+        if status == 206:
+            headers['Content-Range'] = f'bytes {first_byte}-{last_byte}/{len(content)}'
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+
+        body = content[first_byte : last_byte + 1]
+        break_at = self.break_after.pop(name, None)
+        if status == 206 and len(body) > 1 and self.break_ranges.get(name, 0) > 0:
+            self.break_ranges[name] -= 1
+            break_at = len(body) // 2
+        for offset in range(0, len(body), self.CHUNK_SIZE):
+            if break_at is not None and offset >= break_at:
+                request.transport.abort()
+                return response
+            await response.write(body[offset : offset + self.CHUNK_SIZE])
+            if self.chunk_delay > 0:
+                await asyncio.sleep(self.chunk_delay)
+        return response
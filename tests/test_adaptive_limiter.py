@@ -0,0 +1,47 @@
+import asyncio
+
+from moodle_dl.moodle.adaptive_limiter import AdaptiveLimiter
+
+
+def test_cancelled_requests_free_their_slots():
+    limiter = AdaptiveLimiter('requests', max_limit=2, adaptive=False)
+
+    async def request(duration: float):
+        async with limiter.slot():
+            await asyncio.sleep(duration)
+
+    async def run():
+        running = [asyncio.ensure_future(request(10)) for _ in range(2)]
+        waiting = [asyncio.ensure_future(request(10)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 2
+
+        for task in running + waiting[:1]:
+            task.cancel()
+        await asyncio.sleep(0.01)
+        # The remaining waiting request got a slot, the cancelled ones gave theirs back
+        assert limiter.in_flight == 1
+        waiting[1].cancel()
+        await asyncio.gather(*running, *waiting, return_exceptions=True)
+        assert limiter.in_flight == 0
+        assert limiter.waiters == []
+
+    asyncio.run(run())
+
+
+def test_waiting_requests_start_when_slots_are_released():
+    limiter = AdaptiveLimiter('requests', max_limit=3, adaptive=False)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.001)
+
+    async def run():
+        await asyncio.gather(*[request() for _ in range(20)])
+
+    asyncio.run(run())
+    assert peak == 3
+    assert limiter.in_flight == 0
@@ -0,0 +1,287 @@
+"""
+Differential tests of the change detection: the indexed and set-based implementations of the StateRecorder
+are compared with the previous per-file implementations on randomized course snapshots.
+"""
+
+import copy
+import random
+from typing import List
+
+import pytest
+
+from moodle_dl.database import StateRecorder
+from moodle_dl.types import Course, File
+from tests.helpers import make_config
+
+ROUNDS = 8
+
+
+def old_get_modified_files(stored_courses: List[Course], current_courses: List[Course]) -> List[Course]:
+    changed_courses = []
+    for stored_course in stored_courses:
+        same_course_in_current = None
+        for current_course in current_courses:
+            if current_course.id == stored_course.id:
+                same_course_in_current = current_course
+                break
+
+        if same_course_in_current is None:
+            for stored_file in stored_course.files:
+                stored_file.deleted = True
+                stored_file.notified = False
+            changed_courses.append(stored_course)
+            continue
+
+        changed_course = Course(stored_course.id, stored_course.fullname)
+        for stored_file in stored_course.files:
+            matching_file = None
+            for current_file in same_course_in_current.files:
+                if StateRecorder.files_have_same_path(current_file, stored_file):
+                    matching_file = current_file
+                    break
+
+            if matching_file is not None:
+                if StateRecorder.files_are_diffrent(matching_file, stored_file):
+                    matching_file.modified = True
+                    matching_file.old_file = stored_file
+                    changed_course.files.append(matching_file)
+                continue
+
+            for current_file in same_course_in_current.files:
+                if StateRecorder.file_was_moved(current_file, stored_file):
+                    matching_file = current_file
+                    break
+
+            if matching_file is None and not StateRecorder.ignore_deleted(stored_file):
+                stored_file.deleted = True
+                stored_file.notified = False
+                changed_course.files.append(stored_file)
+            elif matching_file is not None:
+                matching_file.moved = True
+                matching_file.old_file = stored_file
+                changed_course.files.append(matching_file)
+
+        if len(changed_course.files) > 0:
+            changed_courses.append(changed_course)
+
+    return changed_courses
+
+
+def old_get_new_files(
+    changed_courses: List[Course], stored_courses: List[Course], current_courses: List[Course]
+) -> List[Course]:
+    for current_course in current_courses:
+        same_course_in_stored = None
+        for stored_course in stored_courses:
+            if stored_course.id == current_course.id:
+                same_course_in_stored = stored_course
+                break
+
+        if same_course_in_stored is None:
+            changed_courses.append(current_course)
+            continue
+
+        changed_course = Course(current_course.id, current_course.fullname)
+        for current_file in current_course.files:
+            matching_file = None
+            for stored_file in same_course_in_stored.files:
+                has_same_path = StateRecorder.files_have_same_path(current_file, stored_file)
+                was_moved = StateRecorder.file_was_moved(current_file, stored_file)
+                if has_same_path or was_moved:
+                    matching_file = current_file
+                    break
+
+            if matching_file is None:
+                changed_course.files.append(current_file)
+
+        if len(changed_course.files) > 0:
+            matched_changed_course = None
+            for ch_course in changed_courses:
+                if ch_course.id == changed_course.id:
+                    matched_changed_course = ch_course
+                    break
+            if matched_changed_course is None:
+                changed_courses.append(changed_course)
+            else:
+                matched_changed_course.files += changed_course.files
+    return changed_courses
+
+
+def old_get_stored_files(database: StateRecorder) -> List[Course]:
+    cursor = database.conn.cursor()
+    cursor.execute(
+        """SELECT course_id, course_fullname
+        FROM files WHERE deleted = 0 AND modified = 0 AND moved = 0
+        GROUP BY course_id;"""
+    )
+    stored_courses = []
+    for course_row in cursor.fetchall():
+        course = Course(course_row['course_id'], course_row['course_fullname'])
+        cursor.execute(
+            """SELECT *
+            FROM files
+            WHERE deleted = 0
+            AND modified = 0
+            AND moved = 0
+            AND course_id = ?;""",
+            (course.id,),
+        )
+        course.files = [File.fromRow(file_row) for file_row in cursor.fetchall()]
+        stored_courses.append(course)
+    return stored_courses
+
+
+def old_get_old_files(database: StateRecorder) -> List[Course]:
+    cursor = database.conn.cursor()
+    cursor.execute(
+        """SELECT DISTINCT course_id, course_fullname
+        FROM files WHERE old_file_id IS NOT NULL"""
+    )
+    stored_courses = []
+    for course_row in cursor.fetchall():
+        course = Course(course_row['course_id'], course_row['course_fullname'])
+        cursor.execute(
+            """SELECT *
+            FROM files
+            WHERE course_id = ?
+            AND old_file_id IS NOT NULL""",
+            (course.id,),
+        )
+        course.files = []
+        for updated_file in cursor.fetchall():
+            old_cursor = database.conn.cursor()
+            old_cursor.execute('SELECT * FROM files WHERE file_id = ?', (updated_file['old_file_id'],))
+            course.files.append(File.fromRow(old_cursor.fetchone()))
+        stored_courses.append(course)
+    return stored_courses
+
+
+def old_changes_to_notify(database: StateRecorder) -> List[Course]:
+    cursor = database.conn.cursor()
+    cursor.execute(
+        """SELECT course_id, course_fullname
+        FROM files WHERE notified = 0 GROUP BY course_id;"""
+    )
+    changed_courses = []
+    for course_row in cursor.fetchall():
+        course = Course(course_row['course_id'], course_row['course_fullname'])
+        cursor.execute('SELECT * FROM files WHERE notified = 0 AND course_id = ?;', (course.id,))
+        course.files = []
+        for file_row in cursor.fetchall():
+            notify_file = File.fromRow(file_row)
+            if notify_file.modified or notify_file.moved:
+                new_cursor = database.conn.cursor()
+                new_cursor.execute('SELECT * FROM files WHERE old_file_id = ?;', (notify_file.file_id,))
+                new_file_row = new_cursor.fetchone()
+                if new_file_row is not None:
+                    notify_file.new_file = File.fromRow(new_file_row)
+            course.files.append(notify_file)
+        changed_courses.append(course)
+    return changed_courses
+
+
+def describe_file(file: File):
+    if file is None:
+        return None
+    return (file.getMap(), describe_file(file.old_file), describe_file(file.new_file))
+
+
+def describe(courses: List[Course]):
+    "Turns courses into plain values, that differ if any attribute of a course or file differs"
+    return [(course.id, course.fullname, [describe_file(file) for file in course.files]) for course in courses]
+
+
+class SnapshotGenerator:
+    "Creates course snapshots from small value pools, so that files often share paths, urls and sizes"
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+
+    def new_file(self) -> File:
+        choice = self.random.choice
+        content_type = choice(['file', 'file', 'file', 'description', 'html', 'description-url'])
+        return File(
+            module_id=choice([1, 2, 3]),
+            section_name=choice(['s1', 's2']),
+            section_id=1,
+            module_name=choice(['m1', 'm2']),
+            content_filepath=choice(['/', '/sub/']),
+            content_filename=choice(['a', 'b', 'c', 'd']),
+            content_fileurl=choice(['u1', 'u2', 'u3']),
+            content_filesize=choice([1, 2]),
+            content_timemodified=choice([1, 2]),
+            module_modname=choice(['resource', 'resource', 'folder', 'forum']),
+            content_type=content_type,
+            content_isexternalfile=False,
+            file_hash=choice([None, 'h1', 'h2']),
+        )
+
+    def change_file(self, file: File) -> File:
+        file = copy.copy(file)
+        attribute = self.random.choice(
+            ['module_id', 'section_name', 'content_filename', 'content_fileurl', 'content_filesize', 'hash']
+        )
+        setattr(file, attribute, getattr(self.new_file(), attribute))
+        return file
+
+    def next_snapshot(self, previous: List[Course]) -> List[Course]:
+        courses = []
+        for course in previous:
+            if self.random.random() < 0.1:
+                continue
+            files = []
+            for file in course.files:
+                dice = self.random.random()
+                if dice < 0.6:
+                    files.append(copy.copy(file))
+                elif dice < 0.9:
+                    files.append(self.change_file(file))
+            files += [self.new_file() for _ in range(self.random.randint(0, 4))]
+            courses.append(Course(course.id, course.fullname, files))
+
+        known_ids = {course.id for course in previous}
+        for course_id in range(1, 5):
+            if course_id not in known_ids and self.random.random() < 0.5:
+                files = [self.new_file() for _ in range(self.random.randint(1, 12))]
+                courses.append(Course(course_id, f'course{course_id}', files))
+        return courses
+
+
+def check_readers(database: StateRecorder):
+    assert describe(database.get_stored_files()) == describe(old_get_stored_files(database))
+    assert describe(database.get_old_files()) == describe(old_get_old_files(database))
+    assert describe(database.changes_to_notify()) == describe(old_changes_to_notify(database))
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_change_detection_matches_previous_implementation(tmp_path, seed):
+    opts, config_helper = make_config(tmp_path)
+    database = StateRecorder(config_helper, opts)
+    generator = SnapshotGenerator(seed)
+    current_courses = []
+    try:
+        for _ in range(ROUNDS):
+            current_courses = generator.next_snapshot(current_courses)
+            stored_courses = database.get_stored_files()
+
+            changes = database.changes_of_new_version(copy.deepcopy(current_courses), copy.deepcopy(stored_courses))
+            old_stored_courses = copy.deepcopy(stored_courses)
+            old_current_courses = copy.deepcopy(current_courses)
+            old_changes = old_get_new_files(
+                old_get_modified_files(old_stored_courses, old_current_courses),
+                old_stored_courses,
+                old_current_courses,
+            )
+            assert describe(changes) == describe(old_changes)
+
+            for course in changes:
+                for file in course.files:
+                    database.save_file(file, course.id, course.fullname)
+            database.flush()
+            check_readers(database)
+
+            if generator.random.random() < 0.5:
+                database.notified(database.changes_to_notify())
+                check_readers(database)
+    finally:
+        database.close()
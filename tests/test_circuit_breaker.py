@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+from moodle_dl.downloader.circuit_breaker import CircuitBreaker, CircuitOpenError
+from moodle_dl.types import CircuitState
+from tests.helpers import make_course, run_downloads
+
+
+def test_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker('files.example.com', threshold=3, cooldown=0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow_download()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    # The cooldown is over, so exactly one probe is let through
+    assert breaker.allow_download()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.allow_download()
+
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_download()
+
+
+def test_failed_probe_opens_again():
+    breaker = CircuitBreaker('files.example.com', threshold=1, cooldown=0)
+    assert breaker.record_failure()
+    assert breaker.allow_download()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_waits_during_cooldown():
+    breaker = CircuitBreaker('files.example.com', threshold=1, cooldown=60)
+    breaker.record_failure()
+    assert not breaker.allow_download()
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_recovered_host_is_probed(tmp_path, serve):
+    requests = []
+
+    async def recovering(request):
+        requests.append(request.match_info['name'])
+        if len(requests) <= 2:
+            return web.Response(status=503)
+        return web.Response(body=b'x' * 1000)
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.Response(body=b'x' * 1000)
+
+    moodle_url = serve({'/f/{name}': slow})
+    # Another host name, so that it counts as external host
+    external_url = serve({'/f/{name}': recovering}).replace('127.0.0.1', 'localhost')
+    course = make_course(
+        [f'{moodle_url}/f/moodle{idx}' for idx in range(6)] + [f'{external_url}/f/ext{idx}' for idx in range(4)]
+    )
+    download_service = run_downloads(
+        tmp_path, [course], ['-mpd', '2', '-mpdh', '2', '-rbd', '0.1', '-cbt', '2', '-cbc', '1']
+    )
+
+    assert download_service.get_failed_tasks() == []
+    assert requests.count('ext0') + requests.count('ext1') >= 3
+    assert download_service.scheduler.breakers['localhost'].state == CircuitState.CLOSED
+
+
+def test_dead_host_does_not_wait_for_cooldown(tmp_path):
+    course = make_course([f'http://localhost:1/f/dead{idx}' for idx in range(10)])
+    started = time.time()
+    download_service = run_downloads(tmp_path, [course], ['-rbd', '0.1', '-cbt', '2', '-cbc', '600'])
+
+    assert time.time() - started < 30
+    failed_tasks = download_service.get_failed_tasks()
+    assert len(failed_tasks) == 10
+    assert any(isinstance(task.status.error, CircuitOpenError) for task in failed_tasks)
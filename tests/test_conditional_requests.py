@@ -0,0 +1,59 @@
+import os
+
+from moodle_dl.downloader.http_validators import HttpValidators
+from tests.helpers import FakeFileHost, make_course, run_downloads
+
+
+def download_twice(tmp_path, serve, change_content: bool = False):
+    "Downloads a file, and downloads it again in a second run"
+    content = os.urandom(100 * 1024)
+    host = FakeFileHost({'a': content})
+    url = serve({'/f/{name}': host.handle}) + '/f/a'
+    first_run = run_downloads(tmp_path, [make_course([url])])
+    assert first_run.get_failed_tasks() == []
+
+    if change_content:
+        content = os.urandom(100 * 1024)
+        host.files['a'] = content
+    second_run = run_downloads(tmp_path, [make_course([url])])
+    assert second_run.get_failed_tasks() == []
+
+    first_file = first_run.all_tasks[0].file
+    second_file = second_run.all_tasks[0].file
+    assert second_file.saved_to != first_file.saved_to
+    with open(second_file.saved_to, 'rb') as saved_file:
+        assert saved_file.read() == content
+    return host, first_file, second_file
+
+
+def test_not_modified_file_uses_the_local_copy(tmp_path, serve):
+    host, first_file, second_file = download_twice(tmp_path, serve)
+
+    requests = host.get_requests('a')
+    assert len(requests) == 2
+    assert requests[1]['If-None-Match'] == FakeFileHost.get_etag(host.files['a'])
+    assert second_file.content_hash == first_file.content_hash
+
+
+def test_modified_file_is_downloaded(tmp_path, serve):
+    host, first_file, second_file = download_twice(tmp_path, serve, change_content=True)
+
+    requests = host.get_requests('a')
+    assert len(requests) == 2
+    assert 'If-None-Match' in requests[1]
+    assert second_file.content_hash != first_file.content_hash
+
+
+def test_missing_local_copy_falls_back_to_a_full_download(tmp_path, serve, monkeypatch):
+    # The local copy was there when the request was sent, but is gone when the server answers 304
+    def get_gone_local_copy(validator, other_paths):
+        return str(tmp_path / 'gone.bin') if validator is not None else None
+
+    monkeypatch.setattr(HttpValidators, 'get_local_copy', staticmethod(get_gone_local_copy))
+    host, first_file, second_file = download_twice(tmp_path, serve)
+
+    requests = host.get_requests('a')
+    assert len(requests) == 3
+    assert 'If-None-Match' in requests[1]
+    assert 'If-None-Match' not in requests[2]
+    assert second_file.content_hash == first_file.content_hash
@@ -0,0 +1,49 @@
+import os
+
+from tests.helpers import FakeFileHost, make_course, run_downloads
+
+DEDUP_CONFIG = {'deduplicate_files': True}
+
+
+def assert_linked(first_path: str, second_path: str, log_text: str):
+    "The files are one inode (hardlink) or share their blocks (reflink, which has its own inode)"
+    with open(first_path, 'rb') as first_file, open(second_path, 'rb') as second_file:
+        assert first_file.read() == second_file.read()
+    assert os.path.samefile(first_path, second_path) or 'created reflink' in log_text
+
+
+def test_same_content_of_two_urls_is_stored_once(tmp_path, serve, caplog):
+    content = os.urandom(100 * 1024)
+    host = FakeFileHost({'a': content, 'b': content})
+    base_url = serve({'/f/{name}': host.handle})
+    course = make_course([f'{base_url}/f/a'])
+    first_run = run_downloads(tmp_path, [course], config=DEDUP_CONFIG)
+    assert first_run.get_failed_tasks() == []
+
+    caplog.set_level('DEBUG')
+    second_run = run_downloads(tmp_path, [make_course([f'{base_url}/f/b'])], config=DEDUP_CONFIG)
+    assert second_run.get_failed_tasks() == []
+
+    first_path = first_run.all_tasks[0].file.saved_to
+    second_path = second_run.all_tasks[0].file.saved_to
+    assert first_path != second_path
+    assert_linked(first_path, second_path, caplog.text)
+
+
+def test_not_modified_file_is_linked_to_the_local_copy(tmp_path, serve, caplog):
+    content = os.urandom(100 * 1024)
+    host = FakeFileHost({'a': content})
+    url = serve({'/f/{name}': host.handle}) + '/f/a'
+    first_run = run_downloads(tmp_path, [make_course([url])], config=DEDUP_CONFIG)
+    assert first_run.get_failed_tasks() == []
+
+    caplog.set_level('DEBUG')
+    second_run = run_downloads(tmp_path, [make_course([url])], config=DEDUP_CONFIG)
+    assert second_run.get_failed_tasks() == []
+
+    assert len(host.get_requests('a')) == 2
+    assert 'Not modified, linking the local copy' in caplog.text
+    first_file = first_run.all_tasks[0].file
+    second_file = second_run.all_tasks[0].file
+    assert second_file.content_hash == first_file.content_hash
+    assert_linked(first_file.saved_to, second_file.saved_to, caplog.text)
@@ -0,0 +1,54 @@
+import os
+import time
+
+from moodle_dl.cli.database_manager import DatabaseManager
+from moodle_dl.database import StateRecorder
+from moodle_dl.types import File
+from tests.helpers import make_config
+
+
+def store_file(tmp_path, name: str, content: bytes, time_stamp: int) -> File:
+    "Writes a downloaded file to the course directory and returns its database entry"
+    saved_to = tmp_path / 'dl' / 'course' / name
+    saved_to.parent.mkdir(parents=True, exist_ok=True)
+    saved_to.write_bytes(content)
+    os.utime(saved_to, (time_stamp, time_stamp))
+    return File(
+        0, 'sec', 0, 'mod', '/', name, f'https://example.org/{name}', len(content), 0, 'resource', 'file', False,
+        saved_to=str(saved_to), time_stamp=time_stamp, content_size=len(content),
+    )  # fmt: skip
+
+
+def stored_paths(tmp_path):
+    opts, config_helper = make_config(tmp_path)
+    with StateRecorder(config_helper, opts) as database:
+        return sorted(os.path.basename(path) for path in database.get_saved_paths())
+
+
+def test_requeue_keeps_locally_edited_files(tmp_path):
+    opts, config_helper = make_config(tmp_path)
+    downloaded_at = int(time.time()) - 3600
+    edited = store_file(tmp_path, 'annotated.pdf', b'original', downloaded_at)
+    truncated = store_file(tmp_path, 'truncated.pdf', b'original', downloaded_at)
+    with StateRecorder(config_helper, opts) as database:
+        database.new_file(edited, 1, 'course')
+        database.new_file(truncated, 1, 'course')
+
+    # The user annotates one file, the other one is cut off without a newer modification time
+    with open(edited.saved_to, 'ab') as edited_file:
+        edited_file.write(b' with notes')
+    with open(truncated.saved_to, 'r+b') as truncated_file:
+        truncated_file.truncate(3)
+    os.utime(truncated.saved_to, (downloaded_at, downloaded_at))
+
+    opts, config_helper = make_config(tmp_path, ['--verify-local-files', '--requeue-broken-files'])
+    manager = DatabaseManager(config_helper, opts)
+    try:
+        manager.verify_local_files()
+    finally:
+        manager.state_recorder.close()
+
+    with open(edited.saved_to, 'rb') as edited_file:
+        assert edited_file.read() == b'original with notes'
+    assert not os.path.exists(truncated.saved_to)
+    assert stored_paths(tmp_path) == ['annotated.pdf']
@@ -0,0 +1,71 @@
+from aiohttp import web
+
+from moodle_dl.types import TaskState
+from tests.helpers import make_course, run_downloads
+
+
+def failing_server(serve, failures: dict, status: int):
+    """
+    Starts a server that answers the first requests of each file with an error status
+    @param failures: Number of failing requests of each file name
+    @return: The base URL and the number of requests of each file
+    """
+    requests = {}
+
+    async def handler(request):
+        name = request.match_info['name']
+        if request.headers.get('Range') == 'bytes=0-4':
+            # Check of the download task, if the download could be continued
+            return web.Response(status=status)
+        requests[name] = requests.get(name, 0) + 1
+        if requests[name] <= failures.get(name, 0):
+            return web.Response(status=status)
+        return web.Response(body=b'x' * 1000)
+
+    return serve({'/f/{name}': handler}), requests
+
+
+def assert_consistent(download_service):
+    assert all(task.status.state in [TaskState.FINISHED, TaskState.FAILED] for task in download_service.all_tasks)
+    assert download_service.status.files_failed == len(download_service.get_failed_tasks())
+    assert download_service.status.files_downloaded + download_service.status.files_failed == len(
+        download_service.all_tasks
+    )
+    assert len(download_service.scheduler.delayed) == 0
+
+
+def test_throttled_downloads_are_retried_later(tmp_path, serve):
+    failures = {f'{idx}': 2 for idx in range(6)}
+    base_url, requests = failing_server(serve, failures, 503)
+    course = make_course([f'{base_url}/f/{idx}' for idx in range(6)])
+    download_service = run_downloads(tmp_path, [course], ['-rbd', '0.05'])
+
+    assert download_service.get_failed_tasks() == []
+    assert requests == {name: 3 for name in failures}
+    assert_consistent(download_service)
+
+
+def test_final_retry_sweep(tmp_path, serve):
+    # Server errors are not retried right away, but once at the end of the download
+    failures = {'0': 0, '1': 1, '2': 1, '3': 2, '4': 5}
+    base_url, requests = failing_server(serve, failures, 500)
+    course = make_course([f'{base_url}/f/{name}' for name in failures])
+    download_service = run_downloads(tmp_path, [course], ['-rbd', '0.05'])
+
+    failed_files = sorted(task.file.content_fileurl.rsplit('/', 1)[-1] for task in download_service.get_failed_tasks())
+    assert failed_files == ['3', '4']
+    assert requests == {'0': 1, '1': 2, '2': 2, '3': 2, '4': 2}
+    assert_consistent(download_service)
+
+
+def test_final_retry_sweep_after_used_up_retries(tmp_path, serve):
+    # Throttled downloads that used up their tries in the run get the final retry as well
+    failures = {'0': 3, '1': 4}
+    base_url, requests = failing_server(serve, failures, 503)
+    course = make_course([f'{base_url}/f/{name}' for name in failures])
+    download_service = run_downloads(tmp_path, [course], ['-rbd', '0.05'])
+
+    failed_files = [task.file.content_fileurl.rsplit('/', 1)[-1] for task in download_service.get_failed_tasks()]
+    assert failed_files == ['1']
+    assert requests == {'0': 4, '1': 4}
+    assert_consistent(download_service)
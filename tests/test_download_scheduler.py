@@ -0,0 +1,217 @@
+from moodle_dl.database import StateRecorder
+from moodle_dl.downloader.download_scheduler import DownloadScheduler
+from moodle_dl.downloader.download_service import DownloadService
+from moodle_dl.types import Course, DownloadOrder, File, TaskClass, TaskStatus
+from tests.helpers import make_config
+
+MOODLE = 'moodle.example.org'
+EXTERNAL = 'files.example.com'
+OTHER = 'videos.example.net'
+BUDGETS = {TaskClass.HTTP: 4, TaskClass.YT_DLP: 1, TaskClass.EXTERNAL: 1, TaskClass.LOCAL: 10}
+
+
+class FakeTask:
+    def __init__(
+        self,
+        name: str,
+        host: str,
+        task_class: TaskClass = TaskClass.HTTP,
+        course: Course = None,
+        size: int = 0,
+        timemodified: int = 0,
+    ):
+        self.name = name
+        self.task_class = task_class
+        url = f'https://{host}/{name}'
+        self.file = File(0, 'sec', 0, 'mod', '/', name, url, size, timemodified, 'resource', 'file', False)
+        self.course = course or Course(1, 'course1')
+        self.status = TaskStatus()
+
+    def __repr__(self):
+        return self.name
+
+
+def make_scheduler(**kwargs) -> DownloadScheduler:
+    kwargs.setdefault('budgets', BUDGETS)
+    return DownloadScheduler(MOODLE, kwargs.pop('max_parallel_per_host', 2), **kwargs)
+
+
+def pop_all(scheduler: DownloadScheduler) -> list:
+    "@return: The names of the tasks that can be started right now, in their order"
+    started = []
+    task = scheduler.pop_next()
+    while task is not None:
+        started.append(task.name)
+        task = scheduler.pop_next()
+    return started
+
+
+def finish(scheduler: DownloadScheduler, task: FakeTask):
+    scheduler.task_done(task, None)
+
+
+def test_hosts_take_turns():
+    scheduler = make_scheduler(max_parallel_per_host=10, budgets={**BUDGETS, TaskClass.HTTP: 6})
+    scheduler.add([FakeTask(f'moodle{idx}', MOODLE) for idx in range(3)])
+    scheduler.add([FakeTask(f'ext{idx}', EXTERNAL) for idx in range(3)])
+    scheduler.add([FakeTask(f'other{idx}', OTHER) for idx in range(3)])
+
+    assert pop_all(scheduler) == ['moodle0', 'ext0', 'other0', 'moodle1', 'ext1', 'other1']
+
+
+def test_external_hosts_are_capped():
+    scheduler = make_scheduler(max_parallel_per_host=2)
+    external_tasks = [FakeTask(f'ext{idx}', EXTERNAL) for idx in range(5)]
+    scheduler.add(external_tasks)
+
+    assert pop_all(scheduler) == ['ext0', 'ext1']
+    assert scheduler.running[EXTERNAL] == 2
+
+    finish(scheduler, external_tasks[0])
+    assert pop_all(scheduler) == ['ext2']
+
+
+def test_moodle_host_does_not_starve_behind_an_external_host():
+    # The external host was queued first and has far more tasks than free slots
+    scheduler = make_scheduler(max_parallel_per_host=2)
+    scheduler.add([FakeTask(f'ext{idx}', EXTERNAL) for idx in range(20)])
+    scheduler.add([FakeTask(f'moodle{idx}', MOODLE) for idx in range(5)])
+
+    # The external host only gets its cap, the other slots go to the Moodle host
+    assert pop_all(scheduler) == ['ext0', 'moodle0', 'ext1', 'moodle1']
+    assert scheduler.running[MOODLE] == 2
+
+
+def test_moodle_host_is_only_limited_by_the_slots_by_default():
+    scheduler = make_scheduler(max_parallel_per_host=1)
+    scheduler.add([FakeTask(f'moodle{idx}', MOODLE) for idx in range(6)])
+
+    assert pop_all(scheduler) == ['moodle0', 'moodle1', 'moodle2', 'moodle3']
+
+
+def test_moodle_host_cap():
+    scheduler = make_scheduler(max_parallel_per_host=1, max_parallel_moodle=2)
+    moodle_tasks = [FakeTask(f'moodle{idx}', MOODLE) for idx in range(4)]
+    scheduler.add(moodle_tasks)
+    scheduler.add([FakeTask(f'ext{idx}', EXTERNAL) for idx in range(4)])
+
+    assert pop_all(scheduler) == ['moodle0', 'ext0', 'moodle1']
+
+    finish(scheduler, moodle_tasks[0])
+    assert pop_all(scheduler) == ['moodle2']
+
+
+def test_local_tasks_are_not_capped():
+    scheduler = make_scheduler(max_parallel_per_host=1)
+    scheduler.add([FakeTask(f'desc{idx}', MOODLE, TaskClass.LOCAL) for idx in range(5)])
+
+    assert pop_all(scheduler) == [f'desc{idx}' for idx in range(5)]
+    assert scheduler.running[DownloadScheduler.LOCAL_HOST] == 5
+
+
+def test_task_classes_have_their_own_budgets():
+    scheduler = make_scheduler(max_parallel_per_host=10, budgets={**BUDGETS, TaskClass.HTTP: 2})
+    http_tasks = [FakeTask(f'http{idx}', MOODLE) for idx in range(4)]
+    scheduler.add(http_tasks)
+    scheduler.add([FakeTask(f'video{idx}', OTHER, TaskClass.YT_DLP) for idx in range(3)])
+    scheduler.add([FakeTask(f'extdl{idx}', EXTERNAL, TaskClass.EXTERNAL) for idx in range(3)])
+
+    # Long running video downloads can not take the slots of the plain downloads, and the other way around
+    assert pop_all(scheduler) == ['http0', 'http1', 'video0', 'extdl0']
+    assert scheduler.running_per_class[TaskClass.HTTP] == 2
+
+    finish(scheduler, http_tasks[0])
+    assert pop_all(scheduler) == ['http2']
+
+    scheduler.set_budget(TaskClass.YT_DLP, 2)
+    assert pop_all(scheduler) == ['video1']
+
+
+def test_tasks_are_classified_by_the_url_in_moodle(tmp_path):
+    config = {'download_linked_files': True, 'external_file_downloaders': {EXTERNAL: 'dl {url}'}}
+    files = [
+        ('file', 'resource', f'https://{MOODLE}/pluginfile.php/a.pdf'),
+        ('url', 'url', f'https://{OTHER}/watch'),
+        ('url', 'url', f'https://{EXTERNAL}/video'),
+        # Redirects to the host with the external downloader, but the class is decided before the redirect
+        ('url', 'url', f'https://{OTHER}/redirect?to={EXTERNAL}'),
+        ('description', 'label', ''),
+    ]
+    course = Course(1, 'course1')
+    for idx, (content_type, modname, url) in enumerate(files):
+        course.files.append(File(idx, 'sec', 0, modname, '/', f'f{idx}', url, 0, 0, modname, content_type, False))
+
+    opts, config_helper = make_config(tmp_path, config=config)
+    with StateRecorder(config_helper, opts) as database:
+        download_service = DownloadService([course], config_helper, opts, database)
+        task_classes = [task.task_class for task in download_service.all_tasks]
+
+    assert task_classes == [TaskClass.HTTP, TaskClass.YT_DLP, TaskClass.EXTERNAL, TaskClass.YT_DLP, TaskClass.LOCAL]
+
+
+def make_priority_course(course_id: int, priority: int = 0) -> Course:
+    course = Course(course_id, f'course{course_id}')
+    course.priority = priority
+    return course
+
+
+def pop_in_order(order: DownloadOrder, tasks: list) -> list:
+    "@return: The names of the tasks in the order they are started, one at a time"
+    scheduler = make_scheduler(order=order, budgets={**BUDGETS, TaskClass.HTTP: 1})
+    scheduler.add(tasks)
+    started = []
+    task = scheduler.pop_next()
+    while task is not None:
+        started.append(task.name)
+        finish(scheduler, task)
+        task = scheduler.pop_next()
+    return started
+
+
+def test_course_order_keeps_the_order_of_the_queue():
+    tasks = [FakeTask(name, MOODLE, size=size) for name, size in [('b', 30), ('a', 10), ('c', 20)]]
+    assert pop_in_order(DownloadOrder.COURSE, tasks) == ['b', 'a', 'c']
+
+
+def test_smallest_first():
+    tasks = [FakeTask(name, MOODLE, size=size) for name, size in [('big', 300), ('unknown', 0), ('small', 1)]]
+    # Files with an unknown size are estimated by their class
+    assert pop_in_order(DownloadOrder.SMALLEST_FIRST, tasks) == ['small', 'big', 'unknown']
+
+
+def test_newest_first():
+    tasks = [FakeTask(name, MOODLE, timemodified=time) for name, time in [('old', 100), ('new', 300), ('mid', 200)]]
+    assert pop_in_order(DownloadOrder.NEWEST_FIRST, tasks) == ['new', 'mid', 'old']
+
+
+def test_courses_take_turns():
+    courses = [make_priority_course(1), make_priority_course(2), make_priority_course(3)]
+    tasks = [FakeTask(f'c1-{idx}', MOODLE, course=courses[0]) for idx in range(3)]
+    tasks += [FakeTask(f'c2-{idx}', MOODLE, course=courses[1]) for idx in range(2)]
+    tasks += [FakeTask('c3-0', MOODLE, course=courses[2])]
+
+    assert pop_in_order(DownloadOrder.ROUND_ROBIN_COURSES, tasks) == ['c1-0', 'c2-0', 'c3-0', 'c1-1', 'c2-1', 'c1-2']
+
+
+def test_course_priority_comes_before_the_order():
+    low, high = make_priority_course(1, priority=-1), make_priority_course(2, priority=5)
+    tasks = [
+        FakeTask('low-small', MOODLE, course=low, size=1),
+        FakeTask('normal-small', MOODLE, course=make_priority_course(3), size=1),
+        FakeTask('high-big', MOODLE, course=high, size=300),
+        FakeTask('high-small', MOODLE, course=high, size=2),
+    ]
+
+    assert pop_in_order(DownloadOrder.SMALLEST_FIRST, tasks) == ['high-small', 'high-big', 'normal-small', 'low-small']
+
+
+def test_course_priority_applies_within_each_host():
+    # The hosts still take turns, the priority orders the queue of each host
+    low, high = make_priority_course(1, priority=0), make_priority_course(2, priority=1)
+    tasks = [
+        FakeTask('moodle-low', MOODLE, course=low),
+        FakeTask('ext-low', EXTERNAL, course=low),
+        FakeTask('moodle-high', MOODLE, course=high),
+    ]
+
+    assert pop_in_order(DownloadOrder.COURSE, tasks) == ['moodle-high', 'ext-low', 'moodle-low']
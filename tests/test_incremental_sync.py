@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from moodle_dl.database import StateRecorder
+from moodle_dl.moodle.moodle_service import MoodleService
+from moodle_dl.types import Course
+from tests.helpers import make_config, make_course
+
+
+class FakeCoreHandler:
+    def __init__(self, changed_course_ids=(), failing_course_ids=(), version: int = 2022041900):
+        self.version = version
+        self.changed_course_ids = changed_course_ids
+        self.failing_course_ids = failing_course_ids
+        self.update_requests = []
+
+    async def async_fetch_course_updates_since(self, course_id: int, since: int):
+        self.update_requests.append((course_id, since))
+        if course_id in self.failing_course_ids:
+            raise RuntimeError('Connection lost')
+        if course_id in self.changed_course_ids:
+            return [{'contextlevel': 'module', 'id': 1, 'updates': [{'name': 'configuration'}]}]
+        return []
+
+
+def split_courses(tmp_path, core_handler: FakeCoreHandler, last_syncs: dict, config: dict = None, sync_config=None):
+    """
+    Saves the last syncs of the courses and splits the courses 1 to 3 into changed and unchanged courses
+    @param sync_config: Configuration of the last syncs, by default the same as the current configuration
+    @return: The IDs of the changed and unchanged courses
+    """
+    opts, config_helper = make_config(tmp_path, config=sync_config if sync_config is not None else config)
+    with StateRecorder(config_helper, opts) as database:
+        for course_id, last_sync in last_syncs.items():
+            database.courses_synced([course_id], last_sync, MoodleService(config_helper, opts).get_sync_config_hash())
+
+    opts, config_helper = make_config(tmp_path, config=config)
+    moodle_service = MoodleService(config_helper, opts)
+    moodle_service.sync_started = int(time.time())
+    courses = [Course(course_id, f'course{course_id}') for course_id in [1, 2, 3]]
+    stored_courses = [make_course([f'https://example.org/{course_id}'], course_id) for course_id in [1, 2, 3]]
+    with StateRecorder(config_helper, opts) as database:
+        changed, unchanged = asyncio.run(
+            moodle_service.split_unchanged_courses(core_handler, database, courses, stored_courses)
+        )
+    for course in unchanged:
+        assert [file.content_fileurl for file in course.files] == [f'https://example.org/{course.id}']
+    return [course.id for course in changed], [course.id for course in unchanged]
+
+
+def test_unchanged_courses_are_not_fetched_again(tmp_path):
+    last_sync = int(time.time()) - 60 * 60
+    core_handler = FakeCoreHandler()
+
+    changed, unchanged = split_courses(tmp_path, core_handler, {1: last_sync, 2: last_sync})
+
+    # Course 3 was never synced
+    assert changed == [3]
+    assert unchanged == [1, 2]
+    # The updates are requested a bit before the last sync
+    since = last_sync - MoodleService.SYNC_TIME_MARGIN
+    assert sorted(core_handler.update_requests) == [(1, since), (2, since)]
+
+
+def test_course_with_updates_is_fetched_again(tmp_path):
+    last_sync = int(time.time()) - 60 * 60
+    core_handler = FakeCoreHandler(changed_course_ids=[2], failing_course_ids=[3])
+
+    changed, unchanged = split_courses(tmp_path, core_handler, {1: last_sync, 2: last_sync, 3: last_sync})
+
+    assert changed == [2, 3]
+    assert unchanged == [1]
+
+
+def test_changed_config_fetches_all_courses(tmp_path):
+    last_sync = int(time.time()) - 60 * 60
+    core_handler = FakeCoreHandler()
+
+    changed, unchanged = split_courses(
+        tmp_path, core_handler, {1: last_sync, 2: last_sync}, {'download_submissions': True}, sync_config={}
+    )
+
+    assert changed == [1, 2, 3]
+    assert unchanged == []
+    assert core_handler.update_requests == []
+
+
+def test_changed_token_does_not_fetch_all_courses(tmp_path):
+    last_sync = int(time.time()) - 60 * 60
+
+    changed, unchanged = split_courses(
+        tmp_path, FakeCoreHandler(), {1: last_sync}, {'token': 'new-token'}, sync_config={'token': 'old-token'}
+    )
+
+    assert changed == [2, 3]
+    assert unchanged == [1]
+
+
+def test_old_syncs_fetch_the_course_again(tmp_path):
+    now = int(time.time())
+    core_handler = FakeCoreHandler()
+
+    changed, unchanged = split_courses(
+        tmp_path, core_handler, {1: now - 3 * 60 * 60, 2: now - 60 * 60}, {'incremental_sync_max_age': 2 * 60 * 60}
+    )
+
+    assert changed == [1, 3]
+    assert unchanged == [2]
+
+
+def test_old_moodle_versions_fetch_all_courses(tmp_path):
+    last_sync = int(time.time()) - 60 * 60
+    core_handler = FakeCoreHandler(version=2016120500)
+
+    changed, unchanged = split_courses(tmp_path, core_handler, {1: last_sync, 2: last_sync})
+
+    assert changed == [1, 2, 3]
+    assert unchanged == []
+    assert core_handler.update_requests == []
+
+
+def test_courses_with_failed_downloads_are_not_synced(tmp_path):
+    opts, config_helper = make_config(tmp_path)
+    moodle_service = MoodleService(config_helper, opts)
+    moodle_service.sync_started = int(time.time())
+    moodle_service.fetched_course_ids = [1, 2, 3]
+    with StateRecorder(config_helper, opts) as database:
+        moodle_service.courses_synced(database, failed_course_ids=[2])
+        course_syncs = database.get_course_syncs()
+
+    assert sorted(course_syncs) == [1, 3]
+    assert course_syncs[1]['last_sync'] == moodle_service.sync_started
+    assert course_syncs[1]['config_hash'] == moodle_service.get_sync_config_hash()
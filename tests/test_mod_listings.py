@@ -0,0 +1,68 @@
+import asyncio
+
+from moodle_dl.moodle.mods.page import PageMod
+from moodle_dl.types import Course
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    async def async_post(self, function, data):
+        self.calls.append((function, data))
+        await asyncio.sleep(0.01)
+        course_ids = data['courseids'].values()
+        return {'pages': [{'course': course_id, 'id': course_id * 10} for course_id in course_ids], 'warnings': []}
+
+
+def make_mod(client: FakeClient) -> PageMod:
+    return PageMod(client, 2022041900, 1, {}, None)
+
+
+def test_fetches_of_single_courses_share_the_listing():
+    client = FakeClient()
+    mod = make_mod(client)
+    courses = [Course(course_id, f'course{course_id}') for course_id in (1, 2, 3)]
+    mod.list_courses_together(courses)
+
+    async def fetch_all():
+        return await asyncio.gather(
+            *[mod.fetch_entries_by_courses('mod_page_get_pages_by_courses', [course], 'pages') for course in courses]
+        )
+
+    results = asyncio.run(fetch_all())
+
+    assert len(client.calls) == 1
+    assert list(client.calls[0][1]['courseids'].values()) == [1, 2, 3]
+    assert results == [[{'course': 1, 'id': 10}], [{'course': 2, 'id': 20}], [{'course': 3, 'id': 30}]]
+
+
+def test_cancelled_fetch_does_not_cancel_the_listing():
+    client = FakeClient()
+    mod = make_mod(client)
+    courses = [Course(1, 'course1'), Course(2, 'course2')]
+    mod.list_courses_together(courses)
+
+    async def fetch_with_cancel():
+        first = asyncio.ensure_future(
+            mod.fetch_entries_by_courses('mod_page_get_pages_by_courses', [courses[0]], 'pages')
+        )
+        second = asyncio.ensure_future(
+            mod.fetch_entries_by_courses('mod_page_get_pages_by_courses', [courses[1]], 'pages')
+        )
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(fetch_with_cancel()) == [{'course': 2, 'id': 20}]
+    assert len(client.calls) == 1
+
+
+def test_without_shared_listing_every_fetch_calls_the_endpoint():
+    client = FakeClient()
+    mod = make_mod(client)
+
+    result = asyncio.run(mod.fetch_entries_by_courses('mod_page_get_pages_by_courses', [Course(1, 'course1')], 'pages'))
+
+    assert result == [{'course': 1, 'id': 10}]
+    assert len(client.calls) == 1
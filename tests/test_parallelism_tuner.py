@@ -0,0 +1,76 @@
+from moodle_dl.downloader.parallelism_tuner import ParallelismTuner
+
+MiB = 1024 * 1024
+
+
+def drive(tuner: ParallelismTuner, get_throughput, windows: int = 40) -> list:
+    "@return: The number of parallel downloads after each window"
+    history = []
+    for _ in range(windows):
+        tuner.on_window(get_throughput(tuner.parallel), saturated=True)
+        assert tuner.min_parallel <= tuner.parallel <= tuner.max_parallel
+        history.append(tuner.parallel)
+    return history
+
+
+def test_climbs_to_the_best_number_of_downloads():
+    # Every download adds throughput up to 8 downloads, then they only slow each other down
+    def get_throughput(parallel):
+        return min(parallel, 8) * MiB - max(0, parallel - 8) * MiB / 2
+
+    history = drive(ParallelismTuner(1, 20), get_throughput)
+
+    assert history[:4] == [5, 6, 7, 8]
+    # After the climb it stays around the best number
+    assert all(7 <= parallel <= 9 for parallel in history[4:])
+
+
+def test_backs_off_when_the_throughput_drops():
+    # More than two parallel downloads overload the server
+    def get_throughput(parallel):
+        return 4 * MiB if parallel <= 2 else 4 * MiB / parallel
+
+    history = drive(ParallelismTuner(1, 20), get_throughput)
+
+    assert history[:2] == [5, 4]
+    assert all(parallel <= 3 for parallel in history[4:])
+
+
+def test_plateau_prefers_fewer_downloads():
+    history = drive(ParallelismTuner(1, 20), lambda parallel: 10 * MiB)
+
+    assert history[-1] <= 2
+
+
+def test_stays_within_the_bounds():
+    tuner = ParallelismTuner(3, 6)
+    history = drive(tuner, lambda parallel: parallel * MiB)
+    assert max(history) == 6
+    assert history[-10:].count(6) >= 5
+
+    tuner = ParallelismTuner(3, 6)
+    history = drive(tuner, lambda parallel: 10 * MiB / parallel)
+    assert min(history) == 3
+    assert history[-10:].count(3) >= 5
+
+
+def test_invalid_bounds_are_corrected():
+    tuner = ParallelismTuner(8, 2)
+    assert tuner.min_parallel == tuner.max_parallel == tuner.parallel == 2
+
+    tuner = ParallelismTuner(0, 0)
+    assert tuner.min_parallel == tuner.max_parallel == tuner.parallel == 1
+
+
+def test_unsaturated_windows_are_skipped():
+    tuner = ParallelismTuner(1, 20)
+    tuner.on_window(4 * MiB, saturated=True)
+    assert tuner.parallel == 5
+
+    # The queue ran empty, so the window says nothing about the number of downloads
+    tuner.on_window(1 * MiB, saturated=False)
+    assert tuner.parallel == 5
+
+    # The next saturated window is not compared to the skipped one or the one before it
+    tuner.on_window(1 * MiB, saturated=True)
+    assert tuner.parallel == 6
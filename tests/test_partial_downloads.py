@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from moodle_dl.database import StateRecorder
+from moodle_dl.downloader.download_service import DownloadService
+from moodle_dl.utils import get_url_key
+from tests.helpers import FakeFileHost, make_config, make_course, run_downloads
+
+MiB = 1024 * 1024
+
+
+def start_host(serve, content: bytes, **kwargs) -> (FakeFileHost, str):
+    host = FakeFileHost({'big': content}, **kwargs)
+    base_url = serve({'/f/{name}': host.handle})
+    return host, f'{base_url}/f/big'
+
+
+def get_part_files(tmp_path):
+    return list((tmp_path / 'dl').rglob('*.part'))
+
+
+def get_partial_downloads(tmp_path):
+    opts, config_helper = make_config(tmp_path)
+    with StateRecorder(config_helper, opts) as database:
+        return database.get_partial_downloads()
+
+
+def assert_downloaded(download_service: DownloadService, content: bytes):
+    assert download_service.get_failed_tasks() == []
+    task = download_service.all_tasks[0]
+    with open(task.file.saved_to, 'rb') as saved_file:
+        assert saved_file.read() == content
+    assert task.file.content_hash == hashlib.sha256(content).hexdigest()
+
+
+def interrupt_download(tmp_path, serve, content: bytes) -> (FakeFileHost, str, int):
+    "Downloads a file, but the connection breaks and there is no retry budget left for this run"
+    host, url = start_host(serve, content)
+    host.break_after['big'] = 2 * MiB
+    download_service = run_downloads(tmp_path, [make_course([url])], ['-rb', '0'])
+    assert len(download_service.get_failed_tasks()) == 1
+
+    part_files = get_part_files(tmp_path)
+    assert len(part_files) == 1
+    part_size = part_files[0].stat().st_size
+    assert 0 < part_size <= 2 * MiB
+    assert content.startswith(part_files[0].read_bytes())
+    assert [partial.part_path for partial in get_partial_downloads(tmp_path).values()] == [str(part_files[0])]
+    return host, url, part_size
+
+
+def test_interrupted_download_is_continued_in_the_next_run(tmp_path, serve):
+    content = os.urandom(3 * MiB)
+    host, url, part_size = interrupt_download(tmp_path, serve, content)
+
+    download_service = run_downloads(tmp_path, [make_course([url])])
+
+    last_request = host.get_requests('big')[-1]
+    assert last_request['Range'] == f'bytes={part_size}-'
+    assert last_request['If-Range'] == FakeFileHost.get_etag(content)
+    assert_downloaded(download_service, content)
+    assert get_part_files(tmp_path) == []
+    assert get_partial_downloads(tmp_path) == {}
+
+
+def test_changed_file_is_downloaded_from_the_start(tmp_path, serve):
+    host, url, _ = interrupt_download(tmp_path, serve, os.urandom(3 * MiB))
+    new_content = os.urandom(3 * MiB)
+    host.files['big'] = new_content
+
+    download_service = run_downloads(tmp_path, [make_course([url])])
+
+    # The server ignores the range, because the validator does not match anymore, and sends the whole file
+    assert 'If-Range' in host.get_requests('big')[-1]
+    assert_downloaded(download_service, new_content)
+    assert get_part_files(tmp_path) == []
+
+
+def test_cancelled_download_keeps_the_part_file(tmp_path, serve):
+    content = os.urandom(4 * MiB)
+    host, url = start_host(serve, content, chunk_delay=0.01)
+    opts, config_helper = make_config(tmp_path)
+
+    async def cancel_download(download_service: DownloadService):
+        download_run = asyncio.ensure_future(download_service.real_run())
+        while download_service.status.bytes_downloaded < 2 * MiB:
+            await asyncio.sleep(0.01)
+        download_run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await download_run
+
+    with StateRecorder(config_helper, opts) as database:
+        download_service = DownloadService([make_course([url])], config_helper, opts, database)
+        asyncio.run(cancel_download(download_service))
+
+    part_files = get_part_files(tmp_path)
+    assert len(part_files) == 1
+    part_size = part_files[0].stat().st_size
+    assert part_size >= 2 * MiB
+    assert content.startswith(part_files[0].read_bytes())
+    # A write that was already passed to the file can finish after the cancellation, the next run uses the file size
+    assert 2 * MiB <= get_partial_downloads(tmp_path)[get_url_key(url)].bytes_received <= part_size
+
+    download_service = run_downloads(tmp_path, [make_course([url])])
+
+    assert host.get_requests('big')[-1]['Range'] == f'bytes={part_size}-'
+    assert_downloaded(download_service, content)
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from moodle_dl.moodle.request_batcher import RequestBatcher
+from moodle_dl.moodle.request_helper import RequestHelper, RequestRejectedError
+from moodle_dl.types import MoodleURL
+from tests.helpers import make_config
+
+
+class FakeClient:
+    def __init__(self, batch_error: Exception):
+        self.batch_error = batch_error
+        self.direct_calls = []
+        self.batch_timeouts = []
+
+    async def async_post_direct(self, function, data, timeout):
+        if function == RequestBatcher.BATCH_FUNCTION:
+            self.batch_timeouts.append(timeout)
+            raise self.batch_error
+        self.direct_calls.append(function)
+        return {'function': function}
+
+
+def run_calls(batcher: RequestBatcher, functions):
+    async def run():
+        return await asyncio.gather(*[batcher.call(function, {}, 60) for function in functions], return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+def test_unavailable_batch_function_falls_back_to_single_calls():
+    client = FakeClient(RequestRejectedError('Access control exception', 'accessexception'))
+    batcher = RequestBatcher(client, batch_size=3, flush_window=0.01)
+
+    results = run_calls(batcher, ['a', 'b', 'c'])
+
+    assert results == [{'function': 'a'}, {'function': 'b'}, {'function': 'c'}]
+    assert sorted(client.direct_calls) == ['a', 'b', 'c']
+    assert not batcher.available
+
+
+@pytest.mark.parametrize(
+    'batch_error',
+    [
+        RequestRejectedError('Your Moodle token has expired.', 'invalidtoken'),
+        RequestRejectedError('The Moodle Mobile API does not appear to be available at this time.'),
+    ],
+)
+def test_other_batch_errors_reach_the_callers(batch_error):
+    client = FakeClient(batch_error)
+    batcher = RequestBatcher(client, batch_size=3, flush_window=0.01)
+
+    results = run_calls(batcher, ['a', 'b', 'c'])
+
+    assert results == [batch_error] * 3
+    assert client.direct_calls == []
+    assert batcher.available
+
+
+def test_batch_timeout_does_not_grow_with_the_batch():
+    client = FakeClient(RequestRejectedError('Your Moodle token has expired.', 'invalidtoken'))
+    batcher = RequestBatcher(client, batch_size=50, flush_window=0.01)
+
+    run_calls(batcher, [f'f{idx}' for idx in range(50)])
+
+    assert client.batch_timeouts == [60 + RequestBatcher.TIMEOUT_MARGIN]
+
+
+def make_request_helper(tmp_path, args=()) -> RequestHelper:
+    opts, config_helper = make_config(tmp_path, args)
+    return RequestHelper(config_helper, opts, MoodleURL(False, 'moodle.example.org', '/'), 'token')
+
+
+def test_batching_is_off_by_default(tmp_path):
+    request_helper = make_request_helper(tmp_path)
+    request_helper.enable_batching(RequestBatcher.MIN_VERSION)
+    assert request_helper.batcher is None
+
+
+def test_old_moodle_versions_are_not_batched(tmp_path):
+    request_helper = make_request_helper(tmp_path, ['-abs', '10'])
+    request_helper.enable_batching(RequestBatcher.MIN_VERSION - 1)
+    assert request_helper.batcher is None
+
+    request_helper.enable_batching(RequestBatcher.MIN_VERSION)
+    assert request_helper.batcher is not None
+    assert request_helper.batcher.batch_size == 10
+
+
+def test_calls_to_old_moodle_versions_are_sent_directly(tmp_path, monkeypatch):
+    request_helper = make_request_helper(tmp_path, ['-abs', '10'])
+    request_helper.enable_batching(RequestBatcher.MIN_VERSION - 1)
+    sent = []
+
+    async def fake_post_direct(function, data=None, timeout=60):
+        sent.append(function)
+        return {'function': function}
+
+    monkeypatch.setattr(request_helper, 'async_post_direct', fake_post_direct)
+
+    async def run():
+        return await asyncio.gather(*[request_helper.async_post(function) for function in ['a', 'b']])
+
+    assert asyncio.run(run()) == [{'function': 'a'}, {'function': 'b'}]
+    assert sent == ['a', 'b']
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+from aiohttp import web
+
+from moodle_dl.moodle.request_helper import RequestHelper
+from moodle_dl.types import MoodleURL
+from moodle_dl.utils import RetryPolicy
+from tests.helpers import make_config, make_course, run_downloads
+
+
+def test_parse_retry_after():
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after(' 7 ') == 7.0
+    assert RetryPolicy.parse_retry_after('soon') is None
+    assert 25 < RetryPolicy.parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    # A date in the past means no waiting
+    assert RetryPolicy.parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+@pytest.mark.parametrize('attempt', [1, 2, 3, 6, 10])
+def test_full_jitter_stays_within_the_exponential_bound(attempt):
+    policy = RetryPolicy(base_delay=0.5, max_delay=10, budget=10)
+    bound = min(10, 0.5 * 2 ** (attempt - 1))
+    delays = [policy.get_delay(attempt) for _ in range(1000)]
+    assert all(0 <= delay <= bound for delay in delays)
+    # Randomized over the whole range, not a fixed delay
+    assert min(delays) < bound / 4 and max(delays) > bound * 3 / 4
+
+
+def test_retry_after_is_honored_but_capped():
+    policy = RetryPolicy(base_delay=0.5, max_delay=10, budget=10)
+    assert all(3 <= policy.get_delay(1, '3') <= 3.5 for _ in range(100))
+    assert all(10 <= policy.get_delay(1, '3600') <= 10.5 for _ in range(100))
+
+
+def test_budget_runs_out_and_is_earned_back():
+    policy = RetryPolicy(base_delay=0, max_delay=0, budget=2)
+    url = 'https://files.example.com/a.pdf'
+    assert policy.next_delay(url, 1) is not None
+    assert policy.next_delay(url, 1) is not None
+    assert policy.next_delay(url, 1) is None
+    # Other hosts have their own budget
+    assert policy.next_delay('https://moodle.example.com/b.pdf', 1) is not None
+
+    for _ in range(9):
+        policy.record_success(url)
+    assert policy.next_delay(url, 1) is None
+    policy.record_success(url)
+    assert policy.next_delay(url, 1) is not None
+
+    # Never more than the budget
+    for _ in range(100):
+        policy.record_success(url)
+    assert policy.tokens['files.example.com'] == pytest.approx(2.0)
+
+
+def throttling_server(serve, throttled_requests: int, retry_after: str = '1'):
+    """
+    Starts a server that answers the first requests of each path with 429 and a Retry-After header
+    @return: The base URL and the request times of each path
+    """
+    request_times = {}
+
+    async def handler(request):
+        times = request_times.setdefault(request.path, [])
+        if request.headers.get('Range') == 'bytes=0-4':
+            # Check of the download task, if the download could be continued
+            return web.Response(status=429, headers={'Retry-After': retry_after})
+        times.append(time.monotonic())
+        if len(times) <= throttled_requests:
+            return web.Response(status=429, headers={'Retry-After': retry_after})
+        if request.path.startswith('/webservice/'):
+            return web.json_response({'result': 'ok'})
+        return web.Response(body=b'x' * 1000)
+
+    base_url = serve({'/{path:.*}': handler})
+    return base_url, request_times
+
+
+def make_request_helper(tmp_path, base_url: str, args=()) -> RequestHelper:
+    opts, config_helper = make_config(tmp_path, ['-rbd', '0.01', *args])
+    moodle_url = MoodleURL(True, base_url[len('http://') :], '/')
+    return RequestHelper(config_helper, opts, moodle_url, 'token')
+
+
+def assert_waited(times, seconds: float):
+    assert all(later - earlier >= seconds for earlier, later in zip(times, times[1:]))
+
+
+def test_async_post_waits_for_retry_after(tmp_path, serve):
+    base_url, request_times = throttling_server(serve, throttled_requests=1)
+    request_helper = make_request_helper(tmp_path, base_url)
+
+    async def post():
+        try:
+            return await request_helper.async_post('core_webservice_get_site_info')
+        finally:
+            await request_helper.close()
+
+    assert asyncio.run(post()) == {'result': 'ok'}
+    times = request_times['/webservice/rest/server.php']
+    assert len(times) == 2
+    assert_waited(times, 1)
+
+
+def test_post_waits_for_retry_after(tmp_path, serve):
+    base_url, request_times = throttling_server(serve, throttled_requests=1)
+    request_helper = make_request_helper(tmp_path, base_url)
+
+    assert request_helper.post('core_webservice_get_site_info') == {'result': 'ok'}
+    times = request_times['/webservice/rest/server.php']
+    assert len(times) == 2
+    assert_waited(times, 1)
+
+
+def test_download_waits_for_retry_after(tmp_path, serve):
+    base_url, request_times = throttling_server(serve, throttled_requests=2)
+    course = make_course([f'{base_url}/f/{idx}' for idx in range(3)])
+    download_service = run_downloads(tmp_path, [course], ['-rbd', '0.01'])
+
+    assert download_service.get_failed_tasks() == []
+    for idx in range(3):
+        times = request_times[f'/f/{idx}']
+        assert len(times) == 3
+        assert_waited(times, 1)
+
+
+def test_used_up_budget_stops_the_retries(tmp_path, serve):
+    base_url, request_times = throttling_server(serve, throttled_requests=100, retry_after='0')
+    request_helper = make_request_helper(tmp_path, base_url, ['-rb', '2'])
+
+    async def post():
+        try:
+            return await request_helper.async_post('core_webservice_get_site_info')
+        finally:
+            await request_helper.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(post())
+    # The first try and the two retries of the budget
+    assert len(request_times['/webservice/rest/server.php']) == 3
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(post())
+    # Requests to a host without budget are not retried anymore
+    assert len(request_times['/webservice/rest/server.php']) == 4
@@ -0,0 +1,78 @@
+import hashlib
+import os
+
+from moodle_dl.downloader.segmented_downloads import SegmentedDownloads
+from tests.helpers import FakeFileHost, make_config, make_course, run_downloads
+
+MiB = 1024 * 1024
+SEGMENT_ARGS = ['-ds', '4', '-sdms', str(MiB), '-rbd', '0.01']
+
+
+def test_ranges_cover_the_file_without_gaps(tmp_path):
+    opts, _ = make_config(tmp_path, ['-ds', '4'])
+    segmented_downloads = SegmentedDownloads(opts)
+    for total_size in [1, 3, 4, 5, 1000, 1001, 4 * MiB + 3]:
+        ranges = segmented_downloads.get_ranges(total_size)
+        assert 1 <= len(ranges) <= 4
+        assert ranges[0][0] == 0 and ranges[-1][1] == total_size - 1
+        assert all(last + 1 == first for (_, last), (first, _) in zip(ranges, ranges[1:]))
+
+
+def download_big_file(tmp_path, serve, content: bytes, accept_ranges: bool = True, broken_ranges: int = 0):
+    host = FakeFileHost({'big': content}, accept_ranges=accept_ranges)
+    host.break_ranges['big'] = broken_ranges
+    base_url = serve({'/f/{name}': host.handle})
+    course = make_course([f'{base_url}/f/big'])
+    course.files[0].content_filesize = len(content)
+    download_service = run_downloads(tmp_path, [course], SEGMENT_ARGS)
+
+    assert download_service.get_failed_tasks() == []
+    task = download_service.all_tasks[0]
+    with open(task.file.saved_to, 'rb') as saved_file:
+        assert saved_file.read() == content
+    assert task.file.content_size == len(content)
+    assert task.file.content_hash == hashlib.sha256(content).hexdigest()
+    assert list((tmp_path / 'dl').rglob('*.part')) == []
+    return host.get_requests('big')
+
+
+def get_ranges(requests):
+    return sorted(headers['Range'] for headers in requests if 'Range' in headers)
+
+
+def test_file_is_downloaded_in_segments(tmp_path, serve):
+    content = os.urandom(4 * MiB + 3)
+    requests = download_big_file(tmp_path, serve, content)
+
+    segment_size = MiB + 1
+    expected_ranges = [
+        f'bytes={start}-{min(start + segment_size, len(content)) - 1}' for start in range(0, len(content), segment_size)
+    ]
+    # The first request checks if the server sends byte ranges
+    assert get_ranges(requests) == sorted(['bytes=0-0'] + expected_ranges)
+
+
+def test_server_without_ranges_gets_a_normal_download(tmp_path, serve):
+    content = os.urandom(2 * MiB)
+    requests = download_big_file(tmp_path, serve, content, accept_ranges=False)
+
+    assert get_ranges(requests) == ['bytes=0-0']
+    assert len(requests) == 2
+
+
+def test_failed_segments_continue_where_they_broke(tmp_path, serve):
+    content = os.urandom(4 * MiB)
+    requests = download_big_file(tmp_path, serve, content, broken_ranges=4)
+
+    # Every segment broke once and was requested again from the position it got to
+    segments = {}
+    for value in get_ranges(requests):
+        first, last = (int(position) for position in value[len('bytes=') :].split('-'))
+        segments.setdefault(last, []).append(first)
+    assert segments.pop(0) == [0]  # the check if the server sends byte ranges
+    assert len(segments) == 4
+    for last, firsts in segments.items():
+        segment_start = last + 1 - MiB
+        assert len(firsts) == 2
+        assert min(firsts) == segment_start
+        assert segment_start <= max(firsts) <= segment_start + MiB // 2
@@ -0,0 +1,55 @@
+import asyncio
+
+from aiohttp import web
+
+from moodle_dl.downloader.session_pool import SessionPool
+from tests.helpers import make_config
+
+COOKIES_TEXT = '''# Netscape HTTP Cookie File
+127.0.0.1\tFALSE\t/\tFALSE\t0\tMoodleSession\tsecret
+.example.org\tTRUE\t/\tFALSE\t0\tshared\tvalue
+'''
+
+
+def start_cookie_echo(serve) -> (str, str):
+    "@return: The URL of the server by its IP and by its name, the server answers with the cookies it got"
+
+    async def echo(request):
+        return web.json_response(dict(request.cookies))
+
+    async def redirect(request):
+        raise web.HTTPFound(request.query['to'])
+
+    ip_url = serve({'/f/{name}': echo, '/redirect': redirect})
+    return ip_url, ip_url.replace('127.0.0.1', 'localhost')
+
+
+def get_cookies(tmp_path, urls):
+    "@return: The cookies the server got for each URL, using the sessions of the pool with cookies"
+    opts, _ = make_config(tmp_path)
+
+    async def run():
+        session_pool = SessionPool(opts, COOKIES_TEXT)
+        try:
+            results = []
+            for url in urls:
+                async with session_pool.get_session(url, with_cookies=True).get(url) as response:
+                    results.append(await response.json())
+            return results
+        finally:
+            await session_pool.close()
+
+    return asyncio.run(run())
+
+
+def test_cookies_are_only_sent_to_their_host(tmp_path, serve):
+    ip_url, name_url = start_cookie_echo(serve)
+
+    assert get_cookies(tmp_path, [f'{ip_url}/f/a', f'{name_url}/f/a']) == [{'MoodleSession': 'secret'}, {}]
+
+
+def test_cookies_are_not_sent_after_a_redirect_to_another_host(tmp_path, serve):
+    ip_url, name_url = start_cookie_echo(serve)
+
+    assert get_cookies(tmp_path, [f'{ip_url}/redirect?to={name_url}/f/a']) == [{}]
+    assert get_cookies(tmp_path, [f'{ip_url}/redirect?to={ip_url}/f/a']) == [{'MoodleSession': 'secret'}]
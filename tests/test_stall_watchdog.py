@@ -0,0 +1,62 @@
+import asyncio
+
+from aiohttp import web
+
+from moodle_dl.downloader.stall_watchdog import StallWatchdog
+from moodle_dl.types import TaskStatus
+from tests.helpers import make_course, run_downloads
+
+
+class FakeTask:
+    def __init__(self, task_id: int):
+        self.task_id = task_id
+        self.status = TaskStatus()
+
+
+def test_task_without_transfer_never_stalls():
+    # Like a task that waits for a free connection of the host
+    watchdog = StallWatchdog(min_speed=1024, window=10)
+    waiting = FakeTask(1)
+    for now in range(0, 100, 5):
+        assert watchdog.find_stalled([waiting], now) == []
+
+
+def test_window_starts_with_the_transfer():
+    watchdog = StallWatchdog(min_speed=1024, window=10)
+    task = FakeTask(1)
+    assert watchdog.find_stalled([task], 0) == []
+    assert watchdog.find_stalled([task], 50) == []
+
+    task.status.open_transfers = 1
+    assert watchdog.find_stalled([task], 55) == []
+    assert watchdog.find_stalled([task], 60) == []
+    assert watchdog.find_stalled([task], 65) == [task]
+
+
+def test_fast_transfer_does_not_stall():
+    watchdog = StallWatchdog(min_speed=1024, window=10)
+    task = FakeTask(1)
+    task.status.open_transfers = 1
+    for now in range(0, 100, 5):
+        assert watchdog.find_stalled([task], now) == []
+        task.status.bytes_downloaded += 100 * 1024
+
+
+def test_queued_downloads_are_not_cancelled(tmp_path, serve, monkeypatch):
+    # With one connection to the host, the other downloads wait longer than the stall window for it
+    monkeypatch.setattr(StallWatchdog, 'CHECK_INTERVAL', 0.2)
+
+    async def slow_but_healthy(request):
+        response = web.StreamResponse(headers={'Content-Length': str(16 * 1024)})
+        await response.prepare(request)
+        for _ in range(16):
+            await response.write(b'x' * 1024)
+            await asyncio.sleep(0.1)
+        return response
+
+    base_url = serve({'/f/{name}': slow_but_healthy})
+    course = make_course([f'{base_url}/f/{idx}' for idx in range(4)])
+    download_service = run_downloads(tmp_path, [course], ['-mpd', '4', '-mcph', '1', '-st', '1', '-mds', '1024'])
+
+    assert download_service.get_failed_tasks() == []
+    assert all(task.status.restarts == 0 for task in download_service.all_tasks)
@@ -0,0 +1,19 @@
+import sqlite3
+
+from moodle_dl.database import StateRecorder
+from moodle_dl.types import File
+from tests.helpers import make_config
+
+
+def test_context_manager_saves_pending_writes(tmp_path):
+    opts, config_helper = make_config(tmp_path)
+    with StateRecorder(config_helper, opts) as database:
+        file = File(0, 'sec', 0, 'mod', '/', 'a.pdf', 'https://example.org/a.pdf', 1, 0, 'resource', 'file', False)
+        database.new_file(file, 1, 'course')
+        assert database.pending_writes == 1
+
+    conn = sqlite3.connect(database.db_file)
+    try:
+        assert conn.execute('SELECT content_filename FROM files').fetchall() == [('a.pdf',)]
+    finally:
+        conn.close()
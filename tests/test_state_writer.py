@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from moodle_dl.database import StateWriter
+from moodle_dl.types import File
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.pending_writes = 0
+        self.saved = []
+
+    def save_file(self, file: File, course_id: int, course_fullname: str):
+        self.saved.append((file.content_filename, file.time_stamp))
+
+    def flush(self):
+        pass
+
+
+def make_file(name: str) -> File:
+    return File(0, 'sec', 0, 'mod', '/', name, f'https://example.org/{name}', 0, 0, 'resource', 'file', False)
+
+
+def test_saves_the_file_as_it_was_when_queued():
+    database = FakeDatabase()
+    writer = StateWriter(database)
+    file = make_file('a.bin')
+    file.time_stamp = 1
+    writer.save_file(file, 1, 'course')
+    file.time_stamp = 2
+
+    writer.start()
+    writer.stop()
+
+    assert database.saved == [('a.bin', 1)]
+
+
+def test_full_queue_does_not_block(monkeypatch):
+    monkeypatch.setattr(StateWriter, 'MAX_QUEUED', 2)
+    database = FakeDatabase()
+    writer = StateWriter(database)
+    names = [f'{idx}.bin' for idx in range(10)]
+
+    # The writer is not running yet, so all but the first changes overflow the queue
+    for name in names:
+        writer.save_file(make_file(name), 1, 'course')
+    writer.start()
+    writer.stop()
+
+    assert [name for name, _ in database.saved] == names
+    assert writer.changes_saved == len(names)
+
+
+class SlowDatabase(FakeDatabase):
+    "Commits slowly in batches of two changes, like a database on a slow disk"
+
+    def __init__(self):
+        super().__init__()
+        self.committed = []
+
+    def save_file(self, file: File, course_id: int, course_fullname: str):
+        super().save_file(file, course_id, course_fullname)
+        self.pending_writes += 1
+        if self.pending_writes >= 2:
+            self.flush()
+
+    def flush(self):
+        time.sleep(0.02)
+        self.committed = list(self.saved)
+        self.pending_writes = 0
+
+
+def test_full_writer_holds_back_the_producer(monkeypatch):
+    monkeypatch.setattr(StateWriter, 'MAX_QUEUED', 2)
+    database = SlowDatabase()
+    writer = StateWriter(database)
+    names = [f'{idx}.bin' for idx in range(20)]
+    peak_unsaved = 0
+
+    async def produce():
+        nonlocal peak_unsaved
+        for name in names:
+            # Like the download loop, which does not start more downloads while the writer is full
+            if writer.is_full():
+                await writer.wait_for_room()
+            writer.save_file(make_file(name), 1, 'course')
+            peak_unsaved = max(peak_unsaved, writer.changes_queued - writer.changes_saved)
+
+    writer.start()
+    try:
+        asyncio.run(produce())
+    finally:
+        writer.stop()
+
+    # Queued changes, the one the writer is saving and the uncommitted change of its batch
+    assert peak_unsaved <= StateWriter.MAX_QUEUED + 2
+    assert len(writer.overflow) == 0
+    assert [name for name, _ in database.committed] == names
+
+
+def test_flush_waits_until_the_changes_are_committed():
+    database = SlowDatabase()
+    writer = StateWriter(database)
+    writer.start()
+
+    async def save_and_flush():
+        number = writer.save_file(make_file('a.bin'), 1, 'course')
+        await writer.flush()
+        return number
+
+    try:
+        number = asyncio.run(save_and_flush())
+        # A single change does not fill a batch, the flush committed it
+        assert [name for name, _ in database.committed] == ['a.bin']
+        assert writer.changes_saved == number == 1
+        assert writer.wait_saved(number, timeout=0)
+    finally:
+        writer.stop()